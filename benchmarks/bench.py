@@ -0,0 +1,168 @@
+"""
+Measure throughput and latency percentiles for Humorbot commands and GIF
+editor actions, against the local stub API with optional injected latency
+and errors. Results are written as JSON so they can be compared between
+releases.
+
+    PYTHONPATH=. python benchmarks/bench.py [--requests 200] [--concurrency 8] [--latency 0.02] [--cold]
+                                            [--output results.json]
+
+With --cold, every cache is cleared before each call, so it is best used
+with --concurrency 1.
+"""
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+from concurrent.futures import ThreadPoolExecutor
+from humorbot.backend import default_config
+from humorbot.bot import Humorbot
+from humorbot.metrics import percentiles
+from humorbot.stub import StubServer, load_fixtures, synthetic_episodes
+
+COMMANDS = ['image', 'images', 'gif', 'gifs']
+ACTIONS = ['edit', 'start', 'end', 'send']
+
+
+def summarise(times, errors, elapsed):
+    times = sorted(times)
+    res = {
+        'requests': len(times) + errors,
+        'errors': errors,
+        'throughput': round((len(times) + errors) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(sum(times) / len(times) * 1000, 3) if times else None,
+        'max_ms': round(times[-1] * 1000, 3) if times else None
+    }
+    for name, value in percentiles(times).items():
+        res[name + '_ms'] = round(value * 1000, 3) if value is not None else None
+    return res
+
+
+def run(func, calls, concurrency, before=None):
+    """
+    Call `func(arg)` for each of `calls`, `concurrency` at a time, and
+    summarise the latencies.
+    """
+    def timed(arg):
+        if before:
+            before()
+        start = time.time()
+        try:
+            func(arg)
+        except Exception:
+            return None
+        return time.time() - start
+
+    start = time.time()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(timed, calls))
+    elapsed = time.time() - start
+    times = [t for t in results if t is not None]
+    return summarise(times, len(results) - len(times), elapsed)
+
+
+def queries(episodes, count, seed=0):
+    """
+    Pick search queries that match subtitles in the episode data.
+    """
+    rnd = random.Random(seed)
+    subs = [s['Content'] for ep in episodes.values() for s in ep['subtitles']]
+    res = []
+    for i in range(count):
+        words = rnd.choice(subs).split()
+        start = rnd.randint(0, max(0, len(words) - 2))
+        res.append(' '.join(words[start:start + 2]))
+    return res
+
+
+def click(res, attachment, name):
+    action = [a for a in res['attachments'][attachment]['actions'] if a['name'] == name][0]
+    return {'actions': [action], 'user': {'name': 'bench'}, 'team': {'domain': 'bench'}}
+
+
+def action_payloads(hb, action, qs):
+    """
+    Build button payloads for an action from real GIF and editor responses.
+    """
+    res = []
+    for q in qs:
+        gif = hb.gif('bench', q)
+        if 'actions' not in gif['attachments'][0]:
+            continue
+        if action == 'edit':
+            res.append(click(gif, 0, 'edit'))
+            continue
+        editor = hb.process_action(click(gif, 0, 'edit'))
+        if action == 'send':
+            res.append(click(editor, 0, 'send'))
+        elif len(editor['attachments']) > 2:
+            res.append(click(editor, len(editor['attachments']) // 2, action))
+    return res
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Humorbot against a stub API')
+    parser.add_argument('--requests', type=int, default=200, help='calls per command or action')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--episodes', type=int, default=20, help='number of synthetic episodes')
+    parser.add_argument('--fixtures', help='JSON fixture file to serve instead of synthetic episodes')
+    parser.add_argument('--latency', type=float, default=0.02, help='injected API latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01, help='extra random API latency in seconds')
+    parser.add_argument('--tail-rate', type=float, default=0.01, help='fraction of slow API requests')
+    parser.add_argument('--tail-latency', type=float, default=0.25, help='latency of slow API requests in seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of API requests that fail')
+    parser.add_argument('--cold', action='store_true', help='clear caches before every call')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results to this file as well as stdout')
+    args = parser.parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    episodes = load_fixtures(args.fixtures) if args.fixtures else synthetic_episodes(args.episodes, seed=args.seed)
+    stub = StubServer(episodes, latency=args.latency, jitter=args.jitter, tail_rate=args.tail_rate,
+                      tail_latency=args.tail_latency, error_rate=args.error_rate, seed=args.seed).start()
+    config = default_config()
+    config.morbo_api_url = stub.url
+    config.frink_api_url = stub.url
+    hb = Humorbot(config)
+
+    def clear():
+        hb.morbo.clear_caches()
+        hb.frink.clear_caches()
+
+    qs = queries(episodes, args.requests, args.seed)
+    data = {'user_name': 'bench', 'team_domain': 'bench'}
+    results = {}
+    for command in COMMANDS:
+        if not args.cold:
+            for q in set(qs):
+                hb.process_command('morbo', dict(data, text='{} {}'.format(command, q)))
+        calls = [dict(data, text='{} {}'.format(command, q)) for q in qs]
+        results[command] = run(lambda d: hb.process_command('morbo', d), calls, args.concurrency,
+                               clear if args.cold else None)
+
+    # Build the button payloads without injected faults so none go missing
+    stub.latency = stub.jitter = stub.tail_rate = stub.error_rate = 0
+    for action in ACTIONS:
+        payloads = action_payloads(hb, action, qs)
+        results[action] = run(hb.process_action, payloads, args.concurrency)
+    stub.stop()
+
+    output = {
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'settings': vars(args),
+        'api_requests': stub.requests,
+        'results': results
+    }
+    text = json.dumps(output, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
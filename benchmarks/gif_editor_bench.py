@@ -0,0 +1,54 @@
+"""
+Measure GIF editor message size and build time against the number of context
+frames, with every frame shown. `legacy_bytes` estimates the size of the same
+message when every button carried the whole editor state, as it did before
+session state. `sampled_bytes` is the size with the default
+`gif_editor_frames` sample instead of every frame.
+
+    PYTHONPATH=. python benchmarks/gif_editor_bench.py
+"""
+import json
+import time
+from humorbot.bot import Humorbot
+from humorbot.backend import default_config
+
+FRAME_COUNTS = [10, 20, 40, 80, 160]
+RUNS = 20
+
+
+def edit_payload(hb, data):
+    context = data['context']
+    value = json.dumps({'state': hb.state.put(data), 'start': context[0], 'end': context[-1], 'show_text': True})
+    return value, {'actions': [{'name': 'edit', 'value': value}]}
+
+
+def main():
+    config = default_config()
+    config.gif_editor_frames = 0
+    hb = Humorbot(config)
+    sampled = Humorbot()
+    results = []
+    for n in FRAME_COUNTS:
+        context = list(range(100000, 100000 + n * 209, 209))
+        data = {'args': 'gif do the hustle', 'text': 'Do the hustle', 'episode': 'S05E02', 'context': context,
+                'command': 'morbo'}
+        value, payload = edit_payload(hb, data)
+        start = time.time()
+        for i in range(RUNS):
+            res = hb.update_gif(payload)
+        elapsed = (time.time() - start) / RUNS
+        legacy_value = json.dumps(dict(data, start=context[0], end=context[-1], show_text=True))
+        size = len(json.dumps(res))
+        buttons = sum(len(a.get('actions', [])) for a in res['attachments'])
+        results.append({
+            'frames': n,
+            'bytes': size,
+            'legacy_bytes': size + buttons * (len(legacy_value) - len(value)),
+            'sampled_bytes': len(json.dumps(sampled.update_gif(edit_payload(sampled, data)[1]))),
+            'build_ms': round(elapsed * 1000, 3)
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Compare API call latency with and without hedged requests, against the
+stub API with a slow tail: most calls take `latency`, but `tail_rate` of
+them take `tail_latency` instead.
+
+Extra load is the number of upstream requests the stub served beyond one
+per call.
+
+    PYTHONPATH=. python benchmarks/hedge_bench.py [calls] [tail_rate]
+"""
+import sys
+import time
+import json
+from humorbot.backend import Morbotron, default_config
+from humorbot.metrics import percentiles
+from humorbot.stub import StubServer
+
+LATENCY = 0.01
+TAIL_LATENCY = 0.3
+
+
+def run(url, calls, hedge):
+    config = default_config()
+    config.morbo_api_url = url
+    config.hedge_requests = hedge
+    backend = Morbotron(config=config)
+    query = backend.search_url('do the hustle')
+    times = []
+    for i in range(calls):
+        start = time.time()
+        backend.get(query, 'search')
+        times.append(time.time() - start)
+    res = {k + '_ms': round(v * 1000, 2) for k, v in percentiles(times).items()}
+    if backend.hedger:
+        res.update({k: v for k, v in backend.hedger.stats.items() if k != 'calls'})
+    return res
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    tail_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 0.03
+    results = {}
+    for name, hedge in [('plain', False), ('hedged', True)]:
+        stub = StubServer(latency=LATENCY, tail_rate=tail_rate, tail_latency=TAIL_LATENCY, seed=0).start()
+        results[name] = run(stub.url, calls, hedge)
+        results[name]['extra_load'] = round(float(stub.requests - calls) / calls, 4)
+        stub.stop()
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
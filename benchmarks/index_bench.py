@@ -0,0 +1,69 @@
+"""
+Measure building, loading and querying a local subtitle index built from
+synthetic episodes.
+
+    PYTHONPATH=. python benchmarks/index_bench.py [episodes] [queries]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+from humorbot.index import build_index, SubtitleIndex
+from humorbot.metrics import percentiles
+from humorbot.stub import synthetic_episodes
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    queries = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    episodes = synthetic_episodes(count)
+    records = [dict(s, Episode=k) for k, ep in episodes.items() for s in ep['subtitles']]
+    rnd = random.Random(0)
+    qs = []
+    for i in range(queries):
+        words = rnd.choice(records)['Content'].split()
+        start = rnd.randint(0, max(0, len(words) - 2))
+        qs.append(u' '.join(words[start:start + rnd.randint(1, 4)]))
+
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'index')
+        start = time.time()
+        build_index(records, path)
+        build_time = time.time() - start
+        size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+        start = time.time()
+        index = SubtitleIndex(path)
+        load_time = time.time() - start
+
+        times = []
+        confident = 0
+        for q in qs:
+            start = time.time()
+            res, confidence = index.search(q)
+            times.append(time.time() - start)
+            confident += confidence == 1
+        index.close()
+    finally:
+        shutil.rmtree(tmp)
+
+    res = {
+        'episodes': count,
+        'subtitles': len(records),
+        'build_s': round(build_time, 3),
+        'bytes': size,
+        'load_ms': round(load_time * 1000, 3),
+        'queries': queries,
+        'phrase_matches': confident,
+        'mean_query_us': round(sum(times) / len(times) * 1e6, 2)
+    }
+    res.update({k + '_query_us': round(v * 1e6, 2) for k, v in percentiles(times).items()})
+    print(json.dumps(res, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
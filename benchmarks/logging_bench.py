@@ -0,0 +1,93 @@
+"""
+Measure the time a request spends logging, the old way (payloads formatted
+eagerly, records written synchronously to the stream) and through the
+background event log, with debug logging off and on.
+
+Each simulated request logs a slash command payload, the command line, and
+a GIF editor response of about 30KB, to a stream that takes `write_ms` per
+write, as a busy terminal or log drain might.
+
+    PYTHONPATH=. python benchmarks/logging_bench.py [requests] [write_ms]
+"""
+import sys
+import json
+import time
+import logging
+from humorbot.logs import EventLog, BackgroundLogging
+from humorbot.metrics import percentiles
+
+DATA = {'token': 'SLACK_TOKEN', 'command': '/morbo', 'text': 'gif do the hustle', 'user_name': 'bench',
+        'team_domain': 'bench', 'response_url': 'https://hooks.slack.com/commands/T000/B000/XXXX'}
+RESPONSE = {'attachments': [{'callback_id': 'gif', 'title': 'frame {}'.format(i),
+                             'image_url': 'https://morbotron.com/img/S05E02/{}/medium.jpg'.format(155870 + i * 42),
+                             'actions': [{'name': n, 'text': n, 'type': 'button', 'value': json.dumps(
+                                 {'episode': 'S05E02', 'start': 155870, 'end': 157870 + i, 'zoom': i})}
+                                 for n in ['Start', 'End', 'Zoom']]} for i in range(60)]}
+
+
+class SlowStream(object):
+    def __init__(self, delay):
+        self.delay = delay
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        time.sleep(self.delay)
+
+    def flush(self):
+        pass
+
+
+def old_request(log):
+    log.debug("Got request: {}".format(DATA))
+    log.info(u"command={}, username={}, team_domain={}, text={}".format(DATA['command'], DATA['user_name'],
+                                                                        DATA['team_domain'], DATA['text']))
+    log.debug("Returning response: {}".format(RESPONSE))
+
+
+def new_request(log, events):
+    events.debug('request', "Got request", DATA)
+    log.info(u"command=%s, username=%s, team_domain=%s, text=%s", DATA['command'], DATA['user_name'],
+             DATA['team_domain'], DATA['text'])
+    events.debug('response', "Returning response", RESPONSE)
+
+
+def run(requests, write_ms, debug, background):
+    log = logging.getLogger('logging_bench')
+    log.propagate = False
+    log.setLevel(logging.DEBUG if debug else logging.INFO)
+    stream = SlowStream(write_ms / 1000.0)
+    writer = None
+    if background:
+        writer = BackgroundLogging(stream, max_queued=requests * 3)
+        handler = writer.handler
+    else:
+        handler = logging.StreamHandler(stream)
+    log.handlers = [handler]
+    events = EventLog(log)
+    times = []
+    for i in range(requests):
+        start = time.time()
+        new_request(log, events) if background else old_request(log)
+        times.append(time.time() - start)
+    if writer:
+        writer.handler.stop()
+    res = {k + '_us': round(v * 1000000, 1) for k, v in percentiles(times).items()}
+    res.update({'mean_us': round(sum(times) / len(times) * 1000000, 1), 'writes': stream.writes})
+    return res
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    write_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    results = {}
+    for debug in [False, True]:
+        before = run(requests, write_ms, debug, False)
+        after = run(requests, write_ms, debug, True)
+        results['debug' if debug else 'info'] = {'before': before, 'after': after,
+                                                 'speedup': round(before['mean_us'] / after['mean_us'], 1)}
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Compare caption matching with `fuzzywuzzy.process.extract` against the
+CaptionMatcher, over subtitles and queries drawn from synthetic episodes,
+and check both pick the same caption every time.
+
+Each simulated `images` command matches one query against the caption
+groups of 10 nearby frames, which share most of their subtitles.
+
+    PYTHONPATH=. python benchmarks/matcher_bench.py [commands]
+"""
+import sys
+import json
+import time
+import random
+from fuzzywuzzy import process
+from humorbot.matcher import CaptionMatcher
+from humorbot.stub import synthetic_episodes
+
+FRAMES = 10
+GROUP_SIZE = 5
+
+
+def lookups(episodes, commands, seed=0):
+    """
+    Build (query, captions) pairs for a number of `images` commands.
+    """
+    rnd = random.Random(seed)
+    subs = [[s['Content'] for s in ep['subtitles']] for ep in episodes.values()]
+    res = []
+    for i in range(commands):
+        ep = rnd.choice(subs)
+        n = rnd.randint(GROUP_SIZE, len(ep) - FRAMES - GROUP_SIZE)
+        words = ep[n].split()
+        start = rnd.randint(0, max(0, len(words) - 3))
+        query = u' '.join(words[start:start + rnd.randint(1, 4)]).lower()
+        for j in range(FRAMES):
+            offset = n - GROUP_SIZE + j // 2
+            res.append((query, ep[offset:offset + rnd.randint(1, GROUP_SIZE)]))
+    return res
+
+
+def main():
+    commands = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    cases = lookups(synthetic_episodes(20), commands)
+
+    start = time.time()
+    expected = [process.extract(q, g, limit=1)[0][0] for q, g in cases]
+    extract_time = time.time() - start
+
+    matcher = CaptionMatcher()
+    start = time.time()
+    first = [matcher.best(q, g) for q, g in cases]
+    first_time = time.time() - start
+    start = time.time()
+    repeat = [matcher.best(q, g) for q, g in cases]
+    repeat_time = time.time() - start
+
+    print(json.dumps({
+        'lookups': len(cases),
+        'mean_choices': round(float(sum(len(g) for q, g in cases)) / len(cases), 2),
+        'extract_us': round(extract_time / len(cases) * 1e6, 2),
+        'matcher_us': round(first_time / len(cases) * 1e6, 2),
+        'matcher_repeat_us': round(repeat_time / len(cases) * 1e6, 2),
+        'same_choice': first == expected and repeat == expected,
+        'stats': matcher.stats
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
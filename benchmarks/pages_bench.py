@@ -0,0 +1,53 @@
+"""
+Compare requests per second for the static pages rendered on every request
+against the in-memory page cache, calling the WSGI app directly so the test
+client's overhead doesn't drown out the difference.
+
+Cached runs send the Accept-Encoding of a typical browser, and also time
+revalidation with If-None-Match, which gets a 304.
+
+    PYTHONPATH=. python benchmarks/pages_bench.py [requests]
+"""
+import sys
+import json
+import time
+from werkzeug.test import EnvironBuilder
+from humorbot import app
+from humorbot.backend import default_config
+
+PATHS = ['/', '/usage', '/privacy', '/favicon.ico']
+BROWSER = {'Accept-Encoding': 'gzip, deflate, br'}
+
+
+def run(path, requests, headers):
+    environ = EnvironBuilder(path=path, headers=headers).get_environ()
+    status = []
+
+    def start_response(s, headers, exc_info=None):
+        status[:] = [int(s.split()[0])]
+    start = time.time()
+    for i in range(requests):
+        body = b''.join(app.app(dict(environ), start_response))
+    elapsed = time.time() - start
+    return {'rps': round(requests / elapsed, 1), 'status': status[0], 'bytes': len(body)}
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    client = app.app.test_client()
+    results = {}
+    for path in PATHS:
+        app.config = default_config()
+        app.config.page_cache = False
+        rendered = run(path, requests, BROWSER)
+        app.config = default_config()
+        cached = run(path, requests, BROWSER)
+        etag = client.get(path, headers=BROWSER).headers['ETag']
+        revalidated = run(path, requests, dict(BROWSER, **{'If-None-Match': etag}))
+        results[path] = {'rendered': rendered, 'cached': cached, 'not_modified': revalidated,
+                         'speedup': round(cached['rps'] / rendered['rps'], 2)}
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
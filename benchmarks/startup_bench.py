@@ -0,0 +1,87 @@
+"""
+Measure how long a fresh process takes to answer its first slash command,
+with lazy startup on and off, and profile what `import humorbot` spends its
+time importing.
+
+Each run starts a new Python process that imports humorbot and posts one
+command to the Flask app, backed by the stub API. Times are measured from
+just before the process is started.
+
+    PYTHONPATH=. python benchmarks/startup_bench.py [runs] [--imports N]
+"""
+import os
+import re
+import sys
+import json
+import time
+import subprocess
+from humorbot.metrics import percentiles
+from humorbot.stub import StubServer
+
+CHILD = '''
+import os, sys, time, json
+start = float(os.environ['STARTUP_BENCH_START'])
+import humorbot
+imported = time.time()
+from humorbot import app
+res = app.app.test_client().post('/slack', data={'token': 'SLACK_TOKEN', 'command': '/morbo', 'text': 'do the hustle',
+                                                 'user_name': 'bench', 'team_domain': 'bench'})
+done = time.time()
+sys.stdout.write('\\n' + json.dumps({'import_s': imported - start, 'first_response_s': done - start,
+                                     'status': res.status_code}) + '\\n')
+'''
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def first_response(url, lazy):
+    env = dict(os.environ, HBOT_MORBO_API_URL=url, HBOT_LAZY_STARTUP='1' if lazy else '0',
+               STARTUP_BENCH_START=repr(time.time()))
+    out = subprocess.check_output([sys.executable, '-c', CHILD], env=env)
+    return json.loads(out.decode('utf-8').strip().splitlines()[-1])
+
+
+def import_profile(top=15):
+    """
+    Run `python -X importtime -c 'import humorbot'` and return the total
+    time and the slowest modules by cumulative time, in milliseconds.
+    """
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import humorbot'], stderr=subprocess.PIPE,
+                         stdout=subprocess.DEVNULL, env=dict(os.environ, HBOT_LAZY_STARTUP='1'))
+    modules = []
+    for line in res.stderr.decode('utf-8').splitlines():
+        m = IMPORT_LINE.match(line)
+        if m:
+            modules.append((m.group(4), int(m.group(2)) / 1000.0, (len(m.group(3)) - 1) // 2))
+    total = [ms for name, ms, depth in modules if name == 'humorbot']
+    modules = sorted((m for m in modules if m[0] != 'humorbot'), key=lambda m: -m[1])[:top]
+    return {'total_ms': total[-1] if total else None,
+            'slowest': [{'module': name, 'cumulative_ms': ms, 'depth': depth} for name, ms, depth in modules]}
+
+
+def summarise(runs, key):
+    return {k + '_ms': round(v * 1000, 1) for k, v in percentiles([r[key] for r in runs], (50, 95)).items()}
+
+
+def main():
+    args = sys.argv[1:]
+    top = 15
+    if '--imports' in args:
+        top = int(args.pop(args.index('--imports') + 1))
+        args.remove('--imports')
+    runs = int(args[0]) if args else 5
+    stub = StubServer().start()
+    results = {}
+    try:
+        for name, lazy in [('eager', False), ('lazy', True)]:
+            samples = [first_response(stub.url, lazy) for i in range(runs)]
+            assert all(s['status'] == 200 for s in samples)
+            results[name] = {'runs': runs, 'import': summarise(samples, 'import_s'),
+                             'first_response': summarise(samples, 'first_response_s')}
+    finally:
+        stub.stop()
+    results['imports'] = import_profile(top)
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
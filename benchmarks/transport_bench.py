@@ -0,0 +1,41 @@
+"""
+Compare one-shot `requests.get` calls against the pooled transport, using the
+local stub API server.
+
+    PYTHONPATH=. python benchmarks/transport_bench.py [calls]
+"""
+import sys
+import time
+import json
+import requests
+from humorbot.transport import HTTPTransport
+from humorbot.stub import StubServer
+
+
+def run(get, url, calls):
+    start = time.time()
+    for i in range(calls):
+        get(url)
+    return time.time() - start
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    stub = StubServer().start()
+    url = stub.url + '/api/search?q=do the hustle'
+    results = {}
+    for name, get in [('oneshot', requests.get), ('pooled', HTTPTransport().get)]:
+        connections = stub.connections
+        elapsed = run(get, url, calls)
+        results[name] = {
+            'calls': calls,
+            'connections': stub.connections - connections,
+            'total_s': round(elapsed, 4),
+            'mean_ms': round(elapsed / calls * 1000, 3)
+        }
+    stub.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,50 @@
+import atexit
 import logging
+import argparse
 import sys
-from scruffy import ConfigFile, PackageFile
-from flask import Flask, request, jsonify, render_template, redirect, send_from_directory
-from slackclient import SlackClient
-
-config = ConfigFile('~/.humourbot.conf', defaults=PackageFile('defaults.yaml'), apply_env=True, env_prefix='HBOT')
-config.load()
-
-logging.basicConfig(stream=sys.stdout, level=logging.DEBUG if config.debug_logging else logging.INFO)
+from . import logs
+from .settings import config
+
+if config.background_logging:
+    logging_writer = logs.BackgroundLogging.from_config(config).start()
+    atexit.register(logging_writer.stop)
+else:
+    logging_writer = None
+    logging.basicConfig(stream=sys.stdout, level=logging.DEBUG if config.debug_logging else logging.INFO)
 logging.getLogger("requests").setLevel(logging.WARNING)
+logs.events = logs.EventLog.from_config(config)
 
-from . import app
-app.config = config
+from .metrics import REGISTRY
+REGISTRY.register(lambda: logs.events.collect())
+REGISTRY.register(lambda: logging_writer.collect() if logging_writer else [])
 
 log = logging.getLogger()
 
 
-def main():
-    app.app.run()
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='humorbot', description='A Slack bot for Morbotron and Frinkiac')
+    subparsers = parser.add_subparsers(dest='subcommand')
+    subparsers.add_parser('serve', help='run the web app (the default)')
+    from . import replay, index, crawler, cache
+    replay.add_arguments(subparsers.add_parser('replay', help='replay commands from a log against the app'))
+    index.add_arguments(subparsers.add_parser('index', help='build or search a local subtitle index'))
+    crawler.add_arguments(subparsers.add_parser('crawl', help='mirror subtitles and frames from a backend'))
+    cache.add_arguments(subparsers.add_parser('cache', help='maintain the disk cache'))
+    args = parser.parse_args(argv)
+
+    if args.subcommand == 'replay':
+        replay.main(args)
+    elif args.subcommand == 'index':
+        index.main(args)
+    elif args.subcommand == 'crawl':
+        crawler.main(args)
+    elif args.subcommand == 'cache':
+        cache.main(args)
+    else:
+        from . import app
+        app.app.run()
 
 
 if __name__ == '__main__':
+    from . import app
     app.app.run(debug=True)
@@ -0,0 +1,99 @@
+"""
+An asyncio entry point for the Slack endpoints, served with:
+
+    gunicorn humorbot.aioapp:app --worker-class aiohttp.GunicornWebWorker
+
+Each worker can have hundreds of commands in flight while they wait on the
+backends. The home, usage, privacy and OAuth pages are still served by the
+Flask app.
+"""
+import json
+import logging
+from aiohttp import web
+from .settings import config
+from .aiobot import AsyncHumorbot
+from .metrics import REGISTRY
+from . import logs
+
+log = logging.getLogger()
+
+NO_MATCH = {'text': "Token doesn't match", 'response_type': 'ephemeral'}
+
+
+def valid_token(config, token):
+    """
+    Check that an app token belongs to one of the ones from the config.
+    """
+    return token in [config.morbo_token, config.frink_token]
+
+
+async def slack(request):
+    """
+    Handle initial / command from Slack
+    """
+    hb = request.app['hb']
+    data = dict(await request.post())
+    if not valid_token(request.app['config'], data.get('token')):
+        return web.json_response(NO_MATCH)
+    try:
+        command = data['command'].replace('/', '').strip()
+        logs.events.debug('request', "Got request", data)
+        res = await hb.process_command(command, data)
+    except Exception as e:
+        log.exception("Exception processing request: {}".format(e))
+        res = {'text': 'Error processing request.', 'response_type': 'ephemeral'}
+
+    return web.json_response(res)
+
+
+async def slacktion(request):
+    """
+    Handle slack message actions.
+    """
+    hb = request.app['hb']
+    form = await request.post()
+    try:
+        data = json.loads(form.get('payload'))
+    except Exception:
+        return web.json_response(NO_MATCH)
+    if not valid_token(request.app['config'], data.get('token')):
+        return web.json_response(NO_MATCH)
+    try:
+        logs.events.debug('action', "Got action with payload", data)
+        res = await hb.process_action(data)
+    except Exception as e:
+        log.exception("Exception processing action: {}".format(e))
+        res = {'text': "Error processing action", 'response_type': 'ephemeral'}
+
+    return web.json_response(res)
+
+
+async def metrics(request):
+    """
+    Expose metrics in the Prometheus text format.
+    """
+    config = request.app['config']
+    path = str(config.metrics_dir) if config.metrics_dir else None
+    return web.Response(text=REGISTRY.render(path, float(config.metrics_dump_interval)), content_type='text/plain')
+
+
+async def close(app):
+    await app['hb'].close()
+
+
+def make_app(config, hb=None):
+    """
+    Build the aiohttp application.
+    """
+    app = web.Application()
+    app['config'] = config
+    app['hb'] = hb or AsyncHumorbot(config)
+    app.router.add_post('/slack', slack)
+    app.router.add_post('/slacktion', slacktion)
+    app.router.add_get('/metrics', metrics)
+    app.on_cleanup.append(close)
+    return app
+
+
+app = make_app(config)
+REGISTRY.register(lambda: app['hb'].collect())
@@ -0,0 +1,91 @@
+"""
+asyncio backends for the async app, sharing caching and URL building with
+the synchronous ones.
+"""
+import asyncio
+from .backend import *
+from .aiotransport import AsyncHTTPTransport, AsyncSingleFlight, hedged
+
+
+class AsyncFrinkotron(Frinkotron):
+    """
+    An asyncio interface to the common Morbotron/Frinkiac back end.
+
+    `search`, `context_frames`, `captions`, `caption_for_query` and
+    `relevance` are coroutines carrying out the same lookup plans as
+    Frinkotron. Plan steps may read and write the disk cache, so they're run
+    in a thread when there is one.
+    """
+    def __init__(self, name='morbo', config=None, transport=None, search_cache=None):
+        if config is None:
+            config = default_config()
+        transport = transport or AsyncHTTPTransport.from_config(config)
+        super(AsyncFrinkotron, self).__init__(name, config, transport, search_cache)
+        self.flights = AsyncSingleFlight()
+
+    async def get(self, url, endpoint='api'):
+        """
+        Make an API request via the transport and return the decoded JSON.
+
+        Concurrent requests for the same URL share a single upstream call.
+        """
+        return await self.flights.do(url, lambda: self.fetch(url, endpoint))
+
+    async def fetch(self, url, endpoint='api'):
+        with self.calling(endpoint) as start:
+            if self.hedger is not None:
+                res = await hedged(self.hedger, endpoint, lambda: self.transport.get(url))
+            else:
+                res = await self.transport.get(url)
+        return self.decode(res, start, endpoint)
+
+    async def run(self, plan):
+        """
+        Carry out a lookup plan, making the API requests it asks for.
+        """
+        step = await self.advance(plan.send, None)
+        while not isinstance(step, Done):
+            try:
+                res = await self.get(*step)
+            except Exception as e:
+                step = await self.advance(plan.throw, e)
+            else:
+                step = await self.advance(plan.send, res)
+        plan.close()
+        return step.value
+
+    async def advance(self, func, arg):
+        """
+        Run the next step of a plan, in a thread if it might touch the disk.
+        """
+        if self.disk_cache is None:
+            return func(arg)
+        return await asyncio.get_event_loop().run_in_executor(None, func, arg)
+
+    async def search(self, key):
+        return await self.run(self.search_plan(key))
+
+    async def context_frames(self, episode, timestamp, before=4000, after=4000):
+        return await self.run(self.context_frames_plan(episode, timestamp, before, after))
+
+    async def captions(self, episode, timestamp):
+        return await self.run(self.captions_plan(episode, timestamp))
+
+    async def caption_for_query(self, episode, timestamp, query):
+        return self.best_caption(await self.captions(episode, timestamp), query)
+
+    async def relevance(self, results, query):
+        if not results:
+            return 0
+        r = results[0]
+        return self.caption_relevance(await self.captions(r['Episode'], r['Timestamp']), query)
+
+
+class AsyncMorbotron(AsyncFrinkotron):
+    def __init__(self, *args, **kwargs):
+        return super(AsyncMorbotron, self).__init__('morbo', *args, **kwargs)
+
+
+class AsyncFrinkiac(AsyncFrinkotron):
+    def __init__(self, *args, **kwargs):
+        return super(AsyncFrinkiac, self).__init__('frink', *args, **kwargs)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Command handling on asyncio, for the async app.
+"""
+import time
+import json
+import asyncio
+from random import choice
+from .bot import *
+from .aiobackend import *
+
+
+class AsyncHumorbot(Humorbot):
+    """
+    A Humorbot whose command handling runs on asyncio.
+
+    Both backends share one pooled async transport, so a single process can
+    have many commands waiting on the network at once.
+    """
+    def __init__(self, config=None):
+        if config is None:
+            config = default_config()
+        if config.gif_state_path:
+            # SQLite would block the event loop, and sessions can be rebuilt from the editor's buttons anyway
+            raise ValueError("gif_state_path isn't supported by the async app")
+        self.config = config
+        self.transport = AsyncHTTPTransport.from_config(config)
+        self.state = state_store_from_config(config)
+        self.cross_stats = {'early': 0, 'complete': 0, 'budget': 0}
+        if not config.lazy_startup:
+            self.start()
+
+    @lazy
+    def frink(self):
+        return AsyncFrinkiac(self.config, self.transport)
+
+    @lazy
+    def morbo(self):
+        return AsyncMorbotron(self.config, self.transport)
+
+    async def gather(self, lookups, default=None):
+        """
+        Run lookups concurrently and return their results in order. Lookups
+        that failed are logged and replaced with `default`.
+        """
+        results = []
+        for r in await asyncio.gather(*lookups, return_exceptions=True):
+            if isinstance(r, Exception):
+                log.error(u"Lookup failed: {}".format(r), exc_info=r)
+                r = default
+            results.append(r)
+        return results
+
+    async def process_command(self, command, data):
+        """
+        Process a command sent to the app.
+        """
+        (action, query, overlay) = self.parse_args(data['text'])
+
+        log.debug(u"Processing /%s %s action with query '%s' and text overlay '%s'", command, action, query, overlay)
+        log.info(u"command=%s, username=%s, team_domain=%s, text=%s", command, data['user_name'], data['team_domain'],
+                 data['text'])
+
+        with ACTION_SECONDS.time(action=action):
+            try:
+                if action == 'help':
+                    res = {'text': MORBO_USAGE if 'morbo' in command else FRINK_USAGE}
+                elif action in ['image', 'random']:
+                    res = await self.image(data['user_name'], query, overlay, command, random=(action == 'random'))
+                elif action == 'images':
+                    res = await self.images(data['user_name'], query, overlay, command)
+                elif action == 'gif':
+                    res = await self.gif(data['user_name'], query, overlay, command)
+                elif action == 'gifs':
+                    res = await self.gifs(data['user_name'], query, overlay, command)
+            except CircuitOpenException as e:
+                res = unavailable(e.backend)
+
+        return res
+
+    async def process_action(self, payload):
+        """
+        Process an action sent to the app by clicking an interactive button in
+        a message. Only restoring a GIF editor session that isn't in the
+        state store needs the backend, so that's done here and the rest runs
+        the synchronous version, which must then find the session stored.
+        """
+        restore = self.missing_session(payload)
+        if restore is not None:
+            state_id = json.loads(payload['actions'][0]['value'])['state']
+            try:
+                self.restore_session(state_id, restore, await self.restore_context(restore))
+            except RequestFailedException:
+                return EXPIRED_EDITOR
+            if self.state.get(state_id) is None:
+                return EXPIRED_EDITOR
+        return super(AsyncHumorbot, self).process_action(payload)
+
+    async def search(self, command, query):
+        """
+        Search the command's backend, or both backends at once if
+        cross_search is on. Returns the command's backend and the results.
+        """
+        backend = self.backend(command)
+        if not self.config.cross_search:
+            return backend, await backend.search(query)
+        owners = {asyncio.ensure_future(self.scored_search(b, query)): b for b in [backend, self.other(backend)]}
+        deadline = time.time() + float(self.config.cross_search_budget)
+        scored, errors = {}, {}
+        pending = set(owners)
+        while pending and not self.confident(scored):
+            done, pending = await asyncio.wait(pending, timeout=max(0, deadline - time.time()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for f in done:
+                try:
+                    scored[owners[f].name] = f.result()
+                except Exception as e:
+                    errors[owners[f].name] = e
+        for f in pending:
+            f.cancel()
+        return backend, self.merge(backend, scored, errors, pending)
+
+    async def scored_search(self, backend, query):
+        """
+        Search a backend and score its results for ranking against the other
+        backend's.
+        """
+        results = await backend.search(query)
+        try:
+            score = await backend.relevance(results, query)
+        except RequestFailedException as e:
+            log.warning(u"Couldn't score {} results for '{}': {}".format(backend.name, query, e))
+            score = 0
+        return score, results
+
+    async def image(self, username, query, overlay='', command='morbo', random=False, multiple=False):
+        """
+        Implement the 'image' and 'random' actions.
+        """
+        backend, search_result = await self.search(command, query)
+        if len(search_result):
+            r = choice(search_result) if random else search_result[0]
+            backend = self.result_backend(r, backend)
+            caption = overlay or await backend.caption_for_query(r['Episode'], r['Timestamp'], query)
+            res = self.image_response(backend, username, query, overlay, command, random, r, caption)
+        else:
+            res = self.no_match(query)
+
+        return res
+
+    async def images(self, username, query, overlay='', command='morbo'):
+        """
+        Implement the 'images' action.
+        """
+        backend, search_result = await self.search(command, query)
+        results = self.options('images', search_result, MAX_IMAGES, overlay)
+        if overlay:
+            captions = [overlay] * len(results)
+        else:
+            captions = await self.gather([self.result_backend(r, backend).caption_for_query(r['Episode'],
+                                                                                            r['Timestamp'], query)
+                                          for r in results], default='')
+
+        return self.images_response(backend, query, overlay, command, results, captions)
+
+    async def gif(self, username, query, overlay='', command='morbo'):
+        """
+        Implement the 'gif' action
+        """
+        backend, search_result = await self.search(command, query)
+        if len(search_result):
+            r = search_result[0]
+            backend = self.result_backend(r, backend)
+            context = await backend.context_frames(r['Episode'], r['Timestamp'])
+            if len(context):
+                caption = overlay or await backend.caption_for_query(r['Episode'], r['Timestamp'], query)
+                res = self.gif_response(backend, query, overlay, command, context, caption)
+            else:
+                res = {'text': 'Failed to get context', 'response_type': 'ephemeral'}
+        else:
+            res = self.no_match(query)
+
+        return res
+
+    async def gifs(self, username, query, overlay='', command='morbo'):
+        """
+        Implement the 'gifs' action.
+        """
+        backend, search_result = await self.search(command, query)
+        results = self.options('gifs', search_result, MAX_GIFS, overlay)
+        backends = [self.result_backend(r, backend) for r in results]
+        lookups = [b.context_frames(r['Episode'], r['Timestamp']) for b, r in zip(backends, results)]
+        if overlay:
+            contexts = await self.gather(lookups, default=[])
+            captions = [overlay] * len(results)
+        else:
+            lookups += [b.caption_for_query(r['Episode'], r['Timestamp'], query) for b, r in zip(backends, results)]
+            found = await self.gather(lookups)
+            contexts = [c or [] for c in found[:len(results)]]
+            captions = [c or '' for c in found[len(results):]]
+
+        return self.gifs_response(backends, query, overlay, command, contexts, captions)
+
+    async def close(self):
+        await self.transport.close()
@@ -0,0 +1,168 @@
+"""
+asyncio counterparts to the HTTP transport and hedging, for the async app.
+These are kept out of the core modules so those still import on Python 2.
+"""
+import time
+import json
+import asyncio
+import aiohttp
+import threading
+from .transport import HTTPTransport, SingleFlight, RETRY_STATUSES
+
+
+class AsyncResponse(object):
+    """
+    The parts of an aiohttp response we need, read before the connection is
+    released back to the pool.
+    """
+    def __init__(self, status, body):
+        self.status_code = status
+        self.body = body
+        return super(AsyncResponse, self).__init__()
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.body.decode('utf-8'))
+
+
+class AsyncHTTPTransport(HTTPTransport):
+    """
+    An asyncio counterpart to HTTPTransport, backed by a pooled aiohttp
+    ClientSession.
+
+    The session is created on first use, so it belongs to the event loop
+    that makes the first request.
+    """
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=10, retries=2, backoff=0.2):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = None
+        self.lock = threading.Lock()
+        self.stats = {'calls': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0}
+
+    def client(self):
+        if self.session is None or self.session.closed:
+            timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout)
+            connector = aiohttp.TCPConnector(limit=self.pool_size, limit_per_host=self.pool_size)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self.session
+
+    async def get(self, url):
+        """
+        Perform a GET request and return the response, retrying server errors
+        and connection failures with exponential backoff.
+        """
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                async with self.client().get(url) as r:
+                    res = AsyncResponse(r.status, await r.read())
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.record(url, time.time() - start, error=True)
+                if attempt >= self.retries:
+                    raise
+            else:
+                self.record(url, time.time() - start, error=not res.ok)
+                if res.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    return res
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+
+    async def post(self, url, data):
+        """
+        POST `data` as JSON and return the response.
+        """
+        start = time.time()
+        async with self.client().post(url, json=data) as r:
+            res = AsyncResponse(r.status, await r.read())
+        self.record(url, time.time() - start, error=not res.ok)
+        return res
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+class AsyncFlight(object):
+    """
+    An upstream call in progress, and how many callers are waiting on it.
+    """
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+        return super(AsyncFlight, self).__init__()
+
+
+class AsyncSingleFlight(SingleFlight):
+    """
+    A SingleFlight for coroutines on one event loop.
+
+    The call runs as a task that every caller for the key waits on, and it's
+    cancelled if they all give up.
+    """
+    async def do(self, key, func):
+        """
+        Return `await func()`, sharing the call with any in flight for `key`.
+        """
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = AsyncFlight(asyncio.ensure_future(func()))
+            flight.task.add_done_callback(lambda task: self.land(key, flight))
+            self.stats['calls'] += 1
+        else:
+            self.stats['coalesced'] += 1
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                self.land(key, flight)
+                flight.task.cancel()
+                await asyncio.wait([flight.task])
+
+    def land(self, key, flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+
+async def hedged(hedger, key, func):
+    """
+    Return `await func()` through a Hedger, hedged if it takes too
+    long. The loser is cancelled.
+    """
+    hedger.earn()
+    delay = hedger.delay(key)
+
+    async def timed():
+        start = time.time()
+        res = await func()
+        hedger.record(key, time.time() - start)
+        return res
+
+    if delay is None:
+        return await timed()
+    first = asyncio.ensure_future(timed())
+    done, pending = await asyncio.wait([first], timeout=delay)
+    if done or not hedger.spend():
+        return await first
+    second = asyncio.ensure_future(timed())
+    pending = set([first, second])
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        ok = [f for f in [first, second] if f in done and f.exception() is None]
+        if ok or not pending:
+            for loser in pending:
+                loser.cancel()
+            if ok and ok[0] is second:
+                with hedger.lock:
+                    hedger.stats['hedge_wins'] += 1
+            # Both failed if none succeeded
+            return (ok or [first])[0].result()
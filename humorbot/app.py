@@ -1,19 +1,159 @@
+import io
 import logging
 import json
+import gzip
+import hashlib
 import requests
 import six
-import random
+import threading
+import time
 import os
 
-from scruffy import ConfigFile, PackageFile
-from flask import Flask, request, jsonify, render_template, redirect, send_from_directory
-from slackclient import SlackClient
+from flask import Flask, request, jsonify, render_template, redirect, g, Response
+from .settings import config
 from .bot import Humorbot
+from .jobs import JobQueue
+from .metrics import REGISTRY, HTTP_SECONDS, JSON_SECONDS
+from .dedupe import Deduplicator, command_key, action_key
+from . import logs
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 log = logging.getLogger()
 app = Flask(__name__)
-config = None
-hb = Humorbot()
+hb = Humorbot(config)
+jobs = JobQueue.from_config(config)
+dedupe = Deduplicator.from_config(config) if config.dedupe_requests else None
+pages = {}
+pages_settings = None
+pages_lock = threading.Lock()
+
+WORKING_RESPONSE = {'text': 'Working on it...', 'response_type': 'ephemeral'}
+BUSY_RESPONSE = {'text': 'Humorbot is too busy right now, try again in a moment.', 'response_type': 'ephemeral'}
+
+REGISTRY.register(lambda: hb.collect())
+REGISTRY.register(lambda: jobs.collect())
+REGISTRY.register(lambda: dedupe.collect() if dedupe else [])
+
+
+@app.before_request
+def start_timer():
+    g.start = time.time()
+
+
+@app.after_request
+def record_request(response):
+    """
+    Record the request latency, and share this worker's metrics with the
+    others every so often.
+    """
+    if 'start' in g:
+        HTTP_SECONDS.observe(time.time() - g.start, endpoint=str(request.endpoint), status=response.status_code)
+    if config is not None and config.metrics_dir:
+        REGISTRY.maybe_dump(str(config.metrics_dir), float(config.metrics_dump_interval))
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Expose metrics in the Prometheus text format, merged across workers if
+    a metrics directory is configured.
+    """
+    path = str(config.metrics_dir) if config.metrics_dir else None
+    return Response(REGISTRY.render(path, float(config.metrics_dump_interval)), mimetype='text/plain; version=0.0.4')
+
+
+def gzipped(body):
+    """
+    Compress with gzip, leaving out the timestamp so the result, and so the
+    ETag, only depends on the body.
+    """
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(body)
+    return out.getvalue()
+
+
+class Page(object):
+    """
+    A rendered page held in memory, along with its gzip (and brotli, if
+    installed) compressed forms and the headers for each, including a strong
+    ETag. The encoding chosen for each Accept-Encoding header is remembered.
+    """
+    def __init__(self, body, mimetype='text/html', max_age=86400):
+        self.mimetype = mimetype
+        digest = hashlib.sha1(body).hexdigest()[:20]
+        self.variants = {None: body, 'gzip': gzipped(body)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body)
+        self.etags = {}
+        self.headers = {}
+        self.negotiated = {}
+        for encoding in self.variants:
+            self.etags[encoding] = digest + ('-' + encoding if encoding else '')
+            self.headers[encoding] = [('ETag', '"{}"'.format(self.etags[encoding])), ('Vary', 'Accept-Encoding'),
+                                      ('Cache-Control', 'public, max-age={}'.format(max_age))]
+            if encoding:
+                self.headers[encoding].append(('Content-Encoding', encoding))
+        return super(Page, self).__init__()
+
+    def response(self):
+        """
+        Build a response in the best encoding the client accepts, or a 304
+        if it already has it.
+        """
+        header = request.headers.get('Accept-Encoding', '')
+        encoding = self.negotiated.get(header, False)
+        if encoding is False:
+            accepted = [e for e in ['br', 'gzip'] if e in self.variants and request.accept_encodings.quality(e)]
+            encoding = max(accepted, key=request.accept_encodings.quality) if accepted else None
+            if len(self.negotiated) < 100:
+                self.negotiated[header] = encoding
+        if self.etags[encoding] in request.if_none_match:
+            return Response(status=304, headers=self.headers[encoding])
+        return Response(self.variants[encoding], mimetype=self.mimetype, headers=self.headers[encoding])
+
+
+def page_settings():
+    """
+    Return the settings pages are rendered and served with.
+
+    They're read from the config's underlying dict, which is much cheaper
+    than going through scruffy on every request, and still sees the config
+    being reloaded or changed in place.
+    """
+    values = config.to_dict()
+    return (bool(values.get('page_cache')), int(values.get('page_max_age')), str(values.get('morbo_client_id')),
+            str(values.get('frink_client_id')))
+
+
+def page(key, render, mimetype='text/html'):
+    """
+    Serve a page from memory, rendering it with `render` the first time it's
+    asked for since the settings it depends on last changed.
+    """
+    global pages_settings
+    settings = page_settings()
+    if pages_settings != settings:
+        with pages_lock:
+            if pages_settings != settings:
+                pages.clear()
+                pages_settings = settings
+    cached = pages.get(key)
+    enabled, max_age = settings[:2]
+    if not enabled:
+        return Response(render(), mimetype=mimetype)
+    if cached is None:
+        body = render()
+        cached = Page(body.encode('utf-8') if isinstance(body, six.text_type) else body, mimetype, max_age)
+        with pages_lock:
+            if pages_settings == settings:
+                pages[key] = cached
+    return cached.response()
 
 
 @app.route('/')
@@ -21,14 +161,21 @@ def index():
     """
     Render the home page which allows the user to add the app to their Slack team
     """
-    return render_template('index.html', morbo_client_id=str(config.morbo_client_id),
-                           frink_client_id=str(config.frink_client_id), installed=request.args.get('installed'))
+    # The page only changes for these values, so don't cache a copy for every other one
+    installed = request.args.get('installed')
+    installed = installed if installed in ['true', 'error'] else None
+    return page(('index', installed), lambda: render_template('index.html',
+                                                              morbo_client_id=str(config.morbo_client_id),
+                                                              frink_client_id=str(config.frink_client_id),
+                                                              installed=installed))
 
 
 @app.route('/favicon.ico')
 def favicon():
-    return send_from_directory(os.path.join(app.root_path, 'static'),
-                               'favicon.ico', mimetype='image/vnd.microsoft.icon')
+    def read():
+        with open(os.path.join(app.root_path, 'static', 'favicon.ico'), 'rb') as f:
+            return f.read()
+    return page('favicon', read, 'image/vnd.microsoft.icon')
 
 
 @app.route('/privacy')
@@ -36,7 +183,7 @@ def privacy():
     """
     Display the privacy policy page.
     """
-    return render_template('privacy.html')
+    return page('privacy', lambda: render_template('privacy.html'))
 
 
 @app.route('/usage')
@@ -44,7 +191,17 @@ def usage():
     """
     Display the usage page.
     """
-    return render_template('usage.html')
+    return page('usage', lambda: render_template('usage.html'))
+
+
+def deduplicated(key, func):
+    """
+    Run `func`, unless this request is a Slack retry of one we've already
+    answered or are still working on.
+    """
+    if dedupe is None:
+        return func()
+    return dedupe.do(key, func, retry='X-Slack-Retry-Num' in request.headers)
 
 
 def verify_token(func):
@@ -84,16 +241,27 @@ def slack():
         command = request.values.get('command').replace('/', '').strip()
         data = request.values.to_dict()
 
-        log.debug("Got request: {}".format(data))
+        logs.events.debug('request', "Got request", data)
+
+        def process():
+            if config.deferred_responses and data.get('response_url'):
+                # Acknowledge now and post the real response to the response_url when it's ready
+                if jobs.submit(hb.process_command, data['response_url'], command, data):
+                    return WORKING_RESPONSE
+                else:
+                    return BUSY_RESPONSE
+            else:
+                return hb.process_command(command, data)
 
-        res = hb.process_command(command, data)
+        res = deduplicated(command_key(data), process)
     except Exception as e:
         log.exception("Exception processing request: {}".format(e))
         res = {'text': 'Error processing request.', 'response_type': 'ephemeral'}
 
-    log.debug("Returning response: {}".format(res))
+    logs.events.debug('response', "Returning response", res)
 
-    return jsonify(res)
+    with JSON_SECONDS.time(endpoint='slack'):
+        return jsonify(res)
 
 
 @app.route('/slacktion', methods=['POST'], endpoint='slacktion')
@@ -104,15 +272,16 @@ def slacktion():
     """
     try:
         data = json.loads(request.form.get('payload'))
-        log.debug('Got action with payload: {}'.format(data))
+        logs.events.debug('action', "Got action with payload", data)
 
-        res = hb.process_action(data)
+        res = deduplicated(action_key(data), lambda: hb.process_action(data))
     except Exception as e:
         log.exception("Exception processing action: {}".format(e))
         res = {'text': "Error processing action", 'response_type': 'ephemeral'}
         raise
 
-    return jsonify(res)
+    with JSON_SECONDS.time(endpoint='slacktion'):
+        return jsonify(res)
 
 
 @app.route('/oauth/frink')
@@ -1,10 +1,18 @@
-import requests
+import os
+import time
 import base64
 import six
 import textwrap
 import re
 import logging
-from fuzzywuzzy import process
+from contextlib import contextmanager
+from scruffy import ConfigFile, PackageFile
+from .transport import HTTPTransport, SingleFlight, CircuitBreaker, Hedger
+from .metrics import BACKEND_SECONDS, BACKEND_ERRORS, MATCH_SECONDS
+from .cache import LRUCache, CaptionIndex, TimelineCache, DiskCache, TieredCache, normalize_query
+from .matcher import CaptionMatcher
+from .index import SubtitleIndex
+from .lazy import lazy
 
 MORBO_BASE_URL = 'https://morbotron.com'
 FRINK_BASE_URL = 'https://frinkiac.com'
@@ -17,11 +25,49 @@ class RequestFailedException(Exception):
     pass
 
 
+class NotFoundException(RequestFailedException):
+    """
+    Raised when the backend answers that there's nothing at a URL.
+    """
+    pass
+
+
+class CircuitOpenException(RequestFailedException):
+    """
+    Raised instead of calling a backend whose circuit breaker is open.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        return super(CircuitOpenException, self).__init__('{} circuit breaker is open'.format(backend))
+
+
+def default_config():
+    """
+    Load the packaged default config, for backends created without one.
+    """
+    return ConfigFile(defaults=PackageFile('defaults.yaml')).load()
+
+
+class Done(object):
+    """
+    The result of a lookup plan.
+
+    Lookups are written as plans: generators that yield the `(url, endpoint)`
+    API requests they need, are sent back the decoded JSON (or have the
+    failure thrown in), and finish by yielding a Done. That way the caching
+    around a request is shared by the blocking and asyncio backends, which
+    only differ in how they make it.
+    """
+    def __init__(self, value):
+        self.value = value
+        return super(Done, self).__init__()
+
+
 class Frinkotron(object):
     """
     An interface to the common Morbotron/Frinkiac back end.
     """
-    def __init__(self, name='morbo'):
+    def __init__(self, name='morbo', config=None, transport=None, search_cache=None):
         self.name = name
         if name == 'morbo':
             self.base = MORBO_BASE_URL
@@ -29,48 +75,354 @@ class Frinkotron(object):
             self.base = FRINK_BASE_URL
         else:
             raise Exception('Wat')
+        if config is None:
+            config = default_config()
+        self.config = config
+
+        # API calls can be pointed somewhere other than the public site (eg. a local stub)
+        self.api_base = str(config['{}_api_url'.format(name)] or self.base)
+        self.transport = transport or HTTPTransport.from_config(config)
+        self.flights = SingleFlight()
+        self.breaker = CircuitBreaker.from_config(config) if config.breaker_enabled else None
+        self.hedger = Hedger.from_config(config) if config.hedge_requests else None
+
+        # Responses are cached in memory, and optionally on disk where all the workers on a host can share them
+        if config.disk_cache_path:
+            self.disk_cache = DiskCache(os.path.expanduser(str(config.disk_cache_path)),
+                                        ttl=int(config.disk_cache_ttl), max_bytes=int(config.disk_cache_max_bytes))
+        else:
+            self.disk_cache = None
+        if search_cache is None:
+            search_cache = TieredCache(LRUCache(ttl=int(config.search_cache_ttl),
+                                                max_entries=int(config.search_cache_max_entries),
+                                                max_bytes=int(config.search_cache_max_bytes), keep_stale=True),
+                                       self.disk_cache)
+        self.search_cache = search_cache
+        self.caption_index = CaptionIndex(max_subtitles=int(config.caption_index_max_subtitles))
+        self.context_cache = TieredCache(LRUCache(ttl=int(config.search_cache_ttl),
+                                                  max_entries=int(config.context_cache_max_entries), keep_stale=True),
+                                         self.disk_cache)
+        self.timeline = TimelineCache(max_frames=int(config.timeline_max_frames))
+        self.stale_stats = {'search': 0, 'context': 0}
+
+        # Searches can be answered from a local subtitle index, with the API as a fallback
+        self.search_index = None
+        self.min_confidence = float(config.search_index_min_confidence)
+        self.search_stats = {'index': 0, 'fallback': 0}
+        index_path = config['{}_search_index'.format(name)]
+        if str(config.search_mode) == 'index' and index_path:
+            try:
+                self.search_index = SubtitleIndex(os.path.expanduser(str(index_path)))
+            except (IOError, OSError, ValueError) as e:
+                log.error("Couldn't load search index, searching remotely: {}".format(e))
         return super(Frinkotron, self).__init__()
 
-    def search(self, key):
+    @lazy
+    def matcher(self):
+        return CaptionMatcher(max_entries=int(self.config.caption_index_max_subtitles))
+
+    def get(self, url, endpoint='api'):
         """
-        Search Morbotron or Frinkiac
+        Make an API request via the transport and return the decoded JSON.
+
+        Concurrent requests for the same URL share a single upstream call.
+        """
+        return self.flights.do(url, lambda: self.fetch(url, endpoint))
+
+    def fetch(self, url, endpoint='api'):
+        with self.calling(endpoint) as start:
+            if self.hedger is not None:
+                res = self.hedger.do(endpoint, lambda: self.transport.get(url))
+            else:
+                res = self.transport.get(url)
+        return self.decode(res, start, endpoint)
+
+    @contextmanager
+    def calling(self, endpoint):
+        """
+        Check the circuit breaker, then time an API call made inside the
+        block, recording it with the breaker if it raises. Yields the start
+        time.
+        """
+        self.check_breaker()
+        start = time.time()
+        with BACKEND_SECONDS.time(backend=self.name, endpoint=endpoint):
+            try:
+                yield start
+            except Exception:
+                BACKEND_ERRORS.inc(backend=self.name, endpoint=endpoint)
+                self.record_call(False, start)
+                raise
+            except BaseException:
+                # Cancelled, which isn't the backend's fault, but a half-open probe has to be given back
+                self.release_call()
+                raise
+
+    def decode(self, res, start, endpoint):
         """
-        res = requests.get(u'{}/api/search?q={}'.format(self.base, key))
+        Record a response with the circuit breaker and return its JSON.
+        """
+        self.record_call(res.status_code < 500, start)
         if res.ok:
             return res.json()
         else:
-            raise RequestFailedException()
+            BACKEND_ERRORS.inc(backend=self.name, endpoint=endpoint)
+            raise NotFoundException() if res.status_code == 404 else RequestFailedException()
+
+    def run(self, plan):
+        """
+        Carry out a lookup plan, making the API requests it asks for.
+        """
+        step = next(plan)
+        while not isinstance(step, Done):
+            try:
+                res = self.get(*step)
+            except Exception as e:
+                step = plan.throw(e)
+            else:
+                step = plan.send(res)
+        plan.close()
+        return step.value
+
+    def search(self, key):
+        """
+        Search Morbotron or Frinkiac
+
+        Results are cached by backend and normalised query.
+        """
+        return self.run(self.search_plan(key))
+
+    def search_plan(self, key):
+        cache_key = (self.name, normalize_query(key))
+        res = self.search_cache.get(cache_key)
+        if res is None:
+            res = self.local_search(key)
+            if res is None:
+                try:
+                    res = yield (self.search_url(key), 'search')
+                except Exception:
+                    res = self.stale('search', self.search_cache, cache_key)
+                    if res is None:
+                        raise
+                    yield Done(res)
+                    return
+            self.search_cache.set(cache_key, res)
+        yield Done(res)
+
+    def check_breaker(self):
+        """
+        Raise CircuitOpenException if the circuit breaker won't allow a call.
+        """
+        if self.breaker is not None and not self.breaker.allow():
+            raise CircuitOpenException(self.name)
+
+    def record_call(self, ok, start):
+        if self.breaker is not None:
+            self.breaker.record(ok, time.time() - start)
+
+    def release_call(self):
+        if self.breaker is not None:
+            self.breaker.release()
+
+    def stale(self, name, cache, key):
+        """
+        Return expired data from a cache after a failed request, if there is
+        any.
+        """
+        res = cache.get(key, stale=True)
+        if res is not None:
+            log.warning(u"Serving stale {} data for {}".format(name, key))
+            self.stale_stats[name] += 1
+        return res
+
+    def local_search(self, key):
+        """
+        Search the local subtitle index, if there is one. Returns None if
+        the API should be asked instead.
+        """
+        if self.search_index is None:
+            return None
+        res, confidence = self.search_index.search(key)
+        if confidence < self.min_confidence:
+            self.search_stats['fallback'] += 1
+            return None
+        self.search_stats['index'] += 1
+        return res
 
     def context_frames(self, episode, timestamp, before=4000, after=4000):
         """
         Get frames around the given timestamp.
+
+        Frames are merged into a timeline of the episode, so a window it
+        already covers is answered locally, and a partly covered one only
+        fetches the missing edges.
         """
-        url = u'{base}/api/frames/{episode}/{ts}/{before}/{after}'.format(base=self.base, episode=episode, ts=timestamp,
-                                                                          before=before, after=after)
-        res = requests.get(url)
-        if res.ok:
-            return res.json()
+        return self.run(self.context_frames_plan(episode, timestamp, before, after))
+
+    def context_frames_plan(self, episode, timestamp, before, after):
+        start, end = max(0, timestamp - before), timestamp + after
+        gaps = self.timeline.gaps(episode, start, end)
+        if not gaps:
+            yield Done(self.timeline.frames(episode, start, end))
+            return
+        cache_key = (self.name, 'frames', episode, timestamp, before, after)
+        res = self.context_cache.get(cache_key)
+        if res is None:
+            try:
+                for gap in gaps:
+                    self.timeline.add(episode, gap, (yield (self.span_url(episode, *gap), 'frames')))
+            except Exception:
+                res = self.stale('context', self.context_cache, cache_key)
+                if res is None:
+                    raise
+                yield Done(res)
+                return
+            res = self.timeline.frames(episode, start, end)
+            self.context_cache.set(cache_key, res)
         else:
-            raise RequestFailedException()
+            self.timeline.add(episode, (start, end), res)
+        yield Done(res)
 
     def captions(self, episode, timestamp):
         """
         Get the caption data for a frame.
+
+        Timestamps inside a subtitle span seen in an earlier response are
+        answered from the caption index.
         """
-        url = u'{base}/api/caption?e={episode}&t={timestamp}'.format(base=self.base, episode=episode, timestamp=timestamp)
+        return self.run(self.captions_plan(episode, timestamp))
 
-        res = requests.get(url)
-        if res.ok:
-            return res.json()['Subtitles']
-        else:
-            raise RequestFailedException()
+    def captions_plan(self, episode, timestamp):
+        res = self.cached_captions(episode, timestamp)
+        if res is None:
+            res = (yield (self.caption_url(episode, timestamp), 'caption'))['Subtitles']
+            self.cache_captions(episode, timestamp, res)
+        yield Done(res)
+
+    def cached_captions(self, episode, timestamp):
+        """
+        Look for captions for a frame in the caption index, then the disk cache.
+        """
+        res = self.caption_index.lookup(episode, timestamp)
+        if res is None and self.disk_cache is not None:
+            res = self.disk_cache.get((self.name, 'captions', episode, timestamp))
+            if res is not None:
+                self.caption_index.add(episode, res)
+        return res
+
+    def cache_captions(self, episode, timestamp, res):
+        self.caption_index.add(episode, res)
+        if self.disk_cache is not None:
+            self.disk_cache.set((self.name, 'captions', episode, timestamp), res)
 
     def caption_for_query(self, episode, timestamp, query):
         """
         Find the best matching caption for a query.
         """
-        caps = self.captions(episode, timestamp)
-        return process.extract(query, [c['Content'] for c in caps], limit=1)[0][0]
+        return self.best_caption(self.captions(episode, timestamp), query)
+
+    def best_caption(self, caps, query):
+        """
+        Pick the caption that best matches a query.
+        """
+        with MATCH_SECONDS.time(backend=self.name):
+            return self.matcher.best(query, [c['Content'] for c in caps]) or ''
+
+    def relevance(self, results, query):
+        """
+        Score how well the top search result's captions match a query, from
+        0 to 100, so results from both backends can be ranked together.
+        """
+        if not results:
+            return 0
+        r = results[0]
+        return self.caption_relevance(self.captions(r['Episode'], r['Timestamp']), query)
+
+    def caption_relevance(self, caps, query):
+        with MATCH_SECONDS.time(backend=self.name):
+            return self.matcher.relevance(query, [c['Content'] for c in caps])
+
+    def clear_caches(self):
+        """
+        Drop everything cached in memory, eg. to measure cold lookups.
+        """
+        self.search_cache.clear()
+        self.context_cache.clear()
+        self.caption_index.clear()
+        self.timeline.clear()
+        self.matcher.clear()
+
+    def collect(self):
+        """
+        Report cache, transport and request coalescing stats to the metrics
+        registry.
+        """
+        labels = {'backend': self.name}
+        caches = [('search', self.search_cache), ('context', self.context_cache)]
+        for cache, tiered in caches:
+            for tier, stats in tiered.tier_stats().items():
+                for event in ['hits', 'misses', 'evictions', 'expirations']:
+                    yield ('humorbot_cache_events_total', 'counter', 'Cache lookups and evictions by cache and tier',
+                           dict(labels, cache=cache, tier=tier, event=event), stats[event])
+                yield ('humorbot_cache_lookup_seconds_total', 'counter', 'Time spent looking up each cache tier',
+                       dict(labels, cache=cache, tier=tier), tiered.time[tier])
+            yield ('humorbot_cache_entries', 'gauge', 'Entries in each in-memory cache', dict(labels, cache=cache),
+                   len(tiered.memory))
+        for event, n in self.caption_index.stats.items():
+            yield ('humorbot_cache_events_total', 'counter', 'Cache lookups and evictions by cache and tier',
+                   dict(labels, cache='captions', tier='index', event=event), n)
+        yield ('humorbot_cache_entries', 'gauge', 'Entries in each in-memory cache', dict(labels, cache='captions'),
+               self.caption_index.size)
+        for event, n in self.timeline.stats.items():
+            yield ('humorbot_cache_events_total', 'counter', 'Cache lookups and evictions by cache and tier',
+                   dict(labels, cache='timeline', tier='memory', event=event), n)
+        yield ('humorbot_cache_entries', 'gauge', 'Entries in each in-memory cache', dict(labels, cache='timeline'),
+               self.timeline.size)
+        for source, n in self.search_stats.items():
+            yield ('humorbot_index_searches_total', 'counter',
+                   'Searches answered by the local index or passed to the API', dict(labels, source=source), n)
+        if self.hedger is not None:
+            for event in ['hedged', 'hedge_wins', 'denied']:
+                yield ('humorbot_hedged_requests_total', 'counter', 'Hedged API calls, wins and hedges over budget',
+                       dict(labels, event=event), self.hedger.stats[event])
+        for cache, n in self.stale_stats.items():
+            yield ('humorbot_stale_responses_total', 'counter', 'Expired cache entries served after a failed request',
+                   dict(labels, cache=cache), n)
+        if self.breaker is not None:
+            for event, n in self.breaker.stats.items():
+                yield ('humorbot_breaker_events_total', 'counter',
+                       'Circuit breaker state transitions and short-circuited calls', dict(labels, event=event), n)
+            for state in [CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN]:
+                yield ('humorbot_breaker_state', 'gauge', 'Current circuit breaker state', dict(labels, state=state),
+                       int(self.breaker.state == state))
+        for event in ['hits', 'misses']:
+            yield ('humorbot_cache_events_total', 'counter', 'Cache lookups and evictions by cache and tier',
+                   dict(labels, cache='match_scores', tier='memory', event=event),
+                   self.__dict__['matcher'].stats[event] if 'matcher' in self.__dict__ else 0)
+        yield ('humorbot_transport_requests_total', 'counter', 'HTTP requests made by the transport', labels,
+               self.transport.stats['calls'])
+        yield ('humorbot_transport_errors_total', 'counter', 'Failed HTTP requests made by the transport', labels,
+               self.transport.stats['errors'])
+        yield ('humorbot_coalesced_requests_total', 'counter', 'Requests that shared an identical in-flight call',
+               labels, self.flights.stats['coalesced'])
+
+    def search_url(self, key):
+        return u'{}/api/search?q={}'.format(self.api_base, key)
+
+    def frames_url(self, episode, timestamp, before, after):
+        return u'{base}/api/frames/{episode}/{ts}/{before}/{after}'.format(base=self.api_base, episode=episode,
+                                                                           ts=timestamp, before=before, after=after)
+
+    def span_url(self, episode, start, end):
+        """
+        Return the URL for the frames between two timestamps.
+        """
+        middle = (start + end) // 2
+        return self.frames_url(episode, middle, middle - start, end - middle)
+
+    def caption_url(self, episode, timestamp):
+        return u'{base}/api/caption?e={episode}&t={timestamp}'.format(base=self.api_base, episode=episode,
+                                                                      timestamp=timestamp)
 
     def image_url(self, episode, timestamp, text=''):
         """
@@ -99,10 +451,10 @@ class Frinkotron(object):
 
 
 class Morbotron(Frinkotron):
-    def __init__(self):
-        return super(Morbotron, self).__init__('morbo')
+    def __init__(self, *args, **kwargs):
+        return super(Morbotron, self).__init__('morbo', *args, **kwargs)
 
 
 class Frinkiac(Frinkotron):
-    def __init__(self):
-        return super(Frinkiac, self).__init__('frink')
+    def __init__(self, *args, **kwargs):
+        return super(Frinkiac, self).__init__('frink', *args, **kwargs)
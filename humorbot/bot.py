@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 import re
 import json
+import time
 from random import choice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from .backend import *
+from .state import state_store_from_config
+from .metrics import ACTION_SECONDS, LOOKUPS_SAVED
+from .lazy import lazy
 
 
 MORBO_USAGE = """Display this help:
@@ -47,14 +52,128 @@ Generate a selection of GIFs for _rebigulator_:
 
 MAX_IMAGES = 10
 MAX_GIFS = 5
+EDITOR_ACTIONS = ['edit', 'start', 'end', 'show_hide_text', 'zoom']
+BACKEND_NAMES = {'morbo': 'Morbotron', 'frink': 'Frinkiac'}
+
+EXPIRED_EDITOR = {
+    'text': 'This GIF editor has expired, please run the command again.',
+    'response_type': 'ephemeral',
+    'replace_original': False
+}
+
+
+def restore_info(session):
+    """
+    Return what a GIF editor button needs to rebuild its session if the
+    state store doesn't have it: everything but the context frames, which
+    are fetched again from their first to last timestamp.
+    """
+    return {'args': session['args'], 'text': session['text'], 'episode': session['episode'],
+            'span': [session['context'][0], session['context'][-1]], 'command': session['command'],
+            'backend': session.get('backend', session['command'])}
+
+
+def unavailable(backend):
+    """
+    Build the reply for when a backend's circuit breaker is open.
+    """
+    return {'text': '{} is having trouble right now, please try again in a minute.'.format(BACKEND_NAMES[backend]),
+            'response_type': 'ephemeral'}
+
+
+def distinct_scenes(results, window):
+    """
+    Group search results into scenes, ie. hits in the same episode with no
+    more than `window` milliseconds between neighbours, and return the best
+    ranked hit of each scene in rank order. A window of 0 keeps every hit.
+    """
+    if not window:
+        return list(results)
+    order = sorted(range(len(results)), key=lambda i: (results[i].get('Backend', ''), results[i]['Episode'],
+                                                       results[i]['Timestamp']))
+    best = []
+    prev = None
+    for i in order:
+        r = results[i]
+        if prev is None or (r.get('Backend'), r['Episode']) != (prev.get('Backend'), prev['Episode']) or \
+                r['Timestamp'] - prev['Timestamp'] > window:
+            best.append(i)
+        else:
+            best[-1] = min(best[-1], i)
+        prev = r
+    return [results[i] for i in sorted(best)]
+
+
+def sample_frames(count, start, end, budget, focus=None):
+    """
+    Pick the indexes of up to `budget` of `count` context frames to show in
+    the GIF editor: the start and end frames, their neighbours, the first
+    and last frames, then frames splitting the biggest gaps. With a `focus`,
+    a run of consecutive frames around it takes the place of the neighbours.
+    """
+    if not budget or count <= budget:
+        return list(range(count))
+    wanted = [start, end]
+    if focus is not None:
+        width = max(1, budget - 2)
+        first = max(0, min(focus - width // 2, count - width))
+        wanted += range(first, first + width)
+    wanted += [start - 1, start + 1, end - 1, end + 1, 0, count - 1]
+    picked = set()
+    for i in wanted:
+        if len(picked) >= budget:
+            break
+        if 0 <= i < count:
+            picked.add(i)
+    while len(picked) < budget:
+        marks = sorted(picked)
+        gap, i = max((b - a, a) for a, b in zip(marks, marks[1:]))
+        if gap < 2:
+            break
+        picked.add(i + gap // 2)
+    return sorted(picked)
+
+
+CANCEL_ATTACHMENT = {
+    'callback_id': 'image_preview',
+    'actions': [
+        {
+            'name': 'cancel',
+            'text': 'Cancel',
+            'type': 'button',
+            'value': 'cancel'
+        }
+    ]
+}
 
 
 class Humorbot(object):
-    def __init__(self):
-        self.frink = Frinkiac()
-        self.morbo = Morbotron()
+    def __init__(self, config=None):
+        if config is None:
+            config = default_config()
+        self.config = config
+        self.executor = ThreadPoolExecutor(max_workers=int(config.lookup_workers))
+        self.state = state_store_from_config(config)
+        self.cross_stats = {'early': 0, 'complete': 0, 'budget': 0}
+        if not config.lazy_startup:
+            self.start()
         return super(Humorbot, self).__init__()
 
+    @lazy
+    def frink(self):
+        return Frinkiac(self.config)
+
+    @lazy
+    def morbo(self):
+        return Morbotron(self.config)
+
+    def start(self):
+        """
+        Build the backends and their matchers now, rather than on first use.
+        """
+        for backend in [self.morbo, self.frink]:
+            backend.matcher
+
     def backend(self, name):
         """
         Return the backend based on the name.
@@ -64,6 +183,114 @@ class Humorbot(object):
         else:
             return self.morbo
 
+    def other(self, backend):
+        """
+        Return the backend for the other show.
+        """
+        return self.frink if backend is self.morbo else self.morbo
+
+    def result_backend(self, r, backend):
+        """
+        Return the backend a search result came from, which after a
+        cross-backend search may not be the command's.
+        """
+        return self.backend(r['Backend']) if 'Backend' in r else backend
+
+    def search(self, command, query):
+        """
+        Search the command's backend, or both backends at once if
+        cross_search is on. Returns the command's backend and the results.
+        """
+        backend = self.backend(command)
+        if not self.config.cross_search:
+            return backend, backend.search(query)
+        owners = {self.executor.submit(self.scored_search, b, query): b for b in [backend, self.other(backend)]}
+        deadline = time.time() + float(self.config.cross_search_budget)
+        scored, errors = {}, {}
+        pending = set(owners)
+        while pending and not self.confident(scored):
+            done, pending = wait(pending, timeout=max(0, deadline - time.time()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for f in done:
+                try:
+                    scored[owners[f].name] = f.result()
+                except Exception as e:
+                    errors[owners[f].name] = e
+        return backend, self.merge(backend, scored, errors, pending)
+
+    def scored_search(self, backend, query):
+        """
+        Search a backend and score its results for ranking against the other
+        backend's.
+        """
+        results = backend.search(query)
+        try:
+            score = backend.relevance(results, query)
+        except RequestFailedException as e:
+            log.warning(u"Couldn't score {} results for '{}': {}".format(backend.name, query, e))
+            score = 0
+        return score, results
+
+    def confident(self, scored):
+        return any(score >= float(self.config.cross_search_confidence) for score, results in scored.values())
+
+    def merge(self, backend, scored, errors, pending):
+        """
+        Merge the results of a cross-backend search, tagging each with the
+        backend it came from. Each backend's results keep their order, ranked
+        by the score of its top result, with the command's backend first on a
+        tie. If neither search succeeded, the command's backend's error is
+        raised, or RequestFailedException if neither finished in time.
+        """
+        if not scored:
+            if not errors:
+                raise RequestFailedException(u"No search finished within {}s".format(self.config.cross_search_budget))
+            raise errors.get(backend.name) or list(errors.values())[0]
+        if not pending:
+            self.cross_stats['complete'] += 1
+        elif self.confident(scored):
+            self.cross_stats['early'] += 1
+        else:
+            self.cross_stats['budget'] += 1
+        ranked = sorted(scored.items(), key=lambda i: (-i[1][0], i[0] != backend.name))
+        log.debug(u"Cross-backend search scores: {}".format(', '.join('{}={}'.format(name, score) for name, (score, _)
+                                                                      in ranked)))
+        return [dict(r, Backend=name) for name, (score, results) in ranked for r in results]
+
+    def options(self, action, results, limit, overlay):
+        """
+        Pick up to `limit` search results to offer, one per scene, before
+        looking anything else up for them. Records how many caption and
+        context lookups that saved compared to taking the first `limit` hits.
+        """
+        picked = distinct_scenes(results, int(self.config.scene_window))[:limit]
+        lookups = (0 if overlay else 1) + (1 if action == 'gifs' else 0)
+        LOOKUPS_SAVED.observe(lookups * (min(limit, len(results)) - len(picked)), action=action)
+        return picked
+
+    def fan_out(self, func, items):
+        """
+        Start a lookup for each item on the worker pool, returning a list of
+        futures in the same order.
+        """
+        return [self.executor.submit(func, item) for item in items]
+
+    def gather(self, futures, default=None):
+        """
+        Wait for a list of futures and return their results in order. Lookups
+        that failed are logged and replaced with `default`, so one bad result
+        only degrades its own attachment.
+        """
+        results = []
+        for f in futures:
+            try:
+                results.append(f.result())
+            except Exception as e:
+                log.exception(u"Lookup failed: {}".format(e))
+                results.append(default)
+        return results
+
     def parse_args(self, text):
         """
         Parse arguments into the action, search query, and text overlay
@@ -100,25 +327,28 @@ class Humorbot(object):
         # Parse the command args
         (action, query, overlay) = self.parse_args(data['text'])
 
-        log.debug(u"Processing /{} {} action with query '{}' and text overlay '{}'".format(command, action, query,
-                                                                                           overlay))
-        log.info(u"command={}, username={}, team_domain={}, text={}".format(command, data['user_name'],
-                                                                            data['team_domain'], data['text']))
-
-        if action == 'help':
-            # Display usage
-            if 'morbo' in command:
-                res = {'text': MORBO_USAGE}
-            elif 'frink' in command:
-                res = {'text': FRINK_USAGE}
-        elif action in ['image', 'random']:
-            res = self.image(data['user_name'], query, overlay, command, random=(action == 'random'))
-        elif action == 'images':
-            res = self.images(data['user_name'], query, overlay, command)
-        elif action == 'gif':
-            res = self.gif(data['user_name'], query, overlay, command)
-        elif action == 'gifs':
-            res = self.gifs(data['user_name'], query, overlay, command)
+        log.debug(u"Processing /%s %s action with query '%s' and text overlay '%s'", command, action, query, overlay)
+        log.info(u"command=%s, username=%s, team_domain=%s, text=%s", command, data['user_name'], data['team_domain'],
+                 data['text'])
+
+        with ACTION_SECONDS.time(action=action):
+            try:
+                if action == 'help':
+                    # Display usage
+                    if 'morbo' in command:
+                        res = {'text': MORBO_USAGE}
+                    elif 'frink' in command:
+                        res = {'text': FRINK_USAGE}
+                elif action in ['image', 'random']:
+                    res = self.image(data['user_name'], query, overlay, command, random=(action == 'random'))
+                elif action == 'images':
+                    res = self.images(data['user_name'], query, overlay, command)
+                elif action == 'gif':
+                    res = self.gif(data['user_name'], query, overlay, command)
+                elif action == 'gifs':
+                    res = self.gifs(data['user_name'], query, overlay, command)
+            except CircuitOpenException as e:
+                res = unavailable(e.backend)
 
         return res
 
@@ -128,40 +358,44 @@ class Humorbot(object):
         a message.
         """
         action = payload['actions'][0]['name']
-        if action == 'cancel':
-            res = {'delete_original': True}
-        elif action in ['edit', 'start', 'end', 'show_hide_text']:
-            res = self.update_gif(payload)
-        elif action == 'send':
-            res = self.send(payload)
+        with ACTION_SECONDS.time(action=action):
+            if action == 'cancel':
+                res = {'delete_original': True}
+            elif action in EDITOR_ACTIONS:
+                res = self.update_gif(payload)
+            elif action == 'send':
+                res = self.send(payload)
 
         return res
 
+    def collect(self):
+        """
+        Report backend and GIF editor session stats to the metrics registry.
+        """
+        # Only backends already in use, as building them here would undo lazy startup
+        for backend in [self.__dict__[name] for name in ['morbo', 'frink'] if name in self.__dict__]:
+            for sample in backend.collect():
+                yield sample
+        for event, n in self.state.stats.items():
+            yield ('humorbot_gif_sessions_total', 'counter', 'GIF editor session store lookups and expirations',
+                   {'event': event}, n)
+        for outcome, n in self.cross_stats.items():
+            yield ('humorbot_cross_searches_total', 'counter',
+                   'Cross-backend searches by whether they finished early, completed or ran out of time',
+                   {'outcome': outcome}, n)
+
     def image(self, username, query, overlay='', command='morbo', random=False, multiple=False):
         """
         Implement the 'image' and 'random' actions.
         """
-        backend = self.backend(command)
-        search_result = backend.search(query)
+        backend, search_result = self.search(command, query)
         if len(search_result):
             r = choice(search_result) if random else search_result[0]
-            args = u'{} | {}'.format(query, overlay) if overlay else '{}{}'.format('random ' if random else '', query)
-            if not overlay:
-                overlay = backend.caption_for_query(r['Episode'], r['Timestamp'], query)
-            url = backend.image_url(r['Episode'], r['Timestamp'], overlay)
-            res = {
-                'text': '',
-                'response_type': 'in_channel',
-                'attachments': [
-                    {
-                        'title': u'@{}: /{} {}'.format(username, command, args),
-                        'fallback': u'@{}: /{} {} | {}'.format(username, command, args, url),
-                        'image_url': url
-                    }
-                ]
-            }
+            backend = self.result_backend(r, backend)
+            caption = overlay or backend.caption_for_query(r['Episode'], r['Timestamp'], query)
+            res = self.image_response(backend, username, query, overlay, command, random, r, caption)
         else:
-            res = {'text': u"No match for '{}'".format(query), 'response_type': 'ephemeral'}
+            res = self.no_match(query)
 
         return res
 
@@ -169,17 +403,94 @@ class Humorbot(object):
         """
         Implement the 'images' action.
         """
-        backend = self.backend(command)
-        search_result = self.backend(command).search(query)
+        backend, search_result = self.search(command, query)
 
-        # Generate attachments for MAX_IMAGES options
+        # Look up captions for MAX_IMAGES options concurrently
+        results = self.options('images', search_result, MAX_IMAGES, overlay)
+        if overlay:
+            captions = [overlay] * len(results)
+        else:
+            captions = self.gather(self.fan_out(lambda r: self.result_backend(r, backend).caption_for_query(
+                r['Episode'], r['Timestamp'], query), results), default='')
+
+        return self.images_response(backend, query, overlay, command, results, captions)
+
+    def gif(self, username, query, overlay='', command='morbo'):
+        """
+        Implement the 'gif' action
+        """
+        # Perform search
+        backend, search_result = self.search(command, query)
+
+        if len(search_result):
+            # Retrieve context frames for the gif using the first search result
+            # Maybe later we'll want to allow the user to select a frame to start with?
+            r = search_result[0]
+            backend = self.result_backend(r, backend)
+            context = backend.context_frames(r['Episode'], r['Timestamp'])
+            if len(context):
+                caption = overlay or backend.caption_for_query(r['Episode'], r['Timestamp'], query)
+                res = self.gif_response(backend, query, overlay, command, context, caption)
+            else:
+                res = {'text': 'Failed to get context', 'response_type': 'ephemeral'}
+        else:
+            res = self.no_match(query)
+
+        return res
+
+    def gifs(self, username, query, overlay='', command='morbo'):
+        """
+        Implement the 'gifs' action.
+        """
+        backend, search_result = self.search(command, query)
+
+        # Look up context frames and captions for MAX_GIFS options concurrently
+        results = self.options('gifs', search_result, MAX_GIFS, overlay)
+        backends = [self.result_backend(r, backend) for r in results]
+        contexts = self.fan_out(lambda i: backends[i].context_frames(results[i]['Episode'], results[i]['Timestamp']),
+                                range(len(results)))
+        if overlay:
+            captions = [overlay] * len(results)
+        else:
+            captions = self.gather(self.fan_out(lambda i: backends[i].caption_for_query(
+                results[i]['Episode'], results[i]['Timestamp'], query), range(len(results))), default='')
+        contexts = self.gather(contexts, default=[])
+
+        return self.gifs_response(backends, query, overlay, command, contexts, captions)
+
+    def no_match(self, query):
+        return {'text': u"No match for '{}'".format(query), 'response_type': 'ephemeral'}
+
+    def image_response(self, backend, username, query, overlay, command, random, r, caption):
+        """
+        Build the response for the 'image' and 'random' actions.
+        """
+        args = u'{} | {}'.format(query, overlay) if overlay else '{}{}'.format('random ' if random else '', query)
+        url = backend.image_url(r['Episode'], r['Timestamp'], caption)
+        res = {
+            'text': '',
+            'response_type': 'in_channel',
+            'attachments': [
+                {
+                    'title': u'@{}: /{} {}'.format(username, command, args),
+                    'fallback': u'@{}: /{} {} | {}'.format(username, command, args, url),
+                    'image_url': url
+                }
+            ]
+        }
+
+        return res
+
+    def images_response(self, backend, query, overlay, command, results, captions):
+        """
+        Build the response for the 'images' action from search results and
+        their captions.
+        """
+        # Generate attachments for each option
         attachments = []
-        ol = overlay
-        for r in search_result[:min(MAX_IMAGES, len(search_result))]:
+        for r, ol in zip(results, captions):
             args = u'images {} | {}'.format(query, overlay) if overlay else u'images {}'.format(query)
-            if not overlay:
-                ol = backend.caption_for_query(r['Episode'], r['Timestamp'], query)
-            url = backend.image_url(r['Episode'], r['Timestamp'], ol)
+            url = self.result_backend(r, backend).image_url(r['Episode'], r['Timestamp'], ol)
             attachments.append({
                 'fallback': overlay,
                 'image_url': url,
@@ -201,17 +512,7 @@ class Humorbot(object):
             })
 
         # Add a cancel button
-        attachments.append({
-            'callback_id': 'image_preview',
-            'actions': [
-                {
-                    'name': 'cancel',
-                    'text': 'Cancel',
-                    'type': 'button',
-                    'value': 'cancel'
-                }
-            ]
-        })
+        attachments.append(CANCEL_ATTACHMENT)
 
         # Build an ephemeral message for the preview
         res = {
@@ -222,141 +523,42 @@ class Humorbot(object):
 
         return res
 
-    def gif(self, username, query, overlay='', command='morbo'):
+    def gif_response(self, backend, query, overlay, command, context, caption):
         """
-        Implement the 'gif' action
+        Build the response for the 'gif' action from the context frames
+        around the first search result.
         """
-        # Perform search
-        backend = self.backend(command)
-        search_result = backend.search(query)
-
-        if len(search_result):
-            # Retrieve context frames for the gif using the first search result
-            # Maybe later we'll want to allow the user to select a frame to start with?
-            context = backend.context_frames(search_result[0]['Episode'], search_result[0]['Timestamp'])
-            if len(context):
-                # Generate initial gif using the entire context and return an ephemeral message
-                args = u'gif {} | {}'.format(query, overlay) if overlay else u'gif {}'.format(query)
-                if not overlay:
-                    overlay = backend.caption_for_query(search_result[0]['Episode'], search_result[0]['Timestamp'], query)
-                url = backend.gif_url(context[0]['Episode'], context[0]['Timestamp'], context[-1]['Timestamp'], overlay)
-                res = {
-                    'text': '',
-                    'response_type': 'ephemeral',
-                    'attachments': [
-                        {
-                            'fallback': url,
-                            'image_url': url,
-                            'callback_id': 'gif_builder',
-                            'actions': [
-                                {
-                                    'name': 'send',
-                                    'text': 'Send',
-                                    'type': 'button',
-                                    'style': 'good',
-                                    'value': json.dumps({
-                                        'url': url,
-                                        'text': overlay,
-                                        'args': args,
-                                        'command': command
-                                    })
-                                },
-                                {
-                                    'name': 'edit',
-                                    'text': 'Edit',
-                                    'type': 'button',
-                                    'value': json.dumps({
-                                        'args': args,
-                                        'text': overlay,
-                                        'episode': context[0]['Episode'],
-                                        'context': [i['Timestamp'] for i in context],
-                                        'start': context[0]['Timestamp'],
-                                        'end': context[-1]['Timestamp'],
-                                        'show_text': True,
-                                        'command': command
-                                    })
-                                },
-                                {
-                                    'name': 'cancel',
-                                    'text': 'Cancel',
-                                    'type': 'button',
-                                    'value': 'cancel'
-                                },
-                            ]
-                        },
-                    ]
-                }
-            else:
-                res = {'text': 'Failed to get context', 'response_type': 'ephemeral'}
-        else:
-            res = {'text': u"No match for '{}'".format(text), 'response_type': 'ephemeral'}
+        # Generate initial gif using the entire context and return an ephemeral message
+        args = u'gif {} | {}'.format(query, overlay) if overlay else u'gif {}'.format(query)
+        attachment = self.gif_attachment(backend, args, command, context, caption)
+        attachment['actions'].append({
+            'name': 'cancel',
+            'text': 'Cancel',
+            'type': 'button',
+            'value': 'cancel'
+        })
+        res = {
+            'text': '',
+            'response_type': 'ephemeral',
+            'attachments': [attachment]
+        }
 
         return res
 
-    def gifs(self, username, query, overlay='', command='morbo'):
+    def gifs_response(self, backends, query, overlay, command, contexts, captions):
         """
-        Implement the 'gifs' action.
+        Build the response for the 'gifs' action from the backend, context
+        frames and caption for each search result.
         """
-        backend = self.backend(command)
-        search_result = self.backend(command).search(query)
-
-        # Generate attachments for MAX_GIFS options
+        # Generate attachments for each option we got context for
         attachments = []
-        ol = overlay
-        for r in search_result[:min(MAX_GIFS, len(search_result))]:
-            context = backend.context_frames(r['Episode'], r['Timestamp'])
+        for backend, context, ol in zip(backends, contexts, captions):
             if len(context):
                 args = u'gifs {} | {}'.format(query, overlay) if overlay else u'gifs {}'.format(query)
-                if not overlay:
-                    ol = backend.caption_for_query(r['Episode'], r['Timestamp'], query)
-                url = backend.gif_url(context[0]['Episode'], context[0]['Timestamp'], context[-1]['Timestamp'], ol)
-                attachments.append({
-                    'fallback': url,
-                    'image_url': url,
-                    'callback_id': 'gif_builder',
-                    'actions': [
-                        {
-                            'name': 'send',
-                            'text': 'Send',
-                            'type': 'button',
-                            'style': 'good',
-                            'value': json.dumps({
-                                'url': url,
-                                'text': ol,
-                                'args': args,
-                                'command': command
-                            })
-                        },
-                        {
-                            'name': 'edit',
-                            'text': 'Edit',
-                            'type': 'button',
-                            'value': json.dumps({
-                                'args': args,
-                                'text': ol,
-                                'episode': context[0]['Episode'],
-                                'context': [i['Timestamp'] for i in context],
-                                'start': context[0]['Timestamp'],
-                                'end': context[-1]['Timestamp'],
-                                'show_text': True,
-                                'command': command
-                            })
-                        },
-                    ]
-                })
+                attachments.append(self.gif_attachment(backend, args, command, context, ol))
 
         # Add a cancel button
-        attachments.append({
-            'callback_id': 'image_preview',
-            'actions': [
-                {
-                    'name': 'cancel',
-                    'text': 'Cancel',
-                    'type': 'button',
-                    'value': 'cancel'
-                }
-            ]
-        })
+        attachments.append(CANCEL_ATTACHMENT)
 
         # Build an ephemeral message for the preview
         res = {
@@ -367,6 +569,52 @@ class Humorbot(object):
 
         return res
 
+    def gif_attachment(self, backend, args, command, context, text):
+        """
+        Build an attachment previewing a GIF of the whole context, with send
+        and edit buttons.
+        """
+        url = backend.gif_url(context[0]['Episode'], context[0]['Timestamp'], context[-1]['Timestamp'], text)
+        session = {
+            'args': args,
+            'text': text,
+            'episode': context[0]['Episode'],
+            'context': [i['Timestamp'] for i in context],
+            'command': command,
+            'backend': backend.name
+        }
+        return {
+            'fallback': url,
+            'image_url': url,
+            'callback_id': 'gif_builder',
+            'actions': [
+                {
+                    'name': 'send',
+                    'text': 'Send',
+                    'type': 'button',
+                    'style': 'good',
+                    'value': json.dumps({
+                        'url': url,
+                        'text': text,
+                        'args': args,
+                        'command': command
+                    })
+                },
+                {
+                    'name': 'edit',
+                    'text': 'Edit',
+                    'type': 'button',
+                    'value': json.dumps({
+                        'state': self.state.put(session),
+                        'restore': restore_info(session),
+                        'start': context[0]['Timestamp'],
+                        'end': context[-1]['Timestamp'],
+                        'show_text': True
+                    })
+                },
+            ]
+        }
+
     def send(self, payload):
         """
         Send an edited GIF or selected image.
@@ -389,18 +637,72 @@ class Humorbot(object):
 
         return res
 
+    def missing_session(self, payload):
+        """
+        Return the restore info from a GIF editor button whose session isn't
+        in the state store, or None if it's there or can't be restored.
+        """
+        action = payload['actions'][0]
+        if action['name'] not in EDITOR_ACTIONS:
+            return None
+        data = json.loads(action['value'])
+        if 'state' not in data or 'restore' not in data or self.state.get(data['state']) is not None:
+            return None
+        return data['restore']
+
+    def restore_session(self, state_id, restore, context):
+        """
+        Rebuild a GIF editor session from a button's restore info and the
+        context frames it spans, and store it under its old id.
+        """
+        session = {k: restore[k] for k in ['args', 'text', 'episode', 'command', 'backend']}
+        session['context'] = [i['Timestamp'] for i in context]
+        self.state.put(session, state_id)
+        return session
+
+    def restore_context(self, restore):
+        """
+        Fetch the context frames a button's restore info spans.
+        """
+        start, end = restore['span']
+        return self.backend(restore['backend']).context_frames(restore['episode'], start, 0, end - start)
+
     def update_gif(self, payload):
         """
         Update a GIF in some way - change the start or end frame, toggle text overlay.
+
+        The episode, context frames and text for an editing session are kept
+        in the state store, so each button only carries the session id and
+        the start, end and text settings it would change to. Buttons also
+        carry enough to rebuild the session from the backend if the store
+        doesn't have it, eg. because another worker started it or this one
+        has restarted since.
         """
         data = json.loads(payload['actions'][0]['value'])
-        backend = self.backend(data['command'])
+        if 'state' in data:
+            state_id = data['state']
+            session = self.state.get(state_id)
+            if session is None and 'restore' in data:
+                try:
+                    session = self.restore_session(state_id, data['restore'], self.restore_context(data['restore']))
+                except RequestFailedException:
+                    session = None
+            if session is None or data['start'] not in session['context'] or data['end'] not in session['context']:
+                return EXPIRED_EDITOR
+            data.update(session)
+        else:
+            # Buttons from before session state carried everything themselves
+            state_id = self.state.put({k: data[k] for k in ['args', 'text', 'episode', 'context', 'command']})
+
+        backend = self.backend(data.get('backend', data['command']))
         url = backend.gif_url(data['episode'], data['start'], data['end'], data['text'] if data['show_text'] else '')
+        view = {'state': state_id, 'restore': restore_info(data), 'start': data['start'], 'end': data['end'],
+                'show_text': data['show_text']}
+        if data.get('zoom') is not None:
+            view['zoom'] = data['zoom']
         attachments = []
 
         # Build an attachment with send, show/hide text and cancel buttons
-        show_hide_data = dict(data)
-        show_hide_data['show_text'] = not show_hide_data['show_text']
         attachments.append({
             'fallback': url,
             'image_url': url,
@@ -421,7 +723,7 @@ class Humorbot(object):
                     'name': 'show_hide_text',
                     'text': '{} text'.format('Hide' if data['show_text'] else 'Show'),
                     'type': 'button',
-                    'value': json.dumps(show_hide_data)
+                    'value': json.dumps(dict(view, show_text=not data['show_text']))
                 },
                 {
                     'name': 'cancel',
@@ -431,38 +733,51 @@ class Humorbot(object):
                 },
             ]
         })
+        if 'zoom' in view:
+            attachments[0]['actions'].insert(2, {
+                'name': 'zoom',
+                'text': 'Zoom out',
+                'type': 'button',
+                'value': json.dumps({k: v for k, v in view.items() if k != 'zoom'})
+            })
 
-        # Build an attachment for each frame with a start and end button
-        for timestamp in data['context']:
-            start_data = dict(data)
-            start_data['start'] = timestamp
-            end_data = dict(data)
-            end_data['end'] = timestamp
-            i = data['context'].index(timestamp)
-            if i >= data['context'].index(data['start']) and i <= data['context'].index(data['end']):
-                color = 'good'
-            else:
-                color = ''
+        # Build an attachment with start and end buttons for each frame, or for a sample of the frames in long
+        # contexts. Zooming in shows every frame around the one chosen, from the context kept in the session.
+        context = data['context']
+        start = context.index(data['start'])
+        end = context.index(data['end'])
+        focus = context.index(view['zoom']) if view.get('zoom') in context else None
+        shown = sample_frames(len(context), start, end, int(self.config.gif_editor_frames), focus)
+        for i in shown:
+            timestamp = context[i]
+            actions = [
+                {
+                    'name': 'start',
+                    'text': 'Start frame',
+                    'type': 'button',
+                    'value': json.dumps(dict(view, start=timestamp))
+                },
+                {
+                    'name': 'end',
+                    'text': 'End frame',
+                    'type': 'button',
+                    'value': json.dumps(dict(view, end=timestamp))
+                },
+            ]
+            if len(shown) < len(context):
+                actions.append({
+                    'name': 'zoom',
+                    'text': 'Zoom',
+                    'type': 'button',
+                    'value': json.dumps(dict(view, zoom=timestamp))
+                })
             attachments.append({
                 'text': 'Frame {} of episode {}'.format(timestamp, data['episode']),
                 'fallback': data['text'],
                 'thumb_url': backend.thumb_url(data['episode'], timestamp),
                 'callback_id': 'gif_builder',
-                'color': color,
-                'actions': [
-                    {
-                        'name': 'start',
-                        'text': 'Start frame',
-                        'type': 'button',
-                        'value': json.dumps(start_data)
-                    },
-                    {
-                        'name': 'end',
-                        'text': 'End frame',
-                        'type': 'button',
-                        'value': json.dumps(end_data)
-                    },
-                ]
+                'color': 'good' if start <= i <= end else '',
+                'actions': actions
             })
 
         # Build response
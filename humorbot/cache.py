@@ -0,0 +1,517 @@
+import os
+import re
+import json
+import math
+import time
+import sqlite3
+import threading
+from array import array
+from contextlib import closing
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+
+def normalize_query(query):
+    """
+    Normalise a search query so trivially different queries share a cache key.
+
+    Case, punctuation and runs of whitespace are ignored.
+    """
+    return u' '.join(re.sub(r'[^\w\s]', u' ', query.lower(), flags=re.UNICODE).split())
+
+
+class LRUCache(object):
+    """
+    A thread-safe in-process cache with a TTL and LRU eviction.
+
+    Entries are evicted least-recently-used first when there are more than
+    `max_entries` of them, or when their total size exceeds `max_bytes`. The
+    size of an entry is the length of its JSON encoding unless given, and is
+    only worked out when there is a `max_bytes`.
+
+    With `keep_stale`, expired entries are kept until they're evicted or
+    replaced, so they can still be fetched with `get(key, stale=True)`.
+    """
+    def __init__(self, ttl=300, max_entries=1000, max_bytes=None, keep_stale=False):
+        self.ttl = ttl
+        self.keep_stale = keep_stale
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        return super(LRUCache, self).__init__()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, stale=False):
+        """
+        Return the cached value for `key`, or None if it's missing or expired
+        (unless `stale` is set).
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            value, size, expires = entry
+            if stale:
+                return value
+            if expires is not None and expires < time.time():
+                if not self.keep_stale:
+                    self.remove(key)
+                self.stats['expirations'] += 1
+                self.stats['misses'] += 1
+                return None
+            self.entries[key] = self.entries.pop(key)
+            self.stats['hits'] += 1
+            return value
+
+    def set(self, key, value, size=None):
+        """
+        Cache `value` under `key`, evicting older entries as necessary.
+        """
+        if not self.max_bytes:
+            size = 0
+        elif size is None:
+            size = len(json.dumps(value))
+        expires = time.time() + self.ttl if self.ttl else None
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (value, size, expires)
+            self.size += size
+            while len(self.entries) > 1 and ((self.max_entries and len(self.entries) > self.max_entries) or
+                                             (self.max_bytes and self.size > self.max_bytes)):
+                self.remove(next(iter(self.entries)))
+                self.stats['evictions'] += 1
+
+    def remove(self, key):
+        """
+        Remove an entry. The caller must hold the lock.
+        """
+        value, size, expires = self.entries.pop(key)
+        self.size -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class EpisodeCaptions(object):
+    """
+    Known subtitles for one episode, as parallel arrays sorted by start time.
+
+    Each subtitle maps to the caption response group it was last seen in, so
+    a lookup can return the same list of subtitles the API would.
+    """
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.groups = []
+        return super(EpisodeCaptions, self).__init__()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def lookup(self, timestamp):
+        i = bisect_right(self.starts, timestamp) - 1
+        if i >= 0 and self.ends[i] >= timestamp:
+            return self.groups[i]
+        return None
+
+    def add(self, subtitles):
+        """
+        Add a group of subtitles, returning the number of new spans indexed.
+        """
+        added = 0
+        for sub in subtitles:
+            start = sub['StartTimestamp']
+            i = bisect_left(self.starts, start)
+            if i < len(self.starts) and self.starts[i] == start:
+                self.ends[i] = sub['EndTimestamp']
+                self.groups[i] = subtitles
+            else:
+                self.starts.insert(i, start)
+                self.ends.insert(i, sub['EndTimestamp'])
+                self.groups.insert(i, subtitles)
+                added += 1
+        return added
+
+
+class CaptionIndex(object):
+    """
+    A per-episode interval index of subtitles seen in caption responses.
+
+    Any timestamp that falls inside a known subtitle span can be answered
+    without asking the API again. Memory is bounded by `max_subtitles`, with
+    whole episodes evicted least-recently-used first.
+    """
+    def __init__(self, max_subtitles=50000):
+        self.max_subtitles = max_subtitles
+        self.episodes = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        return super(CaptionIndex, self).__init__()
+
+    def lookup(self, episode, timestamp):
+        """
+        Return the subtitles covering `timestamp`, or None if it isn't known.
+        """
+        with self.lock:
+            ep = self.episodes.get(episode)
+            group = ep.lookup(timestamp) if ep is not None else None
+            if group is None:
+                self.stats['misses'] += 1
+                return None
+            self.episodes[episode] = self.episodes.pop(episode)
+            self.stats['hits'] += 1
+            return list(group)
+
+    def add(self, episode, subtitles):
+        """
+        Index the subtitles from a caption response.
+        """
+        if not len(subtitles):
+            return
+        subtitles = list(subtitles)
+        with self.lock:
+            ep = self.episodes.pop(episode, None) or EpisodeCaptions()
+            self.episodes[episode] = ep
+            self.size += ep.add(subtitles)
+            while len(self.episodes) > 1 and self.max_subtitles and self.size > self.max_subtitles:
+                key, evicted = self.episodes.popitem(last=False)
+                self.size -= len(evicted)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.episodes.clear()
+            self.size = 0
+
+
+class EpisodeTimeline(object):
+    """
+    Known frames for one episode, as parallel arrays of timestamps and frame
+    ids sorted by timestamp, plus the spans of time known to be complete.
+    """
+    def __init__(self):
+        self.timestamps = array('I')
+        self.ids = array('I')
+        self.spans = []
+        return super(EpisodeTimeline, self).__init__()
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def gaps(self, start, end):
+        """
+        Return the parts of the span from `start` to `end` that aren't
+        covered yet, as (start, end) pairs.
+        """
+        res = []
+        cursor = start
+        for s, e in self.spans:
+            if s > end:
+                break
+            if e < cursor:
+                continue
+            if s > cursor:
+                res.append((cursor, s - 1))
+            cursor = e + 1
+        if cursor <= end:
+            res.append((cursor, end))
+        return res
+
+    def frames(self, start, end):
+        lo = bisect_left(self.timestamps, start)
+        hi = bisect_right(self.timestamps, end)
+        return list(zip(self.ids[lo:hi], self.timestamps[lo:hi]))
+
+    def add(self, start, end, frames):
+        """
+        Merge the frames fetched for a span, returning the number of new
+        frames.
+        """
+        added = 0
+        for frame in frames:
+            ts = frame['Timestamp']
+            i = bisect_left(self.timestamps, ts)
+            if i == len(self.timestamps) or self.timestamps[i] != ts:
+                self.timestamps.insert(i, ts)
+                self.ids.insert(i, frame['Id'])
+                added += 1
+        spans = []
+        for s, e in sorted(self.spans + [(start, end)]):
+            if spans and s <= spans[-1][1] + 1:
+                spans[-1] = (spans[-1][0], max(spans[-1][1], e))
+            else:
+                spans.append((s, e))
+        self.spans = spans
+        return added
+
+
+class TimelineCache(object):
+    """
+    Per-episode timelines of frames seen in context responses.
+
+    A span of time the timeline already covers can be answered by slicing
+    it, and a partly covered one only needs its gaps fetching. Memory is
+    bounded by `max_frames`, with whole episodes evicted least-recently-used
+    first.
+    """
+    def __init__(self, max_frames=200000):
+        self.max_frames = max_frames
+        self.episodes = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'partial': 0, 'misses': 0, 'evictions': 0}
+        return super(TimelineCache, self).__init__()
+
+    def gaps(self, episode, start, end):
+        """
+        Return the parts of a span not covered by an episode's timeline.
+        """
+        with self.lock:
+            ep = self.episodes.get(episode)
+            res = ep.gaps(start, end) if ep is not None else [(start, end)]
+            if not res:
+                self.stats['hits'] += 1
+            elif res == [(start, end)]:
+                self.stats['misses'] += 1
+            else:
+                self.stats['partial'] += 1
+            if ep is not None:
+                self.episodes[episode] = self.episodes.pop(episode)
+            return res
+
+    def frames(self, episode, start, end):
+        """
+        Return the known frames in a span, in the same form as the API.
+        """
+        with self.lock:
+            ep = self.episodes.get(episode)
+            if ep is None:
+                return []
+            return [{'Id': i, 'Episode': episode, 'Timestamp': ts} for i, ts in ep.frames(start, end)]
+
+    def add(self, episode, span, frames):
+        """
+        Merge the frames fetched for a (start, end) span of an episode.
+        """
+        with self.lock:
+            ep = self.episodes.pop(episode, None) or EpisodeTimeline()
+            self.episodes[episode] = ep
+            self.size += ep.add(span[0], span[1], frames)
+            while len(self.episodes) > 1 and self.max_frames and self.size > self.max_frames:
+                key, evicted = self.episodes.popitem(last=False)
+                self.size -= len(evicted)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.episodes.clear()
+            self.size = 0
+
+
+class DiskCache(object):
+    """
+    A persistent cache in an SQLite database in WAL mode.
+
+    It's safe to share between processes, so every gunicorn worker on a host
+    (and the next dyno after a restart, if the file survives) sees the same
+    entries. Entries expire after `ttl` seconds, and the least recently used
+    are evicted once the total size passes `max_bytes`.
+    """
+    # How many writes between checks of the total size
+    EVICT_INTERVAL = 100
+
+    # Don't bother recording a read if the entry was read more recently than this
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, path, ttl=86400, max_bytes=100000000):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+        # Use a throwaway connection, as SQLite connections mustn't be carried across a fork
+        with closing(self.connect()) as db, db:
+            db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, size INTEGER, '
+                       'expires REAL, accessed REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+        return super(DiskCache, self).__init__()
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def db(self):
+        """
+        Return a connection for this thread, reconnecting after a fork.
+        """
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.db = self.connect()
+            self.local.pid = os.getpid()
+        return self.local.db
+
+    def count(self, stat, n=1):
+        with self.lock:
+            self.stats[stat] += n
+
+    def get(self, key):
+        """
+        Return the cached value for `key`, or None if it's missing or expired.
+        """
+        key = json.dumps(key)
+        now = time.time()
+        db = self.db()
+        row = db.execute('SELECT value, expires, accessed FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < now:
+            self.count('misses')
+            return None
+        if row[2] < now - self.TOUCH_INTERVAL:
+            with db:
+                db.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        self.count('hits')
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """
+        Cache `value` under `key`.
+        """
+        data = json.dumps(value)
+        now = time.time()
+        db = self.db()
+        with db:
+            db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+                       (json.dumps(key), data, len(data), now + self.ttl, now))
+        with self.lock:
+            self.writes += 1
+            evict = self.writes % self.EVICT_INTERVAL == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove expired entries, then the least recently used entries until the
+        cache is under its size limit.
+        """
+        db = self.db()
+        with db:
+            self.count('expirations', db.execute('DELETE FROM cache WHERE expires < ?', (time.time(),)).rowcount)
+            size, count = db.execute('SELECT COALESCE(SUM(size), 0), COUNT(*) FROM cache').fetchone()
+            while self.max_bytes and size > self.max_bytes:
+                # Take off about enough of the oldest entries at their average size, and go again if they were smaller
+                n = max(1, int(math.ceil((size - self.max_bytes) * count / float(size))))
+                size -= db.execute('SELECT COALESCE(SUM(size), 0) FROM (SELECT size FROM cache ORDER BY accessed '
+                                   'LIMIT ?)', (n,)).fetchone()[0]
+                evicted = db.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed '
+                                     'LIMIT ?)', (n,)).rowcount
+                count -= evicted
+                self.count('evictions', evicted)
+
+    def compact(self):
+        """
+        Evict what needs evicting, then reclaim the free space in the database
+        and truncate the write-ahead log.
+        """
+        self.evict()
+        db = self.db()
+        db.execute('VACUUM')
+        db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def __len__(self):
+        return self.db().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+class TieredCache(object):
+    """
+    An in-memory cache in front of an optional disk cache.
+
+    Values found on disk are promoted to memory. Hits, misses and lookup
+    latency are kept for each tier.
+    """
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self.lock = threading.Lock()
+        self.time = {'memory': 0.0, 'disk': 0.0}
+        return super(TieredCache, self).__init__()
+
+    def get(self, key, stale=False):
+        """
+        Look in memory, then on disk. With `stale`, return expired data from
+        memory without looking on disk.
+        """
+        if stale:
+            return self.memory.get(key, stale=True)
+        start = time.time()
+        value = self.memory.get(key)
+        mid = time.time()
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+            with self.lock:
+                self.time['disk'] += time.time() - mid
+        with self.lock:
+            self.time['memory'] += mid - start
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def clear(self):
+        """
+        Clear the in-memory tier. The disk tier is shared with other processes
+        and is left alone.
+        """
+        self.memory.clear()
+
+    def tier_stats(self):
+        """
+        Return hit rates and mean lookup latency for each tier.
+        """
+        res = {}
+        for name, tier in [('memory', self.memory), ('disk', self.disk)]:
+            if tier is not None:
+                lookups = tier.stats['hits'] + tier.stats['misses']
+                res[name] = dict(tier.stats, hit_rate=float(tier.stats['hits']) / lookups if lookups else 0.0,
+                                 mean_ms=self.time[name] * 1000 / lookups if lookups else 0.0)
+        return res
+
+
+def disk_usage(path):
+    """
+    Return the size of an SQLite database including its write-ahead log.
+    """
+    return sum(os.path.getsize(p) for p in [path, path + '-wal'] if os.path.exists(p))
+
+
+def add_arguments(parser):
+    subparsers = parser.add_subparsers(dest='cache_command')
+    compact = subparsers.add_parser('compact', help='evict expired entries and reclaim space in the disk cache')
+    compact.add_argument('--path', help='cache database, disk_cache_path from the config by default')
+
+
+def main(args):
+    if args.cache_command == 'compact':
+        from . import config
+        path = args.path or config.disk_cache_path
+        if not path:
+            raise SystemExit("No disk cache configured, set disk_cache_path or pass --path")
+        path = os.path.expanduser(str(path))
+        before = disk_usage(path)
+        DiskCache(path, ttl=int(config.disk_cache_ttl), max_bytes=int(config.disk_cache_max_bytes)).compact()
+        print("Compacted {} from {} to {} bytes".format(path, before, disk_usage(path)))
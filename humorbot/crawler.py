@@ -0,0 +1,218 @@
+"""
+Mirror subtitle and frame data from Morbotron or Frinkiac, eg. to build a
+local search index.
+
+Each episode is walked from the start in windows of context frames, and
+captions are fetched for frames not covered by a subtitle seen already.
+Records are streamed to one gzipped NDJSON shard per episode:
+
+    {"Episode": "S05E02", "Frames": [274432, 274641, ...]}
+    {"Episode": "S05E02", "Id": 155870, "StartTimestamp": 274432, ..., "Content": "..."}
+
+Finished episodes are noted in a checkpoint file in the output directory,
+so an interrupted crawl picks up where it stopped. Episodes can be given as
+keys like S05E02, or whole seasons like S05 to try episodes 1-30.
+
+    humorbot crawl S05 S06E01 --backend morbo --output ~/.humorbot/morbo-crawl --rate 5
+"""
+import os
+import re
+import json
+import gzip
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .backend import Morbotron, Frinkiac, NotFoundException
+
+log = logging.getLogger()
+
+SEASON = re.compile(r'^S(\d+)$', re.IGNORECASE)
+EPISODES_PER_SEASON = 30
+CHECKPOINT = 'checkpoint.json'
+
+
+def expand_episodes(specs):
+    """
+    Expand season keys like S05 into S05E01 to S05E30, keeping order and
+    dropping duplicates.
+    """
+    res = []
+    for spec in specs:
+        m = SEASON.match(spec)
+        keys = ['S{:02d}E{:02d}'.format(int(m.group(1)), e) for e in range(1, EPISODES_PER_SEASON + 1)] if m \
+            else [spec.upper()]
+        res += [k for k in keys if k not in res]
+    return res
+
+
+class RateLimiter(object):
+    """
+    Spaces out calls so there are no more than `rate` a second across all
+    threads. A rate of 0 means no limit.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next = 0
+        self.lock = threading.Lock()
+        return super(RateLimiter, self).__init__()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.time()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Crawler(object):
+    """
+    Crawls episodes from a backend into NDJSON shards in `path`.
+    """
+    def __init__(self, backend, path, workers=4, rate=5, window=8000, caption_step=1000, max_gap=60000,
+                 max_timestamp=3600000):
+        self.backend = backend
+        self.path = path
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.window = window
+        self.caption_step = caption_step
+        self.max_gap = max_gap
+        self.max_timestamp = max_timestamp
+        self.lock = threading.Lock()
+        self.stats = {'episodes': 0, 'empty': 0, 'failed': 0, 'requests': 0, 'subtitles': 0, 'frames': 0}
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.done = self.load_checkpoint()
+        return super(Crawler, self).__init__()
+
+    def load_checkpoint(self):
+        try:
+            with open(os.path.join(self.path, CHECKPOINT)) as f:
+                return set(json.load(f)['done'])
+        except (IOError, OSError, ValueError, KeyError):
+            return set()
+
+    def checkpoint(self, episode):
+        """
+        Mark an episode as finished.
+        """
+        with self.lock:
+            self.done.add(episode)
+            filename = os.path.join(self.path, CHECKPOINT)
+            with open(filename + '.tmp', 'w') as f:
+                json.dump({'done': sorted(self.done)}, f)
+            os.rename(filename + '.tmp', filename)
+
+    def count(self, stat, n=1):
+        with self.lock:
+            self.stats[stat] += n
+
+    def get(self, url, endpoint):
+        self.limiter.wait()
+        self.count('requests')
+        return self.backend.get(url, endpoint)
+
+    def shard(self, episode):
+        return os.path.join(self.path, '{}-{}.ndjson.gz'.format(self.backend.name, episode))
+
+    def crawl(self, episodes):
+        """
+        Crawl every episode that isn't finished yet. Returns the stats.
+        """
+        todo = [e for e in expand_episodes(episodes) if e not in self.done]
+        with ThreadPoolExecutor(self.workers) as executor:
+            list(executor.map(self.crawl_episode, todo))
+        return self.stats
+
+    def crawl_episode(self, episode):
+        """
+        Crawl one episode into a shard, which only appears under its real
+        name once the episode is finished.
+        """
+        part = self.shard(episode) + '.part'
+        try:
+            with gzip.open(part, 'wb') as f:
+                found = self.walk(episode, lambda record: f.write((json.dumps(record) + '\n').encode('utf-8')))
+        except Exception as e:
+            log.error("Failed to crawl {}: {}".format(episode, e))
+            self.count('failed')
+            return
+        if found:
+            os.rename(part, self.shard(episode))
+            self.count('episodes')
+        else:
+            os.remove(part)
+            self.count('empty')
+        self.checkpoint(episode)
+
+    def walk(self, episode, write):
+        """
+        Walk an episode window by window, passing each record to `write`.
+        Returns False if the episode has no frames.
+        """
+        half = self.window // 2
+        cursor = 0
+        last_frame = None
+        seen = set()
+        spans = []
+        last_caption = None
+        while cursor <= self.max_timestamp:
+            if (last_frame if last_frame is not None else 0) + self.max_gap < cursor:
+                break
+            frames = [f['Timestamp'] for f in self.get(self.backend.frames_url(episode, cursor + half, half, half),
+                                                       'frames')]
+            frames = sorted(ts for ts in set(frames) if cursor <= ts < cursor + self.window)
+            cursor += self.window
+            if not frames:
+                continue
+            last_frame = frames[-1]
+            write({'Episode': episode, 'Frames': frames})
+            self.count('frames', len(frames))
+
+            for ts in frames:
+                if any(start <= ts <= end for start, end in spans):
+                    continue
+                if last_caption is not None and ts < last_caption + self.caption_step:
+                    continue
+                last_caption = ts
+                # Any other failure fails the episode, so it isn't checkpointed with captions missing
+                try:
+                    subs = self.get(self.backend.caption_url(episode, ts), 'caption')['Subtitles']
+                except NotFoundException:
+                    log.warning("No captions for {} at {}".format(episode, ts))
+                    continue
+                for sub in subs:
+                    spans.append((sub['StartTimestamp'], sub['EndTimestamp']))
+                    if sub['Id'] not in seen:
+                        seen.add(sub['Id'])
+                        write(dict(sub, Episode=episode))
+                        self.count('subtitles')
+                spans = spans[-20:]
+        return last_frame is not None
+
+
+def add_arguments(parser):
+    parser.add_argument('episodes', nargs='+', help='episode keys (eg. S05E02) or seasons (eg. S05)')
+    parser.add_argument('--backend', choices=['morbo', 'frink'], default='morbo')
+    parser.add_argument('--output', required=True, help='directory for shards and the checkpoint')
+    parser.add_argument('--workers', type=int, default=4, help='episodes to crawl at once')
+    parser.add_argument('--rate', type=float, default=5, help='maximum requests per second, 0 for no limit')
+    parser.add_argument('--window', type=int, default=8000, help='milliseconds of frames to fetch per request')
+    parser.add_argument('--max-gap', type=int, default=60000,
+                        help='stop an episode after this many milliseconds without frames')
+
+
+def main(args):
+    from . import config
+    # An open breaker would fail every remaining episode instantly, so let the transport's retries handle errors
+    config.breaker_enabled = False
+    backend = (Morbotron if args.backend == 'morbo' else Frinkiac)(config=config)
+    crawler = Crawler(backend, os.path.expanduser(args.output), workers=args.workers, rate=args.rate,
+                      window=args.window, max_gap=args.max_gap)
+    start = time.time()
+    stats = crawler.crawl(args.episodes)
+    print(json.dumps(dict(stats, seconds=round(time.time() - start, 1)), indent=2, sort_keys=True))
@@ -0,0 +1,105 @@
+import json
+import hashlib
+import threading
+from .cache import LRUCache
+from .transport import Flight
+
+
+def fingerprint(*parts):
+    """
+    Hash the parts of a request that identify it.
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def command_key(data):
+    """
+    Identify a slash command by its trigger id, or failing that by who sent
+    what, where.
+    """
+    if data.get('trigger_id'):
+        return ('command', data['trigger_id'])
+    return ('command', fingerprint(data.get('team_id'), data.get('channel_id'), data.get('user_id'),
+                                   data.get('user_name'), data.get('command'), data.get('text')))
+
+
+def action_key(payload):
+    """
+    Identify a button click by its trigger id, or failing that by who
+    clicked which button on which message, and when.
+    """
+    if payload.get('trigger_id'):
+        return ('action', payload['trigger_id'])
+    return ('action', fingerprint(payload.get('team'), payload.get('user'), payload.get('action_ts'),
+                                  payload.get('message_ts'), payload.get('actions')))
+
+
+class Deduplicator(object):
+    """
+    Suppresses duplicate deliveries of the same Slack request.
+
+    Slack retries a request it didn't get a timely response to. A retry that
+    arrives while the original is still being processed waits for and
+    shares its response, and one that arrives afterwards gets the response
+    the original returned, for up to `ttl` seconds. Only retries are
+    answered from the cache, so a user repeating a command still gets a
+    fresh response.
+    """
+    def __init__(self, ttl=60, max_entries=10000):
+        self.responses = LRUCache(ttl=ttl, max_entries=max_entries)
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.stats = {'attached': 0, 'replayed': 0}
+        return super(Deduplicator, self).__init__()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(ttl=int(config.dedupe_ttl), max_entries=int(config.dedupe_max_entries))
+
+    def do(self, key, func, retry=False):
+        """
+        Return `func()`, or the response to an earlier delivery of the same
+        request if this is a retry.
+        """
+        if retry:
+            res = self.responses.get(key)
+            if res is not None:
+                self.count('replayed')
+                return res
+            with self.lock:
+                flight = self.flights.get(key)
+            if flight is not None:
+                self.count('attached')
+                flight.event.wait()
+                if flight.error is not None:
+                    raise flight.error
+                return flight.result
+
+        # Originals always run, and retries attach to the latest one
+        flight = Flight()
+        with self.lock:
+            self.flights[key] = flight
+        try:
+            flight.result = func()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            flight.event.set()
+        self.responses.set(key, flight.result)
+        return flight.result
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def collect(self):
+        """
+        Report suppressed duplicates to the metrics registry.
+        """
+        for outcome, n in self.stats.items():
+            yield ('humorbot_duplicate_requests_total', 'counter', 'Slack retries answered without reprocessing',
+                   {'outcome': outcome}, n)
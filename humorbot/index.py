@@ -0,0 +1,261 @@
+"""
+A local full-text index of subtitles, so searches can be answered without
+calling the API.
+
+An index is a directory of flat files that are memory-mapped when loaded,
+so every worker on a host shares one copy through the page cache:
+
+    meta.json       episode keys, and each token's slice of the postings
+    postings.bin    uint32 subtitle numbers, grouped by token
+    subtitles.bin   uint32 (episode, start, end, representative timestamp) rows
+    offsets.bin     uint32 offset of each subtitle's text, plus the end
+    text.bin        normalised UTF-8 subtitle text, each padded with spaces
+
+Indexes are built from NDJSON files (optionally gzipped) of subtitle
+records, as returned in the `Subtitles` of caption responses, or of whole
+caption responses:
+
+    humorbot index build subtitles.ndjson.gz --output ~/.humorbot/morbo-index
+"""
+import os
+import sys
+import gzip
+import json
+import mmap
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from array import array
+from bisect import bisect_left
+from .cache import normalize_query
+
+log = logging.getLogger()
+
+INDEX_VERSION = 2
+COLUMNS = 4
+MAX_RESULTS = 36
+MAX_CANDIDATES = 5000
+
+
+def read_records(paths):
+    """
+    Yield subtitle records from NDJSON files of subtitles or caption
+    responses.
+    """
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    log.warning("Skipping bad record in {}".format(path))
+                    continue
+                if 'Subtitles' in record:
+                    for sub in record['Subtitles']:
+                        yield sub
+                elif 'Content' in record:
+                    yield record
+
+
+def write_array(path, values):
+    with open(path, 'wb') as f:
+        array('I', values).tofile(f)
+
+
+def build_index(records, path):
+    """
+    Build an index from subtitle records into the directory `path`,
+    replacing any index already there. Returns the number of subtitles.
+    """
+    subs = {}
+    for r in records:
+        subs[(r['Episode'], r['StartTimestamp'])] = r
+    # Subtitles are numbered shortest first, so postings list the closest matches first
+    texts = {k: normalize_query(r['Content']) for k, r in subs.items()}
+    subs = [(texts[k], subs[k]) for k in sorted(subs, key=lambda k: (len(texts[k]), k))]
+    episodes = sorted(set(s['Episode'] for normalised, s in subs))
+    episode_ids = {e: i for i, e in enumerate(episodes)}
+
+    rows = array('I')
+    offsets = array('I', [0])
+    text = []
+    size = 0
+    postings = {}
+    for n, (normalised, sub) in enumerate(subs):
+        rows.extend([episode_ids[sub['Episode']], sub['StartTimestamp'], sub['EndTimestamp'],
+                     sub.get('RepresentativeTimestamp', sub['StartTimestamp'])])
+        content = u' {} '.format(normalised).encode('utf-8')
+        text.append(content)
+        size += len(content)
+        offsets.append(size)
+        for token in set(normalised.split()):
+            postings.setdefault(token, []).append(n)
+
+    tokens = {}
+    flat = array('I')
+    for token in sorted(postings):
+        tokens[token] = [len(flat), len(postings[token])]
+        flat.extend(postings[token])
+
+    parent = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+    tmp = tempfile.mkdtemp(dir=parent)
+    write_array(os.path.join(tmp, 'postings.bin'), flat)
+    write_array(os.path.join(tmp, 'subtitles.bin'), rows)
+    write_array(os.path.join(tmp, 'offsets.bin'), offsets)
+    with open(os.path.join(tmp, 'text.bin'), 'wb') as f:
+        f.write(b''.join(text))
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'byteorder': sys.byteorder, 'built': time.time(),
+                   'subtitles': len(subs), 'episodes': episodes, 'tokens': tokens}, f)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp, path)
+    return len(subs)
+
+
+class SubtitleIndex(object):
+    """
+    A memory-mapped subtitle index, loaded from a directory written by
+    `build_index`.
+
+    Queries match subtitles containing every token of the normalised query.
+    Subtitles containing the query as a phrase rank first. Within each group
+    shorter subtitles rank higher, as the query is more of what was said,
+    which puts the same subtitle first as the search API. Ties are in episode
+    order.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['version'] != INDEX_VERSION or meta['byteorder'] != sys.byteorder:
+            raise ValueError("Incompatible search index at {}".format(path))
+        self.episodes = meta['episodes']
+        self.tokens = meta['tokens']
+        self.size = meta['subtitles']
+        self.maps = []
+        self.postings = self.map('postings.bin')
+        self.rows = self.map('subtitles.bin')
+        self.offsets = self.map('offsets.bin')
+        self.text = self.map('text.bin', None)
+        self.lock = threading.Lock()
+        self.stats = {'queries': 0, 'matched': 0}
+        return super(SubtitleIndex, self).__init__()
+
+    def map(self, name, typecode='I'):
+        with open(os.path.join(self.path, name), 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return array('I') if typecode else b''
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps.append(m)
+        return memoryview(m).cast(typecode) if typecode else m
+
+    def __len__(self):
+        return self.size
+
+    def content(self, n):
+        """
+        Return the normalised text of a subtitle.
+        """
+        return self.text[self.offsets[n]:self.offsets[n + 1]].decode('utf-8').strip()
+
+    def subtitle(self, n):
+        episode, start, end, rep = self.rows[n * COLUMNS:(n + 1) * COLUMNS]
+        return {'Episode': self.episodes[episode], 'StartTimestamp': start, 'EndTimestamp': end,
+                'RepresentativeTimestamp': rep, 'Content': self.content(n)}
+
+    def posting(self, token):
+        offset, count = self.tokens.get(token, (0, 0))
+        return self.postings[offset:offset + count]
+
+    def candidates(self, tokens):
+        """
+        Yield the subtitle numbers containing every token, walking the
+        rarest token's postings and searching the others from where the
+        last match left off.
+        """
+        lists = sorted((self.posting(t) for t in set(tokens)), key=len)
+        if not lists or not len(lists[0]):
+            return
+        others = lists[1:]
+        positions = [0] * len(others)
+        for n in lists[0]:
+            for j, other in enumerate(others):
+                i = positions[j] = bisect_left(other, n, positions[j])
+                if i == len(other):
+                    return
+                if other[i] != n:
+                    break
+            else:
+                yield n
+
+    def search(self, query, limit=MAX_RESULTS):
+        """
+        Return (results, confidence) for a query. Results look like those of
+        the search API, one frame per subtitle. Confidence is 1 if the best
+        result contains the query as a phrase, 0.5 if it only contains all its
+        words, and 0 if nothing matched.
+        """
+        query = normalize_query(query)
+        with self.lock:
+            self.stats['queries'] += 1
+        if not query:
+            return [], 0
+        phrase = u' {} '.format(query).encode('utf-8')
+        phrases = []
+        words = []
+        for i, n in enumerate(self.candidates(query.split())):
+            if phrase in self.text[self.offsets[n]:self.offsets[n + 1]]:
+                phrases.append(n)
+                if len(phrases) >= limit:
+                    break
+            elif len(words) < limit:
+                words.append(n)
+            if i >= MAX_CANDIDATES:
+                break
+        if not phrases and not words:
+            return [], 0
+        with self.lock:
+            self.stats['matched'] += 1
+        res = []
+        for n in (phrases + words)[:limit]:
+            rep = self.rows[n * COLUMNS + 3]
+            res.append({'Id': rep, 'Episode': self.episodes[self.rows[n * COLUMNS]], 'Timestamp': rep})
+        return res, 1 if phrases else 0.5
+
+    def close(self):
+        self.postings = self.rows = self.offsets = self.text = None
+        for m in self.maps:
+            try:
+                m.close()
+            except BufferError:
+                pass
+        self.maps = []
+
+
+def add_arguments(parser):
+    subparsers = parser.add_subparsers(dest='index_command')
+    build = subparsers.add_parser('build', help='build an index from NDJSON subtitle files')
+    build.add_argument('sources', nargs='+', help='NDJSON files of subtitles or caption responses')
+    build.add_argument('--output', required=True, help='index directory to write')
+    search = subparsers.add_parser('search', help='search an index')
+    search.add_argument('index', help='index directory')
+    search.add_argument('query')
+
+
+def main(args):
+    if args.index_command == 'build':
+        start = time.time()
+        count = build_index(read_records(args.sources), args.output)
+        print("Indexed {} subtitles in {:.1f}s".format(count, time.time() - start))
+    elif args.index_command == 'search':
+        res, confidence = SubtitleIndex(args.index).search(args.query)
+        print(json.dumps({'confidence': confidence, 'results': res}, indent=2))
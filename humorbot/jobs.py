@@ -0,0 +1,136 @@
+import time
+import logging
+import threading
+from six.moves import queue
+from .transport import HTTPTransport
+
+log = logging.getLogger()
+
+ERROR_RESPONSE = {'text': 'Error processing request.', 'response_type': 'ephemeral'}
+EXPIRED_RESPONSE = {'text': 'Sorry, that took too long. Please try again.', 'response_type': 'ephemeral'}
+
+
+class Job(object):
+    def __init__(self, func, args, response_url, deadline):
+        self.func = func
+        self.args = args
+        self.response_url = response_url
+        self.created = time.time()
+        self.deadline = self.created + deadline if deadline else None
+        return super(Job, self).__init__()
+
+
+class JobQueue(object):
+    """
+    A bounded queue of background jobs whose results are POSTed to a Slack
+    response_url.
+
+    Jobs that are still waiting in the queue when their deadline passes are
+    dropped, and the user is told to try again. Worker threads are started
+    on the first submission, so the queue is safe to create before gunicorn
+    forks its workers.
+    """
+    def __init__(self, workers=4, max_depth=100, deadline=25, transport=None):
+        self.workers = workers
+        self.deadline = deadline
+        self.queue = queue.Queue(maxsize=max_depth)
+        self.transport = transport or HTTPTransport(retries=0)
+        self.threads = []
+        self.lock = threading.Lock()
+        self.stats = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'expired': 0, 'late': 0,
+                      'post_failed': 0, 'total_time': 0.0, 'max_time': 0.0}
+        return super(JobQueue, self).__init__()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build a job queue using the job_* settings from the config.
+        """
+        return cls(workers=int(config.job_workers), max_depth=int(config.job_queue_depth),
+                   deadline=float(config.job_deadline))
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    def submit(self, func, response_url, *args):
+        """
+        Queue a call to `func(*args)` whose result will be POSTed to
+        `response_url`. Returns False if the queue is full.
+        """
+        self.start()
+        try:
+            self.queue.put_nowait(Job(func, args, response_url, self.deadline))
+        except queue.Full:
+            self.count('rejected')
+            return False
+        self.count('submitted')
+        return True
+
+    def start(self):
+        """
+        Start the worker threads if they aren't running yet.
+        """
+        with self.lock:
+            while len(self.threads) < self.workers:
+                t = threading.Thread(target=self.work)
+                t.daemon = True
+                t.start()
+                self.threads.append(t)
+
+    def work(self):
+        while True:
+            self.run(self.queue.get())
+            self.queue.task_done()
+
+    def run(self, job):
+        """
+        Run a job and post its result.
+        """
+        if job.deadline and time.time() > job.deadline:
+            log.warning("Job expired after {:.1f}s in the queue".format(time.time() - job.created))
+            self.count('expired')
+            self.post(job.response_url, EXPIRED_RESPONSE)
+            return
+        try:
+            res = job.func(*job.args)
+            self.count('completed')
+        except Exception as e:
+            log.exception("Exception processing job: {}".format(e))
+            res = ERROR_RESPONSE
+            self.count('failed')
+        elapsed = time.time() - job.created
+        with self.lock:
+            self.stats['total_time'] += elapsed
+            self.stats['max_time'] = max(self.stats['max_time'], elapsed)
+        if job.deadline and time.time() > job.deadline:
+            self.count('late')
+        self.post(job.response_url, res)
+
+    def post(self, url, res):
+        try:
+            r = self.transport.post(url, res)
+            if not r.ok:
+                log.error("Failed to post response to {}: {}".format(url, r))
+                self.count('post_failed')
+        except Exception as e:
+            log.exception("Exception posting response to {}: {}".format(url, e))
+            self.count('post_failed')
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def collect(self):
+        """
+        Report job counts and queue depth to the metrics registry.
+        """
+        for event in ['submitted', 'rejected', 'completed', 'failed', 'expired', 'late', 'post_failed']:
+            yield ('humorbot_jobs_total', 'counter', 'Deferred jobs by outcome', {'event': event}, self.stats[event])
+        yield ('humorbot_job_queue_depth', 'gauge', 'Deferred jobs waiting to run', {}, self.depth)
+
+    def join(self):
+        """
+        Wait for all queued jobs to finish.
+        """
+        self.queue.join()
@@ -0,0 +1,25 @@
+"""
+Helpers for deferring expensive work until it's needed, so a freshly
+started worker can answer its first request sooner.
+"""
+import threading
+
+
+class lazy(object):
+    """
+    A property that's computed on first access and then stored on the
+    instance. Assigning to it replaces the value, as for a plain attribute.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        # Each instance gets its own lock, so one object's slow setup doesn't hold up another's
+        with obj.__dict__.setdefault('_lazy_lock', threading.RLock()):
+            if self.name not in obj.__dict__:
+                obj.__dict__[self.name] = self.func(obj)
+            return obj.__dict__[self.name]
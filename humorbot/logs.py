@@ -0,0 +1,196 @@
+"""
+Logging that stays off the request path.
+
+Records are put on a bounded queue and written to stdout by a background
+thread, so a slow terminal or log drain never holds up a request. If the
+queue fills up, records are dropped and counted rather than waited on.
+
+Request and response payloads are logged as events, which are only
+formatted if they'll be written, and then in the writer thread. Each event
+type can be sampled, and payloads are cut short past a maximum length:
+
+    events.debug('response', "Returning response", res)
+"""
+import os
+import sys
+import random
+import logging
+import threading
+from six.moves import queue
+
+log = logging.getLogger()
+
+EVENTS = ['request', 'response', 'action']
+
+
+class Payload(object):
+    """
+    A value to log, turned into text only when the record is written and cut
+    to `limit` characters.
+    """
+    def __init__(self, value, limit):
+        self.value = value
+        self.limit = limit
+        return super(Payload, self).__init__()
+
+    def __str__(self):
+        text = u'{}'.format(self.value)
+        if self.limit and len(text) > self.limit:
+            return u'{}... ({} more characters)'.format(text[:self.limit], len(text) - self.limit)
+        return text
+
+
+class EventLog(object):
+    """
+    Logs payloads by event type, skipping them entirely when their level is
+    disabled and keeping only a `rates[event]` fraction of them otherwise.
+    """
+    def __init__(self, logger=log, rates=None, max_length=2000):
+        self.logger = logger
+        self.rates = rates or {}
+        self.max_length = max_length
+        self.lock = threading.Lock()
+        self.stats = {'logged': 0, 'sampled': 0, 'disabled': 0}
+        return super(EventLog, self).__init__()
+
+    @classmethod
+    def from_config(cls, config, logger=log):
+        return cls(logger, {e: float(config['log_sample_{}'.format(e)]) for e in EVENTS}, int(config.log_max_length))
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def log(self, level, event, message, payload):
+        """
+        Log `message` followed by `payload` as an `event` record.
+        """
+        if not self.logger.isEnabledFor(level):
+            self.count('disabled')
+            return
+        rate = self.rates.get(event, 1)
+        if rate < 1 and random.random() >= rate:
+            self.count('sampled')
+            return
+        self.count('logged')
+        self.logger.log(level, message + ': %s', Payload(payload, self.max_length), extra={'event': event})
+
+    def debug(self, event, message, payload):
+        self.log(logging.DEBUG, event, message, payload)
+
+    def info(self, event, message, payload):
+        self.log(logging.INFO, event, message, payload)
+
+    def collect(self):
+        for outcome in ['logged', 'sampled', 'disabled']:
+            yield ('humorbot_log_events_total', 'counter', 'Logged payload events by outcome', {'outcome': outcome},
+                   self.stats[outcome])
+
+
+class BackgroundHandler(logging.Handler):
+    """
+    Hands records to a writer thread without waiting, dropping them if the
+    queue is full.
+
+    The thread is started by the first record each process logs, so the
+    handler can be installed before gunicorn forks its workers, as with
+    --preload. A forked worker gets a queue and thread of its own instead of
+    a copy of one whose thread didn't survive the fork.
+    """
+    def __init__(self, output, max_queued=10000):
+        self.output = output
+        self.max_queued = max_queued
+        self.queue = queue.Queue(max_queued)
+        self.thread = None
+        self.pid = None
+        self.dropped = 0
+        self.start_lock = threading.Lock()
+        return super(BackgroundHandler, self).__init__()
+
+    def start(self):
+        """
+        Start a writer thread for this process if it doesn't have one yet.
+        """
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.max_queued)
+            self.dropped = 0
+            self.thread = threading.Thread(target=self.write, args=(self.queue,))
+            self.thread.daemon = True
+            self.thread.start()
+            self.pid = os.getpid()
+
+    def write(self, records):
+        while True:
+            record = records.get()
+            if record is None:
+                return
+            self.output.handle(record)
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        # Formatting is left to the writer thread, unless there's a traceback to render while the frames are current
+        if record.exc_info:
+            record.msg = self.format(record)
+            record.args = record.exc_info = record.exc_text = None
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        """
+        Write out any queued records and stop this process's writer thread.
+        """
+        with self.start_lock:
+            if self.pid != os.getpid():
+                return
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = self.pid = None
+
+
+class BackgroundLogging(object):
+    """
+    Routes the root logger's records through a bounded queue to a stream
+    written by a background thread in each process.
+    """
+    def __init__(self, stream=sys.stdout, level=logging.INFO, max_queued=10000, fmt=logging.BASIC_FORMAT):
+        output = logging.StreamHandler(stream)
+        output.setFormatter(logging.Formatter(fmt))
+        self.handler = BackgroundHandler(output, max_queued)
+        self.level = level
+        return super(BackgroundLogging, self).__init__()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(level=logging.DEBUG if config.debug_logging else logging.INFO,
+                   max_queued=int(config.log_queue_size))
+
+    def start(self):
+        """
+        Install the handler on the root logger. Its thread starts when the
+        first record is logged.
+        """
+        root = logging.getLogger()
+        root.setLevel(self.level)
+        root.addHandler(self.handler)
+        return self
+
+    def stop(self):
+        """
+        Write out any queued records and go back to logging nowhere.
+        """
+        logging.getLogger().removeHandler(self.handler)
+        self.handler.stop()
+
+    def collect(self):
+        yield ('humorbot_log_queue_depth', 'gauge', 'Log records waiting to be written', {},
+               self.handler.queue.qsize())
+        yield ('humorbot_log_dropped_total', 'counter', 'Log records dropped with the queue full', {},
+               self.handler.dropped)
+
+
+events = EventLog()
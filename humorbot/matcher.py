@@ -0,0 +1,105 @@
+"""
+Fuzzy matching of search queries against subtitles.
+
+This picks the same caption as `fuzzywuzzy.process.extract(query, choices,
+limit=1)`, but processes the query once per call and each subtitle once
+per matcher rather than on every call, scores choices with WRatio in a
+single pass keeping only the best, and stops early on a perfect score. A
+lone choice is returned without scoring at all.
+
+Scores are remembered too, as the frames of an `images` command often come
+from the same scene and share most of their subtitles.
+"""
+import threading
+
+# fuzzywuzzy is imported when the first matcher is made, as it's slow to import and not needed to start serving
+fuzz = utils = None
+
+
+class CaptionMatcher(object):
+    """
+    Picks the subtitle that best matches a query, remembering the processed
+    form of up to `max_entries` subtitles and as many scores.
+    """
+    def __init__(self, max_entries=50000):
+        global fuzz, utils
+        if fuzz is None:
+            from fuzzywuzzy import fuzz, utils
+        self.max_entries = max_entries
+        self.processed = {}
+        self.scores = {}
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'scored': 0, 'early_exits': 0}
+        return super(CaptionMatcher, self).__init__()
+
+    def remember(self, memo, key, value):
+        with self.lock:
+            if len(memo) >= self.max_entries:
+                memo.clear()
+            memo[key] = value
+
+    def process(self, text):
+        """
+        Process a subtitle the way extract does, memoised.
+        """
+        res = self.processed.get(text)
+        if res is None:
+            res = utils.full_process(text, force_ascii=True)
+            self.remember(self.processed, text, res)
+        return res
+
+    def score(self, query, choice):
+        """
+        Score a processed query against a subtitle, memoised.
+        """
+        key = (query, choice)
+        res = self.scores.get(key)
+        if res is None:
+            res = fuzz.WRatio(query, self.process(choice), full_process=False)
+            self.remember(self.scores, key, res)
+            self.stats['misses'] += 1
+        else:
+            self.stats['hits'] += 1
+        return res
+
+    def prepare(self, query):
+        # extract runs the default processor over the query, then full_process again when scoring with WRatio
+        return utils.full_process(utils.full_process(query), force_ascii=True)
+
+    def best(self, query, choices):
+        """
+        Return the first of `choices` with the highest WRatio score against
+        `query`, or None if there are no choices.
+        """
+        if not choices:
+            return None
+        if len(choices) == 1:
+            return choices[0]
+        query = self.prepare(query)
+        if not utils.validate_string(query):
+            return choices[0]
+        self.stats['scored'] += 1
+        best, best_score = None, -1
+        for choice in choices:
+            score = self.score(query, choice)
+            if score > best_score:
+                best, best_score = choice, score
+                if score == 100:
+                    self.stats['early_exits'] += 1
+                    break
+        return best
+
+    def relevance(self, query, choices):
+        """
+        Return the highest WRatio score of any of `choices` against `query`,
+        from 0 to 100.
+        """
+        query = self.prepare(query)
+        if not choices or not utils.validate_string(query):
+            return 0
+        return max(self.score(query, choice) for choice in choices)
+
+    def clear(self):
+        with self.lock:
+            self.processed.clear()
+            self.scores.clear()
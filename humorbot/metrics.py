@@ -0,0 +1,276 @@
+"""
+Lightweight counters and histograms, exposed in the Prometheus text format.
+
+Metrics live in a per-process registry. When a metrics directory is
+configured, each gunicorn worker periodically dumps a snapshot of its
+registry there, and /metrics merges the snapshots from every live worker.
+Counters and histograms are summed, and gauges are reported per worker.
+"""
+import os
+import json
+import errno
+import glob
+import time
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def label_key(labels):
+    return json.dumps(sorted(labels.items()))
+
+
+def format_labels(key, extra=None):
+    labels = json.loads(key) + (extra or [])
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+        return super(Counter, self).__init__()
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = list(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+        return super(Histogram, self).__init__()
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        with self.lock:
+            data = self.values.get(key)
+            if data is None:
+                data = self.values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data['buckets'][i] += 1
+                    break
+            data['sum'] += value
+            data['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Time a block of code, observing its duration in seconds.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def snapshot(self):
+        with self.lock:
+            return {k: {'buckets': list(v['buckets']), 'sum': v['sum'], 'count': v['count']}
+                    for k, v in self.values.items()}
+
+
+class Registry(object):
+    """
+    A collection of metrics, plus collector callbacks that report gauges and
+    counters kept elsewhere (eg. cache stats) when a snapshot is taken.
+
+    Collectors return an iterable of (name, kind, help, labels, value) tuples.
+    """
+    # Snapshots that haven't been updated for this many dump intervals are left out
+    STALE_DUMPS = 5
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.last_dump = 0
+        return super(Registry, self).__init__()
+
+    def counter(self, name, help):
+        return self.add(Counter(name, help))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self.add(Histogram(name, help, buckets))
+
+    def add(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def register(self, collector):
+        self.collectors.append(collector)
+
+    def snapshot(self):
+        """
+        Return a JSON-serialisable snapshot of every metric.
+        """
+        snap = {}
+        for m in list(self.metrics.values()):
+            snap[m.name] = {'kind': m.kind, 'help': m.help, 'values': m.snapshot()}
+            if m.kind == 'histogram':
+                snap[m.name]['bounds'] = m.buckets
+        for collector in self.collectors:
+            for name, kind, help, labels, value in collector():
+                entry = snap.setdefault(name, {'kind': kind, 'help': help, 'values': {}})
+                key = label_key(labels)
+                entry['values'][key] = entry['values'].get(key, 0) + value
+        return snap
+
+    def dump(self, path):
+        """
+        Write a snapshot of this process's metrics to a directory.
+        """
+        self.last_dump = time.time()
+        filename = os.path.join(path, 'metrics-{}.json'.format(os.getpid()))
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.rename(filename + '.tmp', filename)
+
+    def maybe_dump(self, path, interval=10):
+        """
+        Dump a snapshot if we haven't for `interval` seconds.
+        """
+        if time.time() - self.last_dump > interval:
+            self.dump(path)
+
+    def load(self, path, interval=10):
+        """
+        Return (pid, snapshot) for each worker that has dumped to a directory.
+        Snapshots left by workers that have exited are deleted, and those not
+        updated for a while (eg. from a worker whose pid has been reused) are
+        skipped.
+        """
+        snaps = []
+        for filename in glob.glob(os.path.join(path, 'metrics-*.json')):
+            try:
+                pid = int(os.path.basename(filename)[len('metrics-'):-len('.json')])
+                if not alive(pid):
+                    os.remove(filename)
+                    continue
+                if os.path.getmtime(filename) < time.time() - self.STALE_DUMPS * interval:
+                    continue
+                with open(filename) as f:
+                    snaps.append((pid, json.load(f)))
+            except (IOError, OSError, ValueError):
+                pass
+        return snaps
+
+    def render(self, path=None, interval=10):
+        """
+        Render metrics in the Prometheus text format. If `path` is given, this
+        process's snapshot is dumped there and merged with those of the other
+        live processes, which dump every `interval` seconds.
+        """
+        if path:
+            self.dump(path)
+            snap = merge(self.load(path, interval))
+        else:
+            snap = self.snapshot()
+        return render(snap)
+
+
+def alive(pid):
+    """
+    Return whether a process exists.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def merge(snaps):
+    """
+    Merge (pid, snapshot) pairs from several processes. Counters and
+    histograms are summed, and gauges get a `worker` label instead, as their
+    sum is rarely meaningful.
+    """
+    res = {}
+    for pid, snap in snaps:
+        for name, entry in snap.items():
+            merged = res.setdefault(name, dict(entry, values={}))
+            for key, value in entry['values'].items():
+                if entry['kind'] == 'gauge':
+                    merged['values'][label_key(dict(json.loads(key), worker=pid))] = value
+                elif entry['kind'] == 'histogram':
+                    m = merged['values'].setdefault(key, {'buckets': [0] * len(value['buckets']), 'sum': 0.0,
+                                                          'count': 0})
+                    m['buckets'] = [a + b for a, b in zip(m['buckets'], value['buckets'])]
+                    m['sum'] += value['sum']
+                    m['count'] += value['count']
+                else:
+                    merged['values'][key] = merged['values'].get(key, 0) + value
+    return res
+
+
+def percentiles(values, ps=(50, 95, 99)):
+    """
+    Return nearest-rank percentiles of a list of values, eg. {'p50': 0.1}.
+    """
+    values = sorted(values)
+    res = {}
+    for p in ps:
+        if values:
+            res['p{}'.format(p)] = values[min(len(values) - 1, max(0, int(round(p / 100.0 * len(values))) - 1))]
+        else:
+            res['p{}'.format(p)] = None
+    return res
+
+
+def render(snap):
+    lines = []
+    for name in sorted(snap):
+        entry = snap[name]
+        lines.append('# HELP {} {}'.format(name, entry['help']))
+        lines.append('# TYPE {} {}'.format(name, entry['kind']))
+        for key in sorted(entry['values']):
+            value = entry['values'][key]
+            if entry['kind'] == 'histogram':
+                total = 0
+                for bound, n in zip(entry['bounds'], value['buckets']):
+                    total += n
+                    lines.append('{}_bucket{} {}'.format(name, format_labels(key, [('le', bound)]), total))
+                lines.append('{}_bucket{} {}'.format(name, format_labels(key, [('le', '+Inf')]), value['count']))
+                lines.append('{}_sum{} {}'.format(name, format_labels(key), format_value(value['sum'])))
+                lines.append('{}_count{} {}'.format(name, format_labels(key), value['count']))
+            else:
+                lines.append('{}{} {}'.format(name, format_labels(key), format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+BACKEND_SECONDS = REGISTRY.histogram('humorbot_backend_request_seconds', 'Backend API call latency')
+BACKEND_ERRORS = REGISTRY.counter('humorbot_backend_errors_total', 'Failed backend API calls')
+ACTION_SECONDS = REGISTRY.histogram('humorbot_action_seconds', 'Time taken to process each Humorbot action')
+MATCH_SECONDS = REGISTRY.histogram('humorbot_caption_match_seconds', 'Time taken to fuzzy match captions',
+                                   buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1))
+JSON_SECONDS = REGISTRY.histogram('humorbot_json_seconds', 'Time taken to encode responses as JSON',
+                                  buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1))
+HTTP_SECONDS = REGISTRY.histogram('humorbot_http_request_seconds', 'Flask request latency by route')
+LOOKUPS_SAVED = REGISTRY.histogram('humorbot_lookups_saved', 'Caption and context lookups saved per command by '
+                                   'skipping near-duplicate search hits', buckets=(0, 1, 2, 5, 10, 20))
@@ -0,0 +1,247 @@
+"""
+Replay Slack commands from production logs, to see how many requests a
+worker can take with a real traffic shape.
+
+Commands are read from the `command=..., username=..., team_domain=...,
+text=...` lines that Humorbot logs for every request, or from a JSONL export
+with the same fields. Lines that start with a timestamp (as gunicorn and
+Heroku logs do) are replayed at their original rate, or scaled with
+--speed. With --max-rate they are sent as fast as the workers can take them,
+which measures saturation throughput.
+
+By default commands go to the Flask app in this process, backed by the stub
+API. Use --url to replay against a running server instead, eg. gunicorn
+pointed at `python -m humorbot.stub` with HBOT_MORBO_API_URL.
+
+    humorbot replay humorbot.log [--speed 2 | --max-rate] [--workers 8] [--output report.json]
+"""
+import re
+import sys
+import json
+import gzip
+import time
+import uuid
+import logging
+import calendar
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from .metrics import percentiles
+
+log = logging.getLogger()
+
+LOG_LINE = re.compile(r'command=(?P<command>.*?), username=(?P<username>.*?), team_domain=(?P<team_domain>.*?), '
+                      r'text=(?P<text>.*)$')
+TIMESTAMP = re.compile(r'(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2}:\d{2})(?:[.,](\d+))?')
+ACTIONS = ['help', 'usage', 'image', 'images', 'random', 'gif', 'gifs']
+ERROR_TEXT = 'Error processing request.'
+
+
+class Command(object):
+    def __init__(self, command, username, team_domain, text, timestamp=None):
+        self.command = command.replace('/', '').strip()
+        self.username = username
+        self.team_domain = team_domain
+        self.text = text
+        self.timestamp = timestamp
+        return super(Command, self).__init__()
+
+    @property
+    def action(self):
+        """
+        The action this command runs, as Humorbot.parse_args would see it.
+        """
+        tokens = self.text.split()
+        if not tokens:
+            return 'help'
+        elif tokens[0] == 'usage':
+            return 'help'
+        elif tokens[0] in ACTIONS:
+            return tokens[0]
+        return 'image'
+
+
+def parse_time(value):
+    """
+    Parse a Unix time or an ISO 8601-ish timestamp into seconds. Time zones
+    are ignored, as only the gaps between commands matter.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = TIMESTAMP.search(value or '')
+    if not m:
+        return None
+    date, clock, fraction = m.groups()
+    seconds = calendar.timegm(time.strptime('{} {}'.format(date, clock), '%Y-%m-%d %H:%M:%S'))
+    return seconds + (float('0.' + fraction) if fraction else 0)
+
+
+def parse_line(line):
+    """
+    Parse a log line or a JSON object into a Command, or None if the line
+    isn't one.
+    """
+    line = line.strip()
+    if line.startswith('{'):
+        try:
+            d = json.loads(line)
+            return Command(d['command'], d.get('username', d.get('user_name', '')), d.get('team_domain', ''),
+                           d.get('text', ''), parse_time(d.get('timestamp', d.get('time'))))
+        except (ValueError, KeyError):
+            return None
+    m = LOG_LINE.search(line)
+    if not m:
+        return None
+    return Command(m.group('command'), m.group('username'), m.group('team_domain'), m.group('text'),
+                   parse_time(line[:m.start()]))
+
+
+def load(path):
+    """
+    Load commands from a log file or JSONL export, optionally gzipped.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        commands = [parse_line(line.decode('utf-8', 'replace')) for line in f]
+    return [c for c in commands if c is not None]
+
+
+def schedule(commands, speed=1.0, max_rate=False):
+    """
+    Return the offset in seconds at which to send each command. Commands are
+    sent back to back if any of them have no timestamp.
+    """
+    if max_rate or any(c.timestamp is None for c in commands):
+        return [0.0] * len(commands)
+    start = commands[0].timestamp
+    return [max(0.0, (c.timestamp - start) / speed) for c in commands]
+
+
+class Replayer(object):
+    """
+    Sends commands to the app and records how long each one took.
+    """
+    def __init__(self, config, url=None, workers=8):
+        self.config = config
+        self.url = url
+        self.workers = workers
+        self.local = threading.local()
+        return super(Replayer, self).__init__()
+
+    def payload(self, cmd):
+        # Each replayed line is a new command, so duplicate suppression mustn't merge repeats of the same text
+        token = self.config.frink_token if 'frink' in cmd.command else self.config.morbo_token
+        return {'token': str(token), 'command': '/' + cmd.command, 'text': cmd.text, 'user_name': cmd.username,
+                'team_domain': cmd.team_domain, 'trigger_id': 'replay.' + uuid.uuid4().hex}
+
+    def post(self, cmd):
+        """
+        Send a command and return whether it succeeded.
+        """
+        if self.url:
+            if not hasattr(self.local, 'session'):
+                self.local.session = requests.Session()
+            res = self.local.session.post(self.url.rstrip('/') + '/slack', data=self.payload(cmd), timeout=30)
+            return res.status_code == 200 and res.json().get('text') != ERROR_TEXT
+        else:
+            from . import app
+            res = app.app.test_client().post('/slack', data=self.payload(cmd))
+            return res.status_code == 200 and json.loads(res.data.decode('utf-8')).get('text') != ERROR_TEXT
+
+    def replay(self, commands, speed=1.0, max_rate=False):
+        """
+        Replay commands on schedule and return a report of throughput, lag,
+        latency percentiles and error rates by action.
+        """
+        offsets = schedule(commands, speed, max_rate)
+        results = []
+        lock = threading.Lock()
+
+        def send(cmd, offset):
+            sent = time.time()
+            try:
+                ok = self.post(cmd)
+            except Exception as e:
+                log.debug("Replayed command failed: {}".format(e))
+                ok = False
+            done = time.time()
+            with lock:
+                results.append((cmd.action, done - sent, sent - start - offset, ok))
+
+        start = time.time()
+        with ThreadPoolExecutor(self.workers) as executor:
+            for cmd, offset in zip(commands, offsets):
+                delay = start + offset - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(send, cmd, offset)
+        elapsed = time.time() - start
+
+        return {
+            'requests': len(results),
+            'seconds': round(elapsed, 3),
+            'throughput': round(len(results) / elapsed, 2) if elapsed else None,
+            'max_rate': max_rate or any(c.timestamp is None for c in commands),
+            'speed': speed,
+            'workers': self.workers,
+            'lag': summarise([r[2] for r in results]),
+            'total': summarise_results(results),
+            'actions': {action: summarise_results([r for r in results if r[0] == action])
+                        for action in sorted(set(r[0] for r in results))}
+        }
+
+
+def summarise(times):
+    res = {k + '_ms': round(v * 1000, 3) if v is not None else None for k, v in percentiles(times).items()}
+    res['max_ms'] = round(max(times) * 1000, 3) if times else None
+    return res
+
+
+def summarise_results(results):
+    errors = len([r for r in results if not r[3]])
+    res = summarise([r[1] for r in results])
+    res.update({'requests': len(results), 'errors': errors,
+                'error_rate': round(float(errors) / len(results), 4) if results else None})
+    return res
+
+
+def add_arguments(parser):
+    parser.add_argument('log', help='log file or JSONL export of commands')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay this many times faster than recorded')
+    parser.add_argument('--max-rate', action='store_true', help='send commands as fast as possible')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent requests')
+    parser.add_argument('--limit', type=int, help='only replay the first N commands')
+    parser.add_argument('--url', help='replay against a running server instead of the in-process app')
+    parser.add_argument('--live', action='store_true', help='use the configured APIs instead of the stub')
+    parser.add_argument('--fixtures', help='JSON fixture file for the stub API')
+    parser.add_argument('--latency', type=float, default=0, help='injected stub API latency in seconds')
+    parser.add_argument('--output', help='write the report to this file as well as stdout')
+
+
+def main(args):
+    from . import app, config
+    from .bot import Humorbot
+    from .stub import StubServer, load_fixtures
+
+    commands = load(args.log)[:args.limit]
+    if not commands:
+        sys.exit("No commands found in {}".format(args.log))
+    logging.getLogger().setLevel(logging.WARNING)
+
+    stub = None
+    if not args.url and not args.live:
+        stub = StubServer(load_fixtures(args.fixtures) if args.fixtures else None, latency=args.latency).start()
+        app.hb = Humorbot(config)
+        app.hb.morbo.api_base = app.hb.frink.api_base = stub.url
+
+    try:
+        report = Replayer(config, args.url, args.workers).replay(commands, args.speed, args.max_rate)
+    finally:
+        if stub:
+            stub.stop()
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
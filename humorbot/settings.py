@@ -0,0 +1,8 @@
+"""
+The app config, loaded from ~/.humourbot.conf over the packaged defaults,
+with HBOT_* environment variables applied on top.
+"""
+from scruffy import ConfigFile, PackageFile
+
+config = ConfigFile('~/.humourbot.conf', defaults=PackageFile('defaults.yaml'), apply_env=True, env_prefix='HBOT')
+config.load()
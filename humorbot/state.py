@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import base64
+import sqlite3
+import threading
+from contextlib import closing
+from .cache import LRUCache
+
+
+def new_state_id():
+    """
+    Generate a short, URL-safe random state id.
+    """
+    return base64.urlsafe_b64encode(os.urandom(9)).decode('ascii')
+
+
+class MemoryStateStore(object):
+    """
+    An in-process store for GIF editor sessions, with a TTL and LRU eviction.
+    """
+    def __init__(self, ttl=3600, max_entries=10000):
+        self.cache = LRUCache(ttl=ttl, max_entries=max_entries)
+        return super(MemoryStateStore, self).__init__()
+
+    @property
+    def stats(self):
+        return self.cache.stats
+
+    def put(self, data, state_id=None):
+        """
+        Store session data and return its id, which is new unless one is
+        given.
+        """
+        state_id = state_id or new_state_id()
+        self.cache.set(state_id, data)
+        return state_id
+
+    def get(self, state_id):
+        """
+        Return the session data for an id, or None if it has expired.
+        """
+        return self.cache.get(state_id)
+
+
+class SQLiteStateStore(object):
+    """
+    A GIF editor session store in an SQLite database, so sessions can be
+    shared between gunicorn workers on the same host.
+    """
+    def __init__(self, path, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expirations': 0}
+        with closing(self.connect()) as db, db:
+            db.execute('CREATE TABLE IF NOT EXISTS state (id TEXT PRIMARY KEY, data TEXT, expires REAL)')
+        return super(SQLiteStateStore, self).__init__()
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=5)
+        db.execute('PRAGMA journal_mode=WAL')
+        return db
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def put(self, data, state_id=None):
+        """
+        Store session data and return its id, which is new unless one is
+        given. Expired sessions are pruned as we go.
+        """
+        state_id = state_id or new_state_id()
+        now = time.time()
+        with closing(self.connect()) as db, db:
+            db.execute('INSERT OR REPLACE INTO state VALUES (?, ?, ?)', (state_id, json.dumps(data), now + self.ttl))
+            pruned = db.execute('DELETE FROM state WHERE expires < ?', (now,)).rowcount
+        with self.lock:
+            self.stats['expirations'] += max(pruned, 0)
+        return state_id
+
+    def get(self, state_id):
+        """
+        Return the session data for an id, or None if it has expired.
+        """
+        with closing(self.connect()) as db, db:
+            row = db.execute('SELECT data FROM state WHERE id = ? AND expires >= ?', (state_id, time.time())).fetchone()
+        if row is None:
+            self.count('misses')
+            return None
+        self.count('hits')
+        return json.loads(row[0])
+
+
+def state_store_from_config(config):
+    """
+    Build the GIF editor session store described by the config.
+    """
+    if config.gif_state_path:
+        return SQLiteStateStore(os.path.expanduser(str(config.gif_state_path)), ttl=int(config.gif_state_ttl))
+    else:
+        return MemoryStateStore(ttl=int(config.gif_state_ttl), max_entries=int(config.gif_state_max_entries))
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+A local stand-in for the Morbotron/Frinkiac API, for tests and benchmarks.
+
+The stub serves `/api/search`, `/api/frames/...` and `/api/caption` from a
+dict of episodes, each with a list of frame timestamps and subtitles, and
+counts the TCP connections it accepts so connection reuse can be measured.
+Episode data can be recorded from the real API into a fixture file, or
+generated synthetically at any scale. Latency and errors can be injected.
+
+To run it standalone:
+
+    python -m humorbot.stub --port 8000 --synthetic 20 --latency 0.05
+"""
+import re
+import gzip
+import json
+import time
+import random
+import argparse
+import threading
+from bisect import bisect_left, bisect_right
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlparse, parse_qs
+from six.moves.urllib.request import urlopen
+
+# Subtitles within this many ms of the requested frame are returned by /api/caption
+CAPTION_WINDOW = 1500
+MAX_SEARCH_RESULTS = 36
+
+
+def frames_between(start, end, step=209):
+    """
+    Generate evenly spaced frame timestamps.
+    """
+    return list(range(start, end, step))
+
+
+DEFAULT_EPISODES = {
+    'S05E02': {
+        'frames': frames_between(270000, 284000),
+        'subtitles': [
+            {'Id': 155870, 'RepresentativeTimestamp': 275224, 'StartTimestamp': 274432, 'EndTimestamp': 276683,
+             'Content': u'( "The Hustle" plays )'},
+            {'Id': 155871, 'RepresentativeTimestamp': 277727, 'StartTimestamp': 276725, 'EndTimestamp': 278936,
+             'Content': u'♪ Do the Hustle... ♪'},
+            {'Id': 155872, 'RepresentativeTimestamp': 280311, 'StartTimestamp': 279010, 'EndTimestamp': 281522,
+             'Content': u'Do the hustle! Do the hustle!'},
+        ]
+    },
+    'S15E01': {
+        'frames': frames_between(430000, 445000),
+        'subtitles': [
+            {'Id': 158107, 'RepresentativeTimestamp': 437478, 'StartTimestamp': 436433, 'EndTimestamp': 438800,
+             'Content': u' PROF. FRINK: Great glayvin in a glass!'},
+            {'Id': 158108, 'RepresentativeTimestamp': 439355, 'StartTimestamp': 438800, 'EndTimestamp': 440367,
+             'Content': u'The Nobel prize.'},
+        ]
+    },
+}
+
+
+WORDS = (u'bite my shiny metal ass good news everyone do the hustle glayvin sweet zombie jesus shut up and take '
+         u'my money hooray a happy ending for the rich people why not zoidberg woo hoo i am so smart eat my shorts '
+         u'excellent doh mmm donuts ay caramba the goggles do nothing neat cromulent embiggen rebigulator seymour '
+         u'steamed hams aurora borealis at this time of year in this part of the country localised entirely within '
+         u'your kitchen my eyes the cheese is old and moldy where is the bathroom').split()
+
+
+def normalize(text):
+    """
+    Lower-case text and strip punctuation, for crude substring search.
+    """
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text.lower(), flags=re.UNICODE).split())
+
+
+def synthetic_episodes(count=20, length=1200000, seed=0):
+    """
+    Generate `count` episodes of `length` ms each, with a frame roughly every
+    209ms and a subtitle of random quotable words every few seconds.
+    """
+    rnd = random.Random(seed)
+    episodes = {}
+    sub_id = 1
+    for e in range(count):
+        key = 'S{:02d}E{:02d}'.format(e // 22 + 1, e % 22 + 1)
+        frames = []
+        ts = rnd.randint(0, 500)
+        while ts < length:
+            frames.append(ts)
+            ts += rnd.randint(150, 300)
+        subtitles = []
+        ts = rnd.randint(1000, 3000)
+        while ts < length - 5000:
+            duration = rnd.randint(1200, 4000)
+            start = rnd.randint(0, len(WORDS) - 8)
+            content = u' '.join(WORDS[start:start + rnd.randint(3, 8)]).capitalize()
+            subtitles.append({'Id': sub_id, 'RepresentativeTimestamp': ts + duration // 2, 'StartTimestamp': ts,
+                              'EndTimestamp': ts + duration, 'Content': content})
+            sub_id += 1
+            ts += duration + rnd.randint(50, 2500)
+        episodes[key] = {'frames': frames, 'subtitles': subtitles}
+    return episodes
+
+
+def load_fixtures(path):
+    """
+    Load episode data from a JSON fixture file, optionally gzipped.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))['episodes']
+
+
+def record(api_base, points, path):
+    """
+    Record a fixture file from a real API, using the context frames and
+    captions around each (episode, timestamp) point.
+    """
+    def get(url):
+        return json.loads(urlopen(api_base + url).read().decode('utf-8'))
+
+    episodes = {}
+    for episode, timestamp in points:
+        ep = episodes.setdefault(episode, {'frames': set(), 'subtitles': {}})
+        for frame in get(u'/api/frames/{}/{}/4000/4000'.format(episode, timestamp)):
+            ep['frames'].add(frame['Timestamp'])
+        for sub in get(u'/api/caption?e={}&t={}'.format(episode, timestamp))['Subtitles']:
+            ep['subtitles'][sub['Id']] = {k: sub[k] for k in ['Id', 'RepresentativeTimestamp', 'StartTimestamp',
+                                                               'EndTimestamp', 'Content']}
+    data = {'episodes': {k: {'frames': sorted(v['frames']),
+                             'subtitles': sorted(v['subtitles'].values(), key=lambda s: s['StartTimestamp'])}
+                         for k, v in episodes.items()}}
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+class StubAPI(object):
+    """
+    Answers API requests from a dict of episode data.
+    """
+    def __init__(self, episodes=None):
+        self.episodes = episodes if episodes is not None else DEFAULT_EPISODES
+        self.frames = {k: sorted(v['frames']) for k, v in self.episodes.items()}
+        self.subs = {k: sorted([dict(s, Episode=k, Language='en') for s in v['subtitles']],
+                               key=lambda s: s['StartTimestamp']) for k, v in self.episodes.items()}
+        self.text = [(k, s, normalize(s['Content'])) for k in sorted(self.subs) for s in self.subs[k]]
+        return super(StubAPI, self).__init__()
+
+    def frame(self, episode, timestamp):
+        return {'Id': timestamp, 'Episode': episode, 'Timestamp': timestamp}
+
+    def frames_between(self, episode, start, end):
+        frames = self.frames.get(episode, [])
+        return [self.frame(episode, ts) for ts in frames[bisect_left(frames, start):bisect_right(frames, end)]]
+
+    def search(self, query):
+        query = normalize(query)
+        res = []
+        if query:
+            for episode, sub, text in self.text:
+                if query in text:
+                    res.extend(self.frames_between(episode, sub['StartTimestamp'], sub['EndTimestamp']))
+                    if len(res) >= MAX_SEARCH_RESULTS:
+                        break
+        return res[:MAX_SEARCH_RESULTS]
+
+    def context_frames(self, episode, timestamp, before, after):
+        return self.frames_between(episode, timestamp - before, timestamp + after)
+
+    def captions(self, episode, timestamp):
+        if episode not in self.subs:
+            return None
+        subs = [s for s in self.subs[episode] if s['StartTimestamp'] <= timestamp + CAPTION_WINDOW and
+                s['EndTimestamp'] >= timestamp - CAPTION_WINDOW]
+        return {'Episode': {'Key': episode}, 'Frame': self.frame(episode, timestamp), 'Subtitles': subs}
+
+    def handle(self, path):
+        """
+        Return a (status, body) tuple for a request path.
+        """
+        url = urlparse(path)
+        args = parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+        try:
+            if url.path == '/api/search':
+                return 200, self.search(args.get('q', [''])[0])
+            elif parts[:2] == ['api', 'frames'] and len(parts) == 6:
+                return 200, self.context_frames(parts[2], int(parts[3]), int(parts[4]), int(parts[5]))
+            elif url.path == '/api/caption':
+                res = self.captions(args['e'][0], int(args['t'][0]))
+                if res is not None:
+                    return 200, res
+        except (KeyError, ValueError):
+            return 400, {'error': 'bad request'}
+        return 404, {'error': 'not found'}
+
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            fail = server.fail_next > 0
+            if fail:
+                server.fail_next -= 1
+            fail = fail or server.random.random() < server.error_rate
+            delay = server.delay()
+        if delay:
+            time.sleep(delay)
+        if fail:
+            status, body = 503, {'error': 'injected failure'}
+        else:
+            status, body = server.api.handle(self.path)
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            self.server.posts.append((self.path, json.loads(body.decode('utf-8'))))
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    A threaded HTTP server running the stub API in the background.
+
+    `connections` counts accepted TCP connections and `requests` counts
+    requests served. Setting `fail_next` makes the next N requests fail with
+    a 503. POSTs to any path are accepted and recorded in `posts`, so the
+    server can also stand in for a Slack response_url.
+
+    Each GET is delayed by `latency` seconds plus up to `jitter` more, and a
+    `tail_rate` fraction of requests take `tail_latency` seconds instead. An
+    `error_rate` fraction of requests fail with a 503.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, episodes=None, host='127.0.0.1', port=0, latency=0, jitter=0, tail_rate=0, tail_latency=0,
+                 error_rate=0, seed=None):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), StubHandler)
+        self.api = StubAPI(episodes)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.fail_next = 0
+        self.posts = []
+        self.thread = None
+        self.latency = latency
+        self.jitter = jitter
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+    def delay(self):
+        """
+        Pick the injected latency for a request. The caller must hold the lock.
+        """
+        if self.tail_rate and self.random.random() < self.tail_rate:
+            return self.tail_latency
+        return self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def verify_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+        return True
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a stub Morbotron/Frinkiac API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--fixtures', help='JSON fixture file of episode data')
+    parser.add_argument('--synthetic', type=int, metavar='EPISODES', help='generate synthetic episodes')
+    parser.add_argument('--latency', type=float, default=0, help='base latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0, help='extra random latency in seconds')
+    parser.add_argument('--tail-rate', type=float, default=0, help='fraction of requests that are slow')
+    parser.add_argument('--tail-latency', type=float, default=0, help='latency of slow requests in seconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests that fail')
+    args = parser.parse_args(argv)
+
+    if args.fixtures:
+        episodes = load_fixtures(args.fixtures)
+    elif args.synthetic:
+        episodes = synthetic_episodes(args.synthetic)
+    else:
+        episodes = None
+    server = StubServer(episodes, args.host, args.port, latency=args.latency, jitter=args.jitter,
+                        tail_rate=args.tail_rate, tail_latency=args.tail_latency, error_rate=args.error_rate)
+    print('Serving stub API on {}'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
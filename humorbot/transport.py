@@ -0,0 +1,348 @@
+import time
+import collections
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+log = logging.getLogger()
+
+RETRY_STATUSES = [500, 502, 503, 504]
+
+
+class HTTPTransport(object):
+    """
+    A pooled, keep-alive HTTP transport for talking to the Frinkotron APIs.
+
+    Each backend owns one of these, so connections (and TLS sessions) are
+    reused across calls instead of being set up again for every request.
+    """
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=10, retries=2, backoff=0.2):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.lock = threading.Lock()
+        self.stats = {'calls': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0}
+        return super(HTTPTransport, self).__init__()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build a transport using the http_* settings from the config.
+        """
+        return cls(pool_size=int(config.http_pool_size), connect_timeout=float(config.http_connect_timeout),
+                   read_timeout=float(config.http_read_timeout), retries=int(config.http_retries),
+                   backoff=float(config.http_retry_backoff))
+
+    def get(self, url):
+        """
+        Perform a GET request and return the response, recording its latency.
+        """
+        start = time.time()
+        try:
+            res = self.session.get(url, timeout=self.timeout)
+        except Exception:
+            self.record(url, time.time() - start, error=True)
+            raise
+        self.record(url, time.time() - start, error=not res.ok)
+        return res
+
+    def post(self, url, data):
+        """
+        POST `data` as JSON and return the response, recording its latency.
+        """
+        start = time.time()
+        try:
+            res = self.session.post(url, json=data, timeout=self.timeout)
+        except Exception:
+            self.record(url, time.time() - start, error=True)
+            raise
+        self.record(url, time.time() - start, error=not res.ok)
+        return res
+
+    def record(self, url, elapsed, error=False):
+        """
+        Record the latency of a call.
+        """
+        with self.lock:
+            self.stats['calls'] += 1
+            self.stats['total_time'] += elapsed
+            self.stats['max_time'] = max(self.stats['max_time'], elapsed)
+            if error:
+                self.stats['errors'] += 1
+        log.debug(u"Request to {} took {:.1f}ms".format(url, elapsed * 1000))
+
+    def close(self):
+        """
+        Close any pooled connections.
+        """
+        self.session.close()
+
+
+class Flight(object):
+    """
+    An upstream call in progress, which later callers can wait on.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        return super(Flight, self).__init__()
+
+
+class SingleFlight(object):
+    """
+    Coalesce concurrent identical calls so they share one upstream request.
+
+    The first caller for a key makes the call, and anyone asking for the same
+    key while it's in flight waits for and receives the same result (or
+    exception).
+    """
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.stats = {'calls': 0, 'coalesced': 0}
+        return super(SingleFlight, self).__init__()
+
+    def do(self, key, func):
+        """
+        Return `func()`, sharing the call with any in flight for `key`.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.stats['calls'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.event.set()
+        return flight.result
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling a backend that is failing or too slow, so callers fail
+    fast instead of tying up workers.
+
+    The breaker opens when, of at least `min_calls` calls in the last
+    `window` seconds, an `error_rate` fraction failed or a `slow_rate`
+    fraction took longer than `slow_call` seconds. After `reset_timeout`
+    seconds it goes half-open and lets a single probe call through, which
+    closes it again on success or reopens it on failure.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, window=30, min_calls=10, error_rate=0.5, slow_call=5, slow_rate=0.8, reset_timeout=15):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.opened = 0
+        self.probing = False
+        self.calls = collections.deque()
+        self.lock = threading.Lock()
+        self.stats = {'open': 0, 'half_open': 0, 'closed': 0, 'short_circuited': 0}
+        return super(CircuitBreaker, self).__init__()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build a breaker using the breaker_* settings from the config.
+        """
+        return cls(window=float(config.breaker_window), min_calls=int(config.breaker_min_calls),
+                   error_rate=float(config.breaker_error_rate), slow_call=float(config.breaker_slow_call),
+                   slow_rate=float(config.breaker_slow_rate), reset_timeout=float(config.breaker_reset_timeout))
+
+    def transition(self, state):
+        """
+        Move to a new state. The caller must hold the lock.
+        """
+        log.warning("Circuit breaker {} -> {}".format(self.state, state))
+        self.state = state
+        self.stats[state] += 1
+        if state == self.OPEN:
+            self.opened = time.time()
+        elif state == self.CLOSED:
+            self.calls.clear()
+
+    def allow(self):
+        """
+        Return whether a call may go ahead.
+        """
+        with self.lock:
+            if self.state == self.OPEN and time.time() - self.opened >= self.reset_timeout:
+                self.transition(self.HALF_OPEN)
+                self.probing = False
+            if self.state == self.CLOSED or (self.state == self.HALF_OPEN and not self.probing):
+                self.probing = self.state == self.HALF_OPEN
+                return True
+            self.stats['short_circuited'] += 1
+            return False
+
+    def record(self, ok, elapsed):
+        """
+        Record the outcome of a call that was allowed.
+        """
+        now = time.time()
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.probing = False
+                self.transition(self.CLOSED if ok and elapsed < self.slow_call else self.OPEN)
+                return
+            if self.state != self.CLOSED:
+                return
+            self.calls.append((now, ok, elapsed >= self.slow_call))
+            while self.calls and self.calls[0][0] < now - self.window:
+                self.calls.popleft()
+            n = len(self.calls)
+            if n >= self.min_calls:
+                errors = len([c for c in self.calls if not c[1]])
+                slow = len([c for c in self.calls if c[2]])
+                if errors >= self.error_rate * n or slow >= self.slow_rate * n:
+                    self.transition(self.OPEN)
+
+    def release(self):
+        """
+        Give up on a call that was allowed but never finished, like a
+        cancelled one. A half-open probe counts as failed, so another is let
+        through after `reset_timeout` rather than never.
+        """
+        with self.lock:
+            if self.state == self.HALF_OPEN and self.probing:
+                self.probing = False
+                self.transition(self.OPEN)
+
+
+class Hedger(object):
+    """
+    Sends a second copy of a slow call and uses whichever finishes first.
+
+    A call is hedged once it has taken longer than the `quantile` of recent
+    calls with the same key (and at least `min_delay` seconds). Hedges are
+    paid for from a budget that grows by `max_ratio` per call, so they add
+    at most that fraction of extra load. A losing call is cancelled if it
+    hasn't started yet, and its result ignored otherwise.
+    """
+    MIN_SAMPLES = 20
+    MAX_TOKENS = 10
+
+    def __init__(self, quantile=0.95, min_delay=0.05, max_ratio=0.05, window=500, workers=20):
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self.window = window
+        self.workers = workers
+        self.executor = None
+        self.latencies = {}
+        self.tokens = 0
+        self.lock = threading.Lock()
+        self.stats = {'calls': 0, 'hedged': 0, 'hedge_wins': 0, 'denied': 0}
+        return super(Hedger, self).__init__()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build a hedger using the hedge_* settings from the config.
+        """
+        return cls(quantile=float(config.hedge_quantile), min_delay=float(config.hedge_min_delay),
+                   max_ratio=float(config.hedge_max_ratio), workers=int(config.hedge_workers))
+
+    def delay(self, key):
+        """
+        Return how long to wait before hedging a call, or None if there
+        aren't enough samples to tell yet.
+        """
+        with self.lock:
+            samples = sorted(self.latencies.get(key, []))
+        if len(samples) < self.MIN_SAMPLES:
+            return None
+        return max(self.min_delay, samples[min(len(samples) - 1, int(self.quantile * len(samples)))])
+
+    def record(self, key, elapsed):
+        with self.lock:
+            samples = self.latencies.setdefault(key, collections.deque(maxlen=self.window))
+            samples.append(elapsed)
+
+    def earn(self):
+        """
+        Add this call's share to the hedging budget.
+        """
+        with self.lock:
+            self.stats['calls'] += 1
+            self.tokens = min(self.MAX_TOKENS, round(self.tokens + self.max_ratio, 6))
+
+    def spend(self):
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.stats['hedged'] += 1
+                return True
+            self.stats['denied'] += 1
+            return False
+
+    def timed(self, key, func):
+        def call():
+            start = time.time()
+            res = func()
+            self.record(key, time.time() - start)
+            return res
+        return call
+
+    def do(self, key, func):
+        """
+        Return `func()`, hedged if it takes too long.
+        """
+        self.earn()
+        delay = self.delay(key)
+        if delay is None:
+            return self.timed(key, func)()
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.workers)
+        first = self.executor.submit(self.timed(key, func))
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        if not self.spend():
+            return first.result()
+        second = self.executor.submit(self.timed(key, func))
+        pending = set([first, second])
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            ok = [f for f in [first, second] if f in done and f.exception() is None]
+            if ok or not pending:
+                for loser in pending:
+                    loser.cancel()
+                if ok and ok[0] is second:
+                    with self.lock:
+                        self.stats['hedge_wins'] += 1
+                # Both failed if none succeeded
+                return (ok or [first])[0].result()
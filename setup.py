@@ -14,10 +14,13 @@ setup(
         'flask',
         'requests',
         'scruffington',
-        'slackclient',
         'fuzzywuzzy',
-        'python-Levenshtein'
+        'python-Levenshtein',
+        'futures; python_version < "3"'
     ],
+    extras_require={
+        'async': ['aiohttp']
+    },
     package_data={'humorbot': ['templates/*', 'static/*', 'defaults.yaml']},
     entry_points={
         'console_scripts': ['humorbot=humorbot:main']
@@ -0,0 +1,29 @@
+"""
+Setup shared by the tests, which talk to a StubServer rather than the real APIs.
+"""
+from humorbot.backend import default_config
+
+
+def stub_config(url, **settings):
+    """
+    The default config with both backends pointed at the stub API at `url`,
+    and any other `settings` changed.
+    """
+    config = default_config()
+    config.morbo_api_url = url
+    config.frink_api_url = url
+    for k, v in settings.items():
+        config[k] = v
+    return config
+
+
+def swap_app(**values):
+    """
+    Replace globals of the Flask app like `config` and `hb`, returning the old
+    ones so they can be put back with `swap_app(**old)`.
+    """
+    from humorbot import app
+    old = {k: getattr(app, k) for k in values}
+    for k, v in values.items():
+        setattr(app, k, v)
+    return old
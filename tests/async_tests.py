@@ -0,0 +1,204 @@
+import os
+import nose
+import sys
+import tempfile
+import json
+import asyncio
+import subprocess
+from aiohttp.test_utils import TestClient, TestServer
+from humorbot.aiobot import *
+from humorbot.aioapp import make_app
+from humorbot.aiotransport import hedged
+from humorbot.stub import StubServer
+from . import stub_config
+
+
+def setup_module():
+    global stub
+    global config
+    stub = StubServer().start()
+    config = stub_config(stub.url)
+
+
+def teardown_module():
+    stub.stop()
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def without_state(res):
+    """
+    Drop the random GIF editor state ids from a response so it can be compared.
+    """
+    for a in res.get('attachments', []):
+        for action in a.get('actions', []):
+            if action['name'] == 'edit':
+                action['value'] = dict(json.loads(action['value']), state=None)
+    return res
+
+
+def test_async_backend():
+    async def go():
+        m = AsyncMorbotron(config)
+        res = await m.search('do the hustle')
+        assert res == Morbotron(config).search('do the hustle')
+        frames = await m.context_frames('S05E02', 278561)
+        assert len(frames)
+        assert await m.caption_for_query('S05E02', 278561, 'do the hustle') == u'♪ Do the Hustle... ♪'
+        await m.transport.close()
+    run(go())
+
+
+def test_cancelled_probe_released():
+    slow = StubServer(latency=0.3).start()
+
+    async def go():
+        m = AsyncMorbotron(stub_config(slow.url, breaker_reset_timeout=0.1))
+        m.breaker.transition(CircuitBreaker.HALF_OPEN)
+        probe = asyncio.ensure_future(m.search('do the hustle'))
+        await asyncio.sleep(0.1)
+        probe.cancel()
+        await asyncio.wait([probe])
+        assert m.breaker.state == CircuitBreaker.OPEN
+        await asyncio.sleep(0.1)
+        assert await m.search('do the hustle')
+        assert m.breaker.state == CircuitBreaker.CLOSED
+        await m.transport.close()
+    try:
+        run(go())
+    finally:
+        slow.stop()
+
+
+def test_async_requests_coalesced():
+    async def go():
+        m = AsyncMorbotron(config)
+        res = await asyncio.gather(*[m.search('glayvin') for i in range(10)])
+        assert all(r == res[0] for r in res)
+        assert m.flights.stats == {'calls': 1, 'coalesced': 9}
+        assert not m.flights.flights
+        await m.transport.close()
+    run(go())
+
+
+def test_async_disk_cache():
+    path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+
+    async def go():
+        m = AsyncMorbotron(stub_config(stub.url, disk_cache_path=path))
+        res = await m.search('do the hustle')
+        assert await m.captions('S05E02', 278561)
+        await m.transport.close()
+        return res
+    res = run(go())
+    m = Morbotron(stub_config('http://localhost:1', disk_cache_path=path, breaker_enabled=False))
+    assert m.search('do the hustle') == res
+    assert m.captions('S05E02', 278561)
+
+
+def test_async_state_path_rejected():
+    with nose.tools.assert_raises(ValueError):
+        AsyncHumorbot(stub_config(stub.url, gif_state_path=os.path.join(tempfile.mkdtemp(), 'state.db')))
+
+
+def test_hedged_success_beats_error():
+    hedger = Hedger(min_delay=0.01, max_ratio=1)
+    for i in range(Hedger.MIN_SAMPLES):
+        hedger.record('search', 0.001)
+
+    async def go():
+        hedge_done = asyncio.Event()
+        calls = []
+
+        async def func():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                # Woken by the hedge finishing, so both are done by the time the hedger looks
+                await hedge_done.wait()
+                raise RequestFailedException()
+            hedge_done.set()
+            return 'hedge'
+        return await hedged(hedger, 'search', func)
+    assert run(go()) == 'hedge'
+    assert hedger.stats['hedge_wins'] == 1
+
+
+def test_async_matches_sync():
+    async def go():
+        ahb = AsyncHumorbot(config)
+        hb = Humorbot(config)
+        try:
+            for action in ['image', 'images', 'gif', 'gifs']:
+                data = {'text': '{} do the hustle'.format(action), 'user_name': 'someone', 'team_domain': 'team'}
+                assert without_state(await ahb.process_command('morbo', data)) == \
+                    without_state(hb.process_command('morbo', data))
+        finally:
+            await ahb.close()
+    run(go())
+
+
+def test_gif_editor_restored():
+    async def go():
+        hb = Humorbot(config)
+        ahb = AsyncHumorbot(config)
+        res = hb.gif('someone', 'do the hustle')
+        action = [a for a in res['attachments'][0]['actions'] if a['name'] == 'edit'][0]
+        try:
+            editor = await ahb.process_action({'actions': [action]})
+            assert editor['attachments'][0]['image_url'] == res['attachments'][0]['image_url']
+            assert len(editor['attachments']) > 2
+        finally:
+            await ahb.close()
+    run(go())
+
+
+def test_gif_editor_restore_failed():
+    async def go():
+        hb = Humorbot(config)
+        ahb = AsyncHumorbot(config)
+        res = hb.gif('someone', 'do the hustle')
+        action = [a for a in res['attachments'][0]['actions'] if a['name'] == 'edit'][0]
+        stub.fail_next = 10
+        try:
+            assert await ahb.process_action({'actions': [action]}) == EXPIRED_EDITOR
+        finally:
+            stub.fail_next = 0
+            await ahb.close()
+    run(go())
+
+
+def test_concurrent_commands():
+    async def go():
+        ahb = AsyncHumorbot(config)
+        data = {'text': 'images glayvin', 'user_name': 'someone', 'team_domain': 'team'}
+        res = await asyncio.gather(*[ahb.process_command('frink', data) for i in range(50)])
+        assert all(r == res[0] for r in res)
+        await ahb.close()
+    run(go())
+
+
+def test_app():
+    async def go():
+        client = TestClient(TestServer(make_app(config)))
+        await client.start_server()
+        try:
+            res = await client.post('/slack', data={'token': 'nope', 'command': '/morbo', 'text': 'help'})
+            assert (await res.json())['text'] == "Token doesn't match"
+            res = await client.post('/slack', data={'token': config.morbo_token, 'command': '/morbo',
+                                                    'text': 'do the hustle', 'user_name': 'someone',
+                                                    'team_domain': 'team'})
+            assert (await res.json())['attachments'][0]['title'] == '@someone: /morbo do the hustle'
+        finally:
+            await client.close()
+    run(go())
+
+
+def test_app_import_is_async_only():
+    code = "import sys, humorbot.aioapp; assert 'humorbot.app' not in sys.modules and 'flask' not in sys.modules"
+    subprocess.check_call([sys.executable, '-c', code])
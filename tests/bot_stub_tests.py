@@ -0,0 +1,180 @@
+import nose
+import os
+import json
+import tempfile
+from humorbot.bot import *
+from humorbot.state import SQLiteStateStore
+from humorbot.stub import StubServer
+from . import stub_config
+
+
+def setup_module():
+    global stub
+    global hb
+    stub = StubServer().start()
+    hb = Humorbot(stub_config(stub.url, scene_window=0, gif_editor_frames=0))
+
+
+def teardown_module():
+    stub.stop()
+
+
+def test_images():
+    res = hb.images('someone', 'do the hustle')
+    assert len(res['attachments']) == MAX_IMAGES + 1
+    urls = [a['image_url'] for a in res['attachments'][:-1]]
+    results = hb.morbo.search('do the hustle')[:MAX_IMAGES]
+    assert urls == [hb.morbo.image_url(r['Episode'], r['Timestamp'], hb.morbo.caption_for_query(r['Episode'],
+                    r['Timestamp'], 'do the hustle')) for r in results]
+
+
+def test_gifs():
+    res = hb.gifs('someone', 'glayvin', command='frink')
+    assert len(res['attachments']) == MAX_GIFS + 1
+    assert all(a['image_url'].startswith('https://frinkiac.com/gif/S15E01/') for a in res['attachments'][:-1])
+
+
+def test_lazy_startup():
+    config = stub_config(stub.url)
+    lazy = Humorbot(config)
+    assert 'morbo' not in lazy.__dict__ and 'frink' not in lazy.__dict__
+    assert lazy.image('someone', 'do the hustle') == hb.image('someone', 'do the hustle')
+    assert 'morbo' in lazy.__dict__ and 'frink' not in lazy.__dict__
+    assert list(lazy.collect()) and 'frink' not in lazy.__dict__
+    fresh = Humorbot(config).morbo
+    assert list(fresh.collect()) and 'matcher' not in fresh.__dict__
+    config.lazy_startup = False
+    eager = Humorbot(config)
+    assert 'matcher' in eager.frink.__dict__
+
+
+def test_one_option_per_scene():
+    scenes = Humorbot(stub_config(stub.url))
+    hits = scenes.morbo.search('do the hustle')
+    res = scenes.images('someone', 'do the hustle')
+    assert len(res['attachments']) == len(distinct_scenes(hits, 3000)) + 1 < len(hits)
+    assert res['attachments'][0]['image_url'] == hb.images('someone', 'do the hustle')['attachments'][0]['image_url']
+
+
+def test_distinct_scenes():
+    hits = [{'Episode': 'S01E01', 'Timestamp': ts} for ts in [5000, 1000, 3000, 9000, 20000]]
+    hits.append({'Episode': 'S01E02', 'Timestamp': 1000})
+    assert [h['Timestamp'] for h in distinct_scenes(hits, 4000)] == [5000, 20000, 1000]
+    assert distinct_scenes(hits, 0) == hits
+
+
+def test_lookup_failure_degrades():
+    backend = hb.morbo
+    results = backend.search('do the hustle')
+    bad = results[1]['Timestamp']
+    caption_for_query = backend.caption_for_query
+
+    def flaky(episode, timestamp, query):
+        if timestamp == bad:
+            raise RequestFailedException()
+        return caption_for_query(episode, timestamp, query)
+    backend.caption_for_query = flaky
+    try:
+        res = hb.images('someone', 'do the hustle')
+    finally:
+        del backend.caption_for_query
+    assert len(res['attachments']) == MAX_IMAGES + 1
+    assert res['attachments'][1]['image_url'] == backend.image_url(results[1]['Episode'], bad)
+    assert 'b64lines' in res['attachments'][0]['image_url']
+
+
+def click(res, attachment, name):
+    """
+    Build the action payload for clicking a button in a response.
+    """
+    action = [a for a in res['attachments'][attachment]['actions'] if a['name'] == name][0]
+    return {'actions': [action], 'user': {'name': 'someone'}, 'team': {'domain': 'team'}}
+
+
+def test_gif_editor():
+    res = hb.gif('someone', 'do the hustle')
+    editor = hb.process_action(click(res, 0, 'edit'))
+    frames = editor['attachments'][1:]
+    assert len(frames) == len(hb.morbo.context_frames('S05E02', hb.morbo.search('do the hustle')[0]['Timestamp']))
+    assert all(f['color'] == 'good' for f in frames)
+    assert all(len(a['value']) < 300 for f in frames for a in f['actions'])
+
+    # Move the start frame along and check the GIF URL follows
+    start = json.loads(click(editor, 3, 'start')['actions'][0]['value'])['start']
+    editor = hb.process_action(click(editor, 3, 'start'))
+    assert '/{}/'.format(start) in editor['attachments'][0]['image_url']
+    assert [f['color'] for f in editor['attachments'][1:4]] == ['', '', 'good']
+
+    # Hide the text
+    editor = hb.process_action(click(editor, 0, 'show_hide_text'))
+    assert 'b64lines' not in editor['attachments'][0]['image_url']
+    assert '/{}/'.format(start) in editor['attachments'][0]['image_url']
+
+
+def test_sample_frames():
+    assert sample_frames(10, 2, 5, 0) == list(range(10))
+    assert sample_frames(10, 2, 5, 10) == list(range(10))
+    assert sample_frames(40, 10, 20, 8) == [0, 9, 10, 11, 19, 20, 21, 39]
+    assert sample_frames(40, 10, 20, 12) == [0, 4, 9, 10, 11, 19, 20, 21, 25, 30, 34, 39]
+    assert sample_frames(40, 10, 20, 8, focus=30) == [10, 20, 27, 28, 29, 30, 31, 32]
+
+
+def test_gif_editor_sampled():
+    sampled = Humorbot(stub_config(stub.url, gif_editor_frames=8))
+    res = sampled.gif('someone', 'do the hustle')
+    full = hb.process_action(click(hb.gif('someone', 'do the hustle'), 0, 'edit'))
+    editor = sampled.process_action(click(res, 0, 'edit'))
+    assert len(editor['attachments']) == 9 < len(full['attachments'])
+    assert len(json.dumps(editor)) < len(json.dumps(full)) / 2
+
+    # Zoom in on the last frame shown, then pick an end frame that wasn't shown before
+    zoomed = sampled.process_action(click(editor, 8, 'zoom'))
+    shown = [a['thumb_url'] for a in editor['attachments'][1:]]
+    new = [i for i, a in enumerate(zoomed['attachments']) if i and a['thumb_url'] not in shown]
+    assert new
+    end = json.loads(click(zoomed, new[0], 'end')['actions'][0]['value'])['end']
+    edited = sampled.process_action(click(zoomed, new[0], 'end'))
+    assert '/{}.gif'.format(end) in edited['attachments'][0]['image_url']
+    assert edited['attachments'][new[0]]['thumb_url'] == zoomed['attachments'][new[0]]['thumb_url']
+
+    # Zoom back out
+    out = sampled.process_action(click(edited, 0, 'zoom'))
+    assert 'Zoom out' not in [a['text'] for a in out['attachments'][0]['actions']]
+    assert '/{}.gif'.format(end) in out['attachments'][0]['image_url']
+
+
+def test_gif_editor_expired():
+    payload = {'actions': [{'name': 'start', 'value': json.dumps({'state': 'nope', 'start': 1, 'end': 2,
+                                                                  'show_text': True})}]}
+    assert hb.process_action(payload) == EXPIRED_EDITOR
+
+
+def test_gif_editor_restored():
+    # Another worker, or this one after a restart, doesn't have the session but can rebuild it
+    other = Humorbot(stub_config(stub.url, gif_editor_frames=0))
+    editor = hb.process_action(click(hb.gif('someone', 'do the hustle'), 0, 'edit'))
+    expected = hb.process_action(click(editor, 3, 'start'))
+    restored = other.process_action(click(editor, 3, 'start'))
+    assert restored['attachments'][0]['image_url'] == expected['attachments'][0]['image_url']
+    assert len(restored['attachments']) == len(expected['attachments'])
+    state_id = json.loads(click(editor, 3, 'start')['actions'][0]['value'])['state']
+    assert other.state.get(state_id)['context'] == hb.state.get(state_id)['context']
+
+
+def test_gif_editor_legacy_payload():
+    data = {'args': 'gif x', 'text': 'x', 'episode': 'S05E02', 'context': [1, 2, 3], 'start': 1, 'end': 3,
+            'show_text': True, 'command': 'morbo'}
+    res = hb.process_action({'actions': [{'name': 'edit', 'value': json.dumps(data)}]})
+    assert len(res['attachments']) == 4
+    assert 'state' in json.loads(res['attachments'][1]['actions'][0]['value'])
+
+
+def test_sqlite_state_store():
+    path = os.path.join(tempfile.mkdtemp(), 'state.db')
+    a = SQLiteStateStore(path)
+    b = SQLiteStateStore(path)
+    state_id = a.put({'episode': 'S05E02', 'context': [1, 2, 3]})
+    assert b.get(state_id) == {'episode': 'S05E02', 'context': [1, 2, 3]}
+    assert b.get('nope') is None
+    expired = SQLiteStateStore(path, ttl=-1)
+    assert b.get(expired.put({})) is None
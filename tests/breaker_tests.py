@@ -0,0 +1,110 @@
+import nose
+import time
+from humorbot.bot import *
+from humorbot.transport import CircuitBreaker, HTTPTransport
+from humorbot.stub import StubServer
+from . import stub_config
+
+
+def setup_module():
+    global stub
+    global config
+    stub = StubServer().start()
+    config = stub_config(stub.url, search_cache_ttl=1, breaker_min_calls=2, breaker_reset_timeout=0.1)
+
+
+def teardown_module():
+    stub.stop()
+
+
+def test_breaker_opens_and_recovers():
+    breaker = CircuitBreaker(min_calls=4, error_rate=0.5, reset_timeout=0.05)
+    for ok in [True, False, True]:
+        assert breaker.allow()
+        breaker.record(ok, 0.01)
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record(False, 0.01)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.stats['short_circuited'] == 1
+
+    # One probe at a time once the reset timeout passes
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(False, 0.01)
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record(True, 0.01)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats == {'open': 2, 'half_open': 2, 'closed': 1, 'short_circuited': 2}
+
+
+def test_abandoned_probe_released():
+    breaker = CircuitBreaker(min_calls=1, reset_timeout=0.05)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record(False, 0.01)
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    assert breaker.allow()
+
+
+class InterruptedTransport(HTTPTransport):
+    def get(self, url):
+        raise KeyboardInterrupt()
+
+
+def test_interrupted_probe_released():
+    b = Morbotron(config=config, transport=InterruptedTransport())
+    b.breaker.transition(CircuitBreaker.HALF_OPEN)
+    nose.tools.assert_raises(KeyboardInterrupt, b.search, 'glayvin')
+    assert b.breaker.state == CircuitBreaker.OPEN and not b.breaker.probing
+    b.transport = HTTPTransport(retries=0)
+    time.sleep(0.1)
+    assert b.search('glayvin')
+    assert b.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_slow_calls_open_breaker():
+    breaker = CircuitBreaker(min_calls=2, slow_call=1, slow_rate=0.5)
+    breaker.record(True, 2)
+    breaker.record(True, 2)
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_stale_fallback_and_fail_fast():
+    b = Morbotron(config=config, transport=HTTPTransport(retries=0))
+    res = b.search('do the hustle')
+    time.sleep(1.1)
+    stub.error_rate = 1
+    try:
+        assert b.search('do the hustle') == res
+        assert b.stale_stats['search'] == 1
+        nose.tools.assert_raises(RequestFailedException, b.search, 'glayvin')
+        assert b.breaker.state == CircuitBreaker.OPEN
+
+        # Open, so this doesn't reach the stub
+        requests = stub.requests
+        nose.tools.assert_raises(CircuitOpenException, b.search, 'glayvin')
+        assert stub.requests == requests
+    finally:
+        stub.error_rate = 0
+
+    time.sleep(0.1)
+    assert b.search('glayvin')
+    assert b.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_friendly_message_when_open():
+    hb = Humorbot(config)
+    hb.morbo = Morbotron(config=config, transport=HTTPTransport(retries=0))
+    hb.morbo.breaker.transition(CircuitBreaker.OPEN)
+    res = hb.process_command('morbo', {'text': 'gif do the hustle', 'user_name': 'someone', 'team_domain': 'team'})
+    assert res == unavailable('morbo')
+    assert 'Morbotron' in res['text']
@@ -0,0 +1,217 @@
+import nose
+import os
+import time
+import tempfile
+import multiprocessing
+from humorbot.backend import *
+from humorbot.cache import *
+from humorbot import main
+from humorbot.stub import StubServer
+from . import stub_config
+
+
+def setup_module():
+    global stub
+    global m
+    stub = StubServer().start()
+    m = Morbotron(stub_config(stub.url))
+
+
+def teardown_module():
+    stub.stop()
+
+
+def test_normalize_query():
+    assert normalize_query('Do the Hustle!') == 'do the hustle'
+    assert normalize_query('  do   the,hustle ') == 'do the hustle'
+    assert normalize_query(u'glayvin') == u'glayvin'
+
+
+def test_lru_eviction():
+    c = LRUCache(ttl=0, max_entries=2)
+    c.set('a', 1)
+    c.set('b', 2)
+    assert c.get('a') == 1
+    c.set('c', 3)
+    assert c.get('b') is None
+    assert c.get('a') == 1
+    assert c.get('c') == 3
+    assert c.stats['evictions'] == 1
+    assert c.stats['hits'] == 3
+    assert c.stats['misses'] == 1
+
+
+def test_max_bytes():
+    c = LRUCache(ttl=0, max_entries=0, max_bytes=10)
+    c.set('a', 'x', size=4)
+    c.set('b', 'y', size=4)
+    c.set('c', 'z', size=4)
+    assert len(c) == 2
+    assert c.size == 8
+    assert c.get('a') is None
+
+
+def test_unbounded_bytes_not_sized():
+    c = LRUCache(ttl=0)
+    value = object()
+    c.set('a', value)
+    assert c.get('a') is value
+    assert c.size == 0
+
+
+def test_ttl():
+    c = LRUCache(ttl=0.05)
+    c.set('a', 1)
+    assert c.get('a') == 1
+    time.sleep(0.1)
+    assert c.get('a') is None
+    assert c.stats['expirations'] == 1
+
+
+def test_search_cached():
+    requests = stub.requests
+    res = m.search('do the hustle')
+    assert m.search('Do the   hustle!') == res
+    assert m.search('do the hustle') == res
+    assert stub.requests - requests == 1
+
+
+def test_caption_index():
+    idx = CaptionIndex(max_subtitles=3)
+    subs = [{'StartTimestamp': 100, 'EndTimestamp': 200, 'Content': 'a'},
+            {'StartTimestamp': 250, 'EndTimestamp': 300, 'Content': 'b'}]
+    idx.add('S01E01', subs)
+    assert idx.lookup('S01E01', 150) == subs
+    assert idx.lookup('S01E01', 300) == subs
+    assert idx.lookup('S01E01', 220) is None
+    assert idx.lookup('S01E01', 50) is None
+    assert idx.lookup('S01E02', 150) is None
+    assert idx.size == 2
+    idx.add('S01E02', [{'StartTimestamp': 100, 'EndTimestamp': 200, 'Content': 'c'}])
+    idx.add('S01E03', [{'StartTimestamp': 100, 'EndTimestamp': 200, 'Content': 'd'}])
+    assert idx.lookup('S01E01', 150) is None
+    assert idx.lookup('S01E03', 150)[0]['Content'] == 'd'
+    assert idx.stats['evictions'] == 1
+    assert idx.size == 2
+
+
+def test_captions_indexed():
+    requests = stub.requests
+    res = m.captions('S05E02', 278561)
+    assert m.captions('S05E02', 278000) == res
+    assert m.captions('S05E02', 280000) == res
+    assert stub.requests - requests == 1
+    m.captions('S05E02', 278970)
+    assert stub.requests - requests == 2
+
+
+def frames(episode, timestamps):
+    return [{'Id': ts, 'Episode': episode, 'Timestamp': ts} for ts in timestamps]
+
+
+def test_timeline_cache():
+    tl = TimelineCache(max_frames=5)
+    assert tl.gaps('S01E01', 100, 200) == [(100, 200)]
+    tl.add('S01E01', (100, 200), frames('S01E01', [100, 150, 200]))
+    tl.add('S01E01', (300, 400), frames('S01E01', [350]))
+    assert tl.gaps('S01E01', 120, 180) == []
+    assert tl.gaps('S01E01', 50, 450) == [(50, 99), (201, 299), (401, 450)]
+    assert tl.frames('S01E01', 120, 360) == frames('S01E01', [150, 200, 350])
+    tl.add('S01E01', (201, 299), frames('S01E01', [200, 250]))
+    assert tl.gaps('S01E01', 100, 400) == []
+    assert tl.stats == {'hits': 2, 'partial': 1, 'misses': 1, 'evictions': 0}
+    assert tl.size == 5
+    tl.add('S01E02', (0, 100), frames('S01E02', [0, 50]))
+    assert tl.gaps('S01E01', 100, 200) == [(100, 200)]
+    assert tl.stats['evictions'] == 1
+    assert tl.size == 2
+
+
+def test_context_frames_timeline():
+    requests = stub.requests
+    first = m.context_frames('S05E02', 276000)
+    assert m.context_frames('S05E02', 276000, 2000, 2000) == [f for f in first if 274000 <= f['Timestamp'] <= 278000]
+    assert stub.requests - requests == 1
+    overlap = m.context_frames('S05E02', 277000)
+    assert stub.requests - requests == 2
+    assert overlap == [f for f in m.context_frames('S05E02', 275000, 2000, 6000) if f['Timestamp'] >= 273000]
+    assert overlap == m.get(m.frames_url('S05E02', 277000, 4000, 4000))
+    assert m.timeline.stats['partial'] >= 1
+
+
+def write_entries(path, start):
+    c = DiskCache(path)
+    for i in range(start, start + 50):
+        c.set(('k', i), {'value': i})
+
+
+def test_disk_cache():
+    path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+    a = DiskCache(path)
+    b = DiskCache(path)
+    a.set(('morbo', 'do the hustle'), [{'Episode': 'S05E02', 'Timestamp': 1}])
+    assert b.get(('morbo', 'do the hustle')) == [{'Episode': 'S05E02', 'Timestamp': 1}]
+    assert b.get(('morbo', 'nope')) is None
+    assert b.stats['hits'] == 1
+    assert b.stats['misses'] == 1
+    expired = DiskCache(path, ttl=-1)
+    expired.set('old', 1)
+    assert a.get('old') is None
+    a.compact()
+    assert len(a) == 1
+
+
+def test_compact_command():
+    path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+    c = DiskCache(path, ttl=-1)
+    for i in range(100):
+        c.set(i, 'x' * 1000)
+    before = disk_usage(path)
+    main(['cache', 'compact', '--path', path])
+    assert len(c) == 0
+    assert disk_usage(path) < before
+
+
+def test_disk_cache_multiprocess():
+    path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+    DiskCache(path)
+    procs = [multiprocessing.Process(target=write_entries, args=(path, i * 50)) for i in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    c = DiskCache(path)
+    assert len(c) == 200
+    assert c.get(('k', 123)) == {'value': 123}
+
+
+def test_disk_cache_eviction():
+    c = DiskCache(os.path.join(tempfile.mkdtemp(), 'cache.db'), max_bytes=100)
+    for i in range(20):
+        c.set(i, 'x' * 10)
+    c.evict()
+    assert len(c) == 8
+    assert c.get(19) == 'x' * 10
+    assert c.stats['evictions'] == 12
+
+
+def test_tiered_cache():
+    path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+    TieredCache(LRUCache(), DiskCache(path)).set('a', 1)
+    t = TieredCache(LRUCache(), DiskCache(path))
+    assert t.get('a') == 1
+    assert t.get('a') == 1
+    stats = t.tier_stats()
+    assert stats['memory']['hits'] == 1
+    assert stats['memory']['misses'] == 1
+    assert stats['disk']['hits'] == 1
+    assert stats['disk']['hit_rate'] == 1.0
+
+
+def test_backend_disk_cache():
+    config = stub_config(stub.url, disk_cache_path=os.path.join(tempfile.mkdtemp(), 'cache.db'))
+    Morbotron(config).caption_for_query('S05E02', 278561, 'hustle')
+    requests = stub.requests
+    fresh = Morbotron(config)
+    assert fresh.captions('S05E02', 278561) == m.captions('S05E02', 278561)
+    assert stub.requests == requests
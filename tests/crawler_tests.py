@@ -0,0 +1,108 @@
+import nose
+import os
+import glob
+import json
+import gzip
+import time
+import tempfile
+from humorbot.backend import *
+from humorbot.transport import HTTPTransport
+from humorbot.crawler import *
+from humorbot.index import build_index, read_records, SubtitleIndex
+from humorbot.stub import StubServer, DEFAULT_EPISODES
+from . import stub_config
+
+
+def setup_module():
+    global stub
+    global backend
+    stub = StubServer().start()
+    backend = Morbotron(config=stub_config(stub.url))
+
+
+def teardown_module():
+    stub.stop()
+
+
+def crawler(path):
+    return Crawler(backend, path, workers=2, rate=0, max_gap=500000, max_timestamp=500000)
+
+
+def test_expand_episodes():
+    episodes = expand_episodes(['S05E02', 's01', 'S01E03'])
+    assert episodes[:3] == ['S05E02', 'S01E01', 'S01E02']
+    assert len(episodes) == EPISODES_PER_SEASON + 1
+
+
+def test_crawl():
+    path = tempfile.mkdtemp()
+    stats = crawler(path).crawl(['S05E02', 'S15E01', 'S99E99'])
+    assert (stats['episodes'], stats['empty'], stats['failed']) == (2, 1, 0)
+    assert sorted(os.path.basename(p) for p in glob.glob(os.path.join(path, '*.gz'))) == [
+        'morbo-S05E02.ndjson.gz', 'morbo-S15E01.ndjson.gz']
+
+    with gzip.open(os.path.join(path, 'morbo-S05E02.ndjson.gz'), 'rb') as f:
+        records = [json.loads(line.decode('utf-8')) for line in f]
+    frames = sorted(ts for r in records if 'Frames' in r for ts in r['Frames'])
+    assert frames == DEFAULT_EPISODES['S05E02']['frames']
+    assert sorted(r['Id'] for r in records if 'Id' in r) == [s['Id'] for s in DEFAULT_EPISODES['S05E02']['subtitles']]
+
+    # Shards can be indexed straight away
+    build_index(read_records(glob.glob(os.path.join(path, '*.gz'))), os.path.join(path, 'index'))
+    assert SubtitleIndex(os.path.join(path, 'index')).search('great glayvin')[1] == 1
+
+
+def test_resume():
+    path = tempfile.mkdtemp()
+    crawler(path).crawl(['S05E02'])
+    requests = stub.requests
+    stats = crawler(path).crawl(['S05E02', 'S15E01'])
+    assert stats['episodes'] == 1
+    assert json.load(open(os.path.join(path, CHECKPOINT)))['done'] == ['S05E02', 'S15E01']
+    assert stats['requests'] == stub.requests - requests
+
+
+def test_failed_episode_not_checkpointed():
+    path = tempfile.mkdtemp()
+    stub.fail_next = 100
+    try:
+        stats = Crawler(Morbotron(config=backend.config, transport=HTTPTransport(retries=0)), path, rate=0,
+                        max_gap=500000).crawl(['S05E02'])
+    finally:
+        stub.fail_next = 0
+    assert stats['failed'] == 1
+    assert not os.path.exists(os.path.join(path, CHECKPOINT))
+
+
+class FailingCaptions(HTTPTransport):
+    """
+    Sends caption requests to a server that always fails.
+    """
+    def __init__(self, failing_url):
+        self.failing_url = failing_url
+        return super(FailingCaptions, self).__init__(retries=0)
+
+    def get(self, url):
+        return super(FailingCaptions, self).get(url.replace(stub.url, self.failing_url) if '/api/caption' in url
+                                                else url)
+
+
+def test_failed_captions_fail_the_episode():
+    path = tempfile.mkdtemp()
+    failing = StubServer(error_rate=1).start()
+    try:
+        stats = Crawler(Morbotron(config=backend.config, transport=FailingCaptions(failing.url)), path, rate=0,
+                        max_gap=500000).crawl(['S05E02'])
+    finally:
+        failing.stop()
+    assert stats['failed'] == 1 and stats['subtitles'] == 0
+    assert not os.path.exists(os.path.join(path, CHECKPOINT))
+    assert not glob.glob(os.path.join(path, '*.ndjson.gz'))
+
+
+def test_rate_limit():
+    limiter = RateLimiter(100)
+    start = time.time()
+    for i in range(11):
+        limiter.wait()
+    assert time.time() - start >= 0.1
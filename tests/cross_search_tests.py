@@ -0,0 +1,119 @@
+import nose
+import time
+import asyncio
+from humorbot.bot import *
+from humorbot.aiobot import AsyncHumorbot
+from humorbot.stub import StubServer, synthetic_episodes
+from . import stub_config
+
+
+def setup_module():
+    global morbo_stub
+    global frink_stub
+    global frink_query
+    global config
+    morbo_stub = StubServer().start()
+    episodes = synthetic_episodes(3, length=60000, seed=5)
+    frink_stub = StubServer(episodes).start()
+    frink_query = [s['Content'] for s in episodes['S01E02']['subtitles'] if len(s['Content'].split()) > 3][0]
+    config = stub_config(morbo_stub.url, frink_api_url=frink_stub.url, cross_search=True)
+
+
+def teardown_module():
+    morbo_stub.stop()
+    frink_stub.stop()
+
+
+def test_picks_the_matching_show():
+    hb = Humorbot(config)
+    res = hb.image('someone', frink_query, command='morbo')
+    assert res['attachments'][0]['image_url'].startswith('https://frinkiac.com/meme/S01E02/')
+    assert res['attachments'][0]['title'] == u'@someone: /morbo {}'.format(frink_query)
+    res = hb.image('someone', 'the nobel prize', command='frink')
+    assert res['attachments'][0]['image_url'].startswith('https://morbotron.com/meme/S15E01/')
+
+
+def test_merged_ranking():
+    hb = Humorbot(config)
+    backend, results = hb.search('frink', 'the nobel prize')
+    assert backend is hb.frink
+    assert results
+    assert all(r['Backend'] == 'morbo' for r in results)
+    res = hb.images('someone', 'the nobel prize', command='frink')
+    assert all(a['image_url'].startswith('https://morbotron.com/') for a in res['attachments'][:-1])
+    assert hb.cross_stats['complete'] == 2
+
+
+def test_returns_early_when_confident():
+    frink_stub.latency = 1
+    try:
+        hb = Humorbot(config)
+        start = time.time()
+        backend, results = hb.search('morbo', 'the nobel prize')
+        assert time.time() - start < 0.5
+        assert results[0]['Backend'] == 'morbo'
+        assert hb.cross_stats['early'] == 1
+    finally:
+        frink_stub.latency = 0
+
+
+def test_latency_budget():
+    frink_stub.latency = 1
+    try:
+        hb = Humorbot(stub_config(morbo_stub.url, frink_api_url=frink_stub.url, cross_search=True,
+                                  cross_search_budget=0.1, cross_search_confidence=101))
+        start = time.time()
+        backend, results = hb.search('frink', 'the nobel prize')
+        assert time.time() - start < 0.5
+        assert results[0]['Backend'] == 'morbo'
+        assert hb.cross_stats['budget'] == 1
+    finally:
+        frink_stub.latency = 0
+
+
+def test_budget_covers_the_first_answer():
+    morbo_stub.latency = frink_stub.latency = 1
+    try:
+        hb = Humorbot(stub_config(morbo_stub.url, frink_api_url=frink_stub.url, cross_search=True,
+                                  cross_search_budget=0.1))
+        start = time.time()
+        nose.tools.assert_raises(RequestFailedException, hb.search, 'frink', 'the nobel prize')
+        assert time.time() - start < 0.5
+    finally:
+        morbo_stub.latency = frink_stub.latency = 0
+
+
+def test_async_budget_covers_the_first_answer():
+    morbo_stub.latency = frink_stub.latency = 1
+    loop = asyncio.new_event_loop()
+    try:
+        hb = AsyncHumorbot(stub_config(morbo_stub.url, frink_api_url=frink_stub.url, cross_search=True,
+                                       cross_search_budget=0.1))
+        start = time.time()
+        nose.tools.assert_raises(RequestFailedException, loop.run_until_complete, hb.search('frink', 'the nobel prize'))
+        assert time.time() - start < 0.5
+        loop.run_until_complete(hb.close())
+    finally:
+        loop.close()
+        morbo_stub.latency = frink_stub.latency = 0
+
+
+def test_gif_editor_keeps_the_backend():
+    hb = Humorbot(config)
+    res = hb.gifs('someone', frink_query, command='morbo')
+    assert res['attachments'][0]['image_url'].startswith('https://frinkiac.com/gif/S01E02/')
+    action = [a for a in res['attachments'][0]['actions'] if a['name'] == 'edit'][0]
+    editor = hb.process_action({'actions': [action], 'user': {'name': 'someone'}, 'team': {'domain': 'team'}})
+    assert editor['attachments'][0]['image_url'].startswith('https://frinkiac.com/gif/S01E02/')
+    assert editor['attachments'][1]['thumb_url'].startswith('https://frinkiac.com/img/S01E02/')
+
+
+def test_async_cross_search():
+    loop = asyncio.new_event_loop()
+    try:
+        hb = AsyncHumorbot(config)
+        res = loop.run_until_complete(hb.gif('someone', frink_query, command='morbo'))
+        loop.run_until_complete(hb.close())
+    finally:
+        loop.close()
+    assert res['attachments'][0]['image_url'].startswith('https://frinkiac.com/gif/S01E02/')
@@ -0,0 +1,114 @@
+import nose
+import json
+import time
+import threading
+from humorbot import app
+from humorbot.bot import Humorbot
+from humorbot.dedupe import *
+from humorbot.stub import StubServer
+from . import stub_config, swap_app
+
+
+def setup_module():
+    global stub
+    stub = StubServer().start()
+
+
+def teardown_module():
+    stub.stop()
+
+
+def test_retry_replays_response():
+    dedupe = Deduplicator()
+    calls = []
+    assert dedupe.do('key', lambda: calls.append(1) or len(calls)) == 1
+    assert dedupe.do('key', lambda: calls.append(1) or len(calls), retry=True) == 1
+    assert dedupe.stats['replayed'] == 1
+
+    # A repeat that isn't a retry runs again
+    assert dedupe.do('key', lambda: calls.append(1) or len(calls)) == 2
+
+
+def test_retry_attaches_to_original():
+    dedupe = Deduplicator()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return 'done'
+
+    results = []
+    original = threading.Thread(target=lambda: results.append(dedupe.do('key', slow)))
+    original.start()
+    started.wait()
+    retry = threading.Thread(target=lambda: results.append(dedupe.do('key', slow, retry=True)))
+    retry.start()
+    time.sleep(0.05)
+    release.set()
+    original.join()
+    retry.join()
+    assert results == ['done', 'done']
+    assert len(calls) == 1
+    assert dedupe.stats['attached'] == 1
+
+
+def test_concurrent_originals_all_run():
+    dedupe = Deduplicator()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait()
+        return 'done'
+
+    threads = [threading.Thread(target=dedupe.do, args=('key', slow)) for i in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join()
+    assert len(calls) == 8
+    assert dedupe.stats['attached'] == 0
+    assert dedupe.flights == {}
+
+
+def test_errors_not_cached():
+    dedupe = Deduplicator()
+
+    def fail():
+        raise ValueError()
+    nose.tools.assert_raises(ValueError, dedupe.do, 'key', fail)
+    assert dedupe.do('key', lambda: 'ok', retry=True) == 'ok'
+
+
+def test_keys():
+    data = {'team_id': 'T1', 'channel_id': 'C1', 'user_id': 'U1', 'command': '/morbo', 'text': 'gif foo'}
+    assert command_key(data) == command_key(dict(data))
+    assert command_key(data) != command_key(dict(data, text='gif bar'))
+    assert command_key(dict(data, trigger_id='123.456')) == ('command', '123.456')
+    payload = {'team': {'id': 'T1'}, 'user': {'id': 'U1'}, 'action_ts': '1.2', 'actions': [{'name': 'edit'}]}
+    assert action_key(payload) != action_key(dict(payload, action_ts='1.3'))
+
+
+def test_slack_retry():
+    config = stub_config(stub.url)
+    old = swap_app(config=config, hb=Humorbot(config), dedupe=Deduplicator())
+    try:
+        client = app.app.test_client()
+        data = {'token': config.morbo_token, 'command': '/morbo', 'text': 'gifs do the hustle', 'user_name': 'someone',
+                'team_domain': 'team', 'trigger_id': '1.2.3'}
+        first = json.loads(client.post('/slack', data=data).data.decode('utf-8'))
+        requests = stub.requests
+        app.hb.morbo.clear_caches()
+        retry = json.loads(client.post('/slack', data=data, headers={'X-Slack-Retry-Num': '1'}).data.decode('utf-8'))
+        assert retry == first
+        assert stub.requests == requests
+        assert app.dedupe.stats['replayed'] == 1
+    finally:
+        swap_app(**old)
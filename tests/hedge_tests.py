@@ -0,0 +1,106 @@
+import nose
+import time
+import threading
+from humorbot.backend import *
+from humorbot.transport import Hedger
+from humorbot.stub import StubServer
+from . import stub_config
+
+
+def setup_module():
+    global stub
+    stub = StubServer(latency=0.005, tail_rate=0.1, tail_latency=0.5, seed=1).start()
+
+
+def teardown_module():
+    stub.stop()
+
+
+def warm(hedger, key='search', elapsed=0.01, count=Hedger.MIN_SAMPLES):
+    for i in range(count):
+        hedger.record(key, elapsed)
+
+
+def test_delay_needs_samples():
+    hedger = Hedger(quantile=0.5, min_delay=0.02)
+    assert hedger.delay('search') is None
+    warm(hedger, elapsed=0.01)
+    assert hedger.delay('search') == 0.02
+    warm(hedger, elapsed=0.1)
+    assert hedger.delay('search') == 0.1
+    assert hedger.delay('caption') is None
+
+
+def test_hedge_wins_over_slow_call():
+    hedger = Hedger(min_delay=0.01, max_ratio=1)
+    warm(hedger)
+    calls = []
+    lock = threading.Lock()
+
+    def func():
+        with lock:
+            calls.append(len(calls))
+            n = calls[-1]
+        time.sleep(0.5 if n == 0 else 0)
+        return n
+
+    start = time.time()
+    assert hedger.do('search', func) == 1
+    assert time.time() - start < 0.3
+    assert hedger.stats['hedged'] == 1
+    assert hedger.stats['hedge_wins'] == 1
+
+
+def test_hedges_are_capped():
+    hedger = Hedger(min_delay=0.005, max_ratio=0.1)
+    warm(hedger, elapsed=0.001, count=hedger.window)
+    for i in range(20):
+        hedger.do('search', lambda: time.sleep(0.05))
+    assert hedger.stats['hedged'] == 2
+    assert hedger.stats['denied'] == 18
+
+
+def test_errors_are_raised():
+    hedger = Hedger(min_delay=0.01, max_ratio=1)
+    warm(hedger)
+
+    def func():
+        time.sleep(0.02)
+        raise RequestFailedException()
+    nose.tools.assert_raises(RequestFailedException, hedger.do, 'search', func)
+
+
+def test_success_beats_error_finishing_together():
+    # The slow call fails just as the hedge succeeds, often landing in the same batch of finished calls
+    for i in range(20):
+        hedger = Hedger(min_delay=0.01, max_ratio=1)
+        warm(hedger)
+        hedge_done = threading.Event()
+        calls = []
+        lock = threading.Lock()
+
+        def func():
+            with lock:
+                calls.append(len(calls))
+                n = calls[-1]
+            if n == 0:
+                hedge_done.wait()
+                raise RequestFailedException()
+            hedge_done.set()
+            return n
+        assert hedger.do('search', func) == 1
+        assert hedger.stats['hedge_wins'] == 1
+
+
+def test_backend_hedges_tail_latency():
+    b = Morbotron(config=stub_config(stub.url, hedge_requests=True, hedge_quantile=0.5, hedge_max_ratio=1))
+    url = b.search_url('do the hustle')
+    times = []
+    for i in range(60):
+        start = time.time()
+        assert b.get(url, 'search')
+        times.append(time.time() - start)
+    assert b.hedger.stats['hedge_wins'] > 0
+    # Only calls where the hedge hits the tail too should be slow
+    assert len([t for t in times[Hedger.MIN_SAMPLES:] if t >= 0.5]) < 4
+    assert any(m[0] == 'humorbot_hedged_requests_total' for m in b.collect())
@@ -0,0 +1,66 @@
+import nose
+import os
+import json
+import gzip
+import tempfile
+from humorbot.backend import *
+from humorbot.index import *
+from humorbot.stub import StubServer, DEFAULT_EPISODES
+from . import stub_config
+
+
+def setup_module():
+    global stub
+    global path
+    stub = StubServer().start()
+    tmp = tempfile.mkdtemp()
+    source = os.path.join(tmp, 'subtitles.ndjson.gz')
+    with gzip.open(source, 'wb') as f:
+        for episode, data in DEFAULT_EPISODES.items():
+            f.write(json.dumps({'Subtitles': [dict(s, Episode=episode) for s in data['subtitles']]}).encode('utf-8'))
+            f.write(b'\n')
+        f.write(b'not json\n')
+    path = os.path.join(tmp, 'index')
+    assert build_index(read_records([source]), path) == 5
+
+
+def teardown_module():
+    stub.stop()
+
+
+def test_search_index():
+    index = SubtitleIndex(path)
+    assert len(index) == 5
+    res, confidence = index.search('Do the hustle!')
+    assert confidence == 1
+    assert [(r['Episode'], r['Timestamp']) for r in res] == [('S05E02', 277727), ('S05E02', 280311)]
+    res, confidence = index.search('hustle the')
+    assert confidence == 0.5
+    assert index.search('nobody said this') == ([], 0)
+    assert index.search('') == ([], 0)
+    index.close()
+
+
+def test_search_ranking():
+    # The API puts the frames of '♪ Do the Hustle... ♪' first for this (see bot_tests), ahead of the earlier
+    # subtitle that only mentions the hustle and the later one that repeats it
+    index = SubtitleIndex(path)
+    res, confidence = index.search('the hustle')
+    assert [r['Timestamp'] for r in res] == [277727, 275224, 280311]
+    res, confidence = index.search('hustle the')
+    assert [r['Timestamp'] for r in res] == [277727, 275224, 280311]
+    index.close()
+
+
+def test_backend_index_mode():
+    backend = Morbotron(config=stub_config(stub.url, search_mode='index', morbo_search_index=path))
+    requests = stub.requests
+    res = backend.search('great glayvin')
+    assert res[0]['Episode'] == 'S15E01'
+    assert stub.requests == requests
+    assert backend.search_stats == {'index': 1, 'fallback': 0}
+
+    # Nothing in the index has these words in this order, so ask the API
+    assert backend.search('hustle the do') == []
+    assert stub.requests == requests + 1
+    assert backend.search_stats['fallback'] == 1
@@ -0,0 +1,72 @@
+import nose
+import time
+import json
+import threading
+from humorbot import app
+from humorbot.bot import *
+from humorbot.jobs import *
+from humorbot.stub import StubServer
+from . import stub_config, swap_app
+
+
+def setup_module():
+    global stub
+    stub = StubServer().start()
+
+
+def teardown_module():
+    stub.stop()
+
+
+def wait_for_posts(n, timeout=5):
+    end = time.time() + timeout
+    while len(stub.posts) < n and time.time() < end:
+        time.sleep(0.01)
+    return stub.posts[:n]
+
+
+def test_job_posts_result():
+    del stub.posts[:]
+    jobs = JobQueue(workers=2)
+    assert jobs.submit(lambda x: {'text': x}, stub.url + '/response', 'hello')
+    assert jobs.submit(lambda: 1 / 0, stub.url + '/response')
+    jobs.join()
+    posts = wait_for_posts(2)
+    assert ('/response', {'text': 'hello'}) in posts
+    assert ('/response', ERROR_RESPONSE) in posts
+    assert jobs.stats['completed'] == 1
+    assert jobs.stats['failed'] == 1
+
+
+def test_queue_depth_and_deadline():
+    del stub.posts[:]
+    jobs = JobQueue(workers=1, max_depth=1, deadline=0.05)
+    blocker = threading.Event()
+    assert jobs.submit(blocker.wait, stub.url + '/response')
+    time.sleep(0.05)
+    assert jobs.submit(lambda: {'text': 'late'}, stub.url + '/response')
+    assert not jobs.submit(lambda: {'text': 'rejected'}, stub.url + '/response')
+    assert jobs.depth == 1
+    time.sleep(0.1)
+    blocker.set()
+    jobs.join()
+    assert jobs.stats['rejected'] == 1
+    assert jobs.stats['expired'] == 1
+    assert ('/response', EXPIRED_RESPONSE) in wait_for_posts(2)
+
+
+def test_deferred_slack_command():
+    del stub.posts[:]
+    config = stub_config(stub.url, deferred_responses=True)
+    old = swap_app(config=config, hb=Humorbot(config), jobs=JobQueue())
+    try:
+        client = app.app.test_client()
+        res = client.post('/slack', data={'token': config.morbo_token, 'command': '/morbo', 'text': 'do the hustle',
+                                          'user_name': 'someone', 'team_domain': 'team',
+                                          'response_url': stub.url + '/response'})
+        assert json.loads(res.data.decode('utf-8')) == app.WORKING_RESPONSE
+        path, body = wait_for_posts(1)[0]
+        assert body['response_type'] == 'in_channel'
+        assert body['attachments'][0]['title'] == '@someone: /morbo do the hustle'
+    finally:
+        swap_app(**old)
@@ -0,0 +1,117 @@
+import nose
+import os
+import io
+import time
+import logging
+import tempfile
+import threading
+from humorbot.logs import *
+
+
+class Exploding(object):
+    def __str__(self):
+        raise AssertionError("formatted")
+
+
+def logger(level):
+    res = logging.getLogger('logs_tests')
+    res.propagate = False
+    res.setLevel(level)
+    res.handlers = []
+    return res
+
+
+def test_payload_truncated():
+    assert str(Payload('hello', 10)) == 'hello'
+    assert str(Payload('x' * 25, 10)) == 'x' * 10 + '... (15 more characters)'
+    assert str(Payload('x' * 25, 0)) == 'x' * 25
+
+
+def test_disabled_events_not_formatted():
+    events = EventLog(logger(logging.INFO))
+    events.debug('response', "Returning response", Exploding())
+    assert events.stats == {'logged': 0, 'sampled': 0, 'disabled': 1}
+
+
+def test_event_sampling():
+    log = logger(logging.DEBUG)
+    stream = io.StringIO()
+    log.addHandler(logging.StreamHandler(stream))
+    events = EventLog(log, {'request': 0, 'response': 1}, max_length=5)
+    for i in range(10):
+        events.debug('request', "Got request", {'n': i})
+        events.debug('response', "Returning response", 'abcdefgh')
+    assert events.stats['sampled'] == 10
+    assert events.stats['logged'] == 10
+    assert stream.getvalue().splitlines() == ['Returning response: abcde... (3 more characters)'] * 10
+
+
+def test_background_logging():
+    stream = io.StringIO()
+    writer = BackgroundLogging(stream, max_queued=100, fmt='%(levelname)s %(message)s')
+    log = logger(logging.DEBUG)
+    log.addHandler(writer.handler)
+    assert writer.handler.thread is None
+    EventLog(log).info('request', "Got request", {'text': 'do the hustle'})
+    try:
+        raise ValueError("oops")
+    except ValueError:
+        log.exception("Failed")
+    writer.handler.stop()
+    lines = stream.getvalue().splitlines()
+    assert lines[0] == "INFO Got request: {'text': 'do the hustle'}"
+    assert lines[1] == "ERROR Failed"
+    assert lines[-1] == "ValueError: oops"
+
+
+class BlockedStream(io.StringIO):
+    def __init__(self):
+        self.writing = threading.Event()
+        self.unblock = threading.Event()
+        io.StringIO.__init__(self)
+
+    def write(self, text):
+        self.writing.set()
+        self.unblock.wait()
+        return io.StringIO.write(self, text)
+
+
+def test_background_logging_drops_when_full():
+    stream = BlockedStream()
+    writer = BackgroundLogging(stream, max_queued=2)
+    log = logger(logging.INFO)
+    log.addHandler(writer.handler)
+    log.info("line %s", 0)
+    # Two more fit in the queue while the writer is stuck on the first
+    stream.writing.wait()
+    for i in range(1, 5):
+        log.info("line %s", i)
+    assert writer.handler.dropped == 2
+    assert dict(((m[0], m[4]) for m in writer.collect()))['humorbot_log_dropped_total'] == 2
+    stream.unblock.set()
+    writer.handler.stop()
+    assert stream.getvalue().splitlines() == ['INFO:logs_tests:line 0', 'INFO:logs_tests:line 1',
+                                              'INFO:logs_tests:line 2']
+
+
+def test_background_logging_after_fork():
+    # As with gunicorn --preload, the writer thread is started before the fork but each worker needs its own
+    path = os.path.join(tempfile.mkdtemp(), 'log')
+    with open(path, 'w') as stream:
+        writer = BackgroundLogging(stream, fmt='%(message)s')
+        log = logger(logging.INFO)
+        log.addHandler(writer.handler)
+        log.info("parent")
+        while not os.path.getsize(path):
+            time.sleep(0.01)
+        pid = os.fork()
+        if not pid:
+            try:
+                log.info("child")
+                writer.handler.stop()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        writer.handler.stop()
+    with open(path) as f:
+        assert f.read().splitlines() == ['parent', 'child']
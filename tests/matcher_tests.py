@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import nose
+from fuzzywuzzy import process
+from humorbot.matcher import CaptionMatcher
+
+CHOICES = [
+    [u'♪ Do the Hustle... ♪', u'Hey, hey, hey!', u'Do the hustle!'],
+    [u' PROF. FRINK: Great glayvin in a glass!', u'The Nobel prize.'],
+    [u'Café au lait, é a', u'é a', u'cafe au lait'],
+    [u'Same', u'same!', u'SAME'],
+    [u'One line only'],
+    [u'!!!', u'...', u'Something']
+]
+QUERIES = [u'do the hustle', u'glayvin', u'nobel', u'é a', u'café', u'same', u'', u'!!!', u'hey hey', u'zzz']
+
+
+def test_same_choice_as_extract():
+    matcher = CaptionMatcher()
+    for i in range(2):
+        for choices in CHOICES:
+            for query in QUERIES:
+                assert matcher.best(query, choices) == process.extract(query, choices, limit=1)[0][0]
+
+
+def test_no_choices():
+    assert CaptionMatcher().best(u'do the hustle', []) is None
+
+
+def test_memoised():
+    matcher = CaptionMatcher(max_entries=4)
+    matcher.best(u'hustle', CHOICES[0])
+    assert matcher.stats['misses'] == 3
+    matcher.best(u'hustle', CHOICES[0])
+    assert matcher.stats['hits'] == 3
+    matcher.best(u'glayvin', CHOICES[1])
+    assert len(matcher.scores) <= 4
@@ -0,0 +1,106 @@
+import nose
+import os
+import sys
+import time
+import tempfile
+import subprocess
+from humorbot import app
+from humorbot.bot import *
+from humorbot.metrics import *
+from humorbot.stub import StubServer
+from . import stub_config, swap_app
+
+
+def setup_module():
+    global stub
+    stub = StubServer().start()
+
+
+def teardown_module():
+    stub.stop()
+
+
+def test_render():
+    r = Registry()
+    c = r.counter('test_total', 'A counter')
+    h = r.histogram('test_seconds', 'A histogram', buckets=(0.1, 1))
+    c.inc(backend='morbo')
+    c.inc(2, backend='morbo')
+    h.observe(0.05)
+    h.observe(0.5)
+    h.observe(5)
+    r.register(lambda: [('test_gauge', 'gauge', 'A gauge', {'cache': 'search'}, 7)])
+    text = r.render()
+    assert '# TYPE test_total counter' in text
+    assert 'test_total{backend="morbo"} 3' in text
+    assert 'test_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_seconds_bucket{le="1"} 2' in text
+    assert 'test_seconds_bucket{le="+Inf"} 3' in text
+    assert 'test_seconds_count 3' in text
+    assert 'test_gauge{cache="search"} 7' in text
+
+
+def worker_dump(path, registry, pid):
+    registry.dump(path)
+    os.rename(os.path.join(path, 'metrics-{}.json'.format(os.getpid())),
+              os.path.join(path, 'metrics-{}.json'.format(pid)))
+
+
+def dead_pid():
+    p = subprocess.Popen([sys.executable, '-c', ''])
+    p.wait()
+    return p.pid
+
+
+def test_merge_workers():
+    path = tempfile.mkdtemp()
+    a = Registry()
+    a.counter('test_total', 'A counter').inc(2)
+    a.histogram('test_seconds', 'A histogram', buckets=(1,)).observe(0.5)
+    a.register(lambda: [('test_depth', 'gauge', 'A gauge', {}, 3)])
+    worker_dump(path, a, os.getppid())
+    b = Registry()
+    b.counter('test_total', 'A counter').inc(3)
+    b.histogram('test_seconds', 'A histogram', buckets=(1,)).observe(2)
+    b.register(lambda: [('test_depth', 'gauge', 'A gauge', {}, 4)])
+    text = b.render(path)
+    assert 'test_total 5' in text
+    assert 'test_seconds_bucket{le="1"} 1' in text
+    assert 'test_seconds_count 2' in text
+    assert 'test_depth{{worker="{}"}} 3'.format(os.getppid()) in text
+    assert 'test_depth{{worker="{}"}} 4'.format(os.getpid()) in text
+
+
+def test_merge_skips_dead_and_stale_workers():
+    path = tempfile.mkdtemp()
+    dead = Registry()
+    dead.counter('test_total', 'A counter').inc(100)
+    pid = dead_pid()
+    worker_dump(path, dead, pid)
+    stale = Registry()
+    stale.counter('test_total', 'A counter').inc(10)
+    worker_dump(path, stale, os.getppid())
+    old = time.time() - 60
+    os.utime(os.path.join(path, 'metrics-{}.json'.format(os.getppid())), (old, old))
+    live = Registry()
+    live.counter('test_total', 'A counter').inc(1)
+    assert 'test_total 1\n' in live.render(path, interval=10)
+    assert not os.path.exists(os.path.join(path, 'metrics-{}.json'.format(pid)))
+    assert os.path.exists(os.path.join(path, 'metrics-{}.json'.format(os.getppid())))
+
+
+def test_metrics_endpoint():
+    config = stub_config(stub.url)
+    old = swap_app(config=config, hb=Humorbot(config))
+    try:
+        client = app.app.test_client()
+        client.post('/slack', data={'token': config.morbo_token, 'command': '/morbo', 'text': 'gifs do the hustle',
+                                    'user_name': 'someone', 'team_domain': 'team'})
+        text = client.get('/metrics').data.decode('utf-8')
+    finally:
+        swap_app(**old)
+    assert 'humorbot_backend_request_seconds_count{backend="morbo",endpoint="search"}' in text
+    assert 'humorbot_action_seconds_count{action="gifs"}' in text
+    assert 'humorbot_http_request_seconds_count{endpoint="slack",status="200"}' in text
+    assert 'humorbot_cache_events_total{backend="morbo",cache="search",event="misses",tier="memory"}' in text
+    assert 'humorbot_cache_lookup_seconds_total{backend="morbo",cache="search",tier="memory"}' in text
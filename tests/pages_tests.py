@@ -0,0 +1,69 @@
+import nose
+import gzip
+from humorbot import app
+from humorbot.backend import default_config
+from . import swap_app
+
+
+def setup_module():
+    global old
+    old = swap_app(config=default_config())
+
+
+def teardown_module():
+    swap_app(**old)
+
+
+def test_pages_cached():
+    client = app.app.test_client()
+    for path in ['/', '/usage', '/privacy', '/favicon.ico']:
+        res = client.get(path)
+        assert res.status_code == 200
+        assert res.headers['ETag']
+        assert 'max-age=86400' in res.headers['Cache-Control']
+        assert client.get(path).headers['ETag'] == res.headers['ETag']
+    assert b'<title>humorbot</title>' in client.get('/').data
+
+
+def test_compressed():
+    client = app.app.test_client()
+    plain = client.get('/usage')
+    res = client.get('/usage', headers={'Accept-Encoding': 'gzip'})
+    assert res.headers['Content-Encoding'] == 'gzip'
+    assert res.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(res.data) == plain.data
+    assert res.headers['ETag'] != plain.headers['ETag']
+
+
+def test_not_modified():
+    client = app.app.test_client()
+    etag = client.get('/privacy').headers['ETag']
+    res = client.get('/privacy', headers={'If-None-Match': etag})
+    assert res.status_code == 304
+    assert not res.data
+    assert client.get('/privacy', headers={'If-None-Match': '"nope"'}).status_code == 200
+    gzipped = client.get('/privacy', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+    assert client.get('/privacy', headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzipped}).status_code == 304
+
+
+def test_index_variants():
+    client = app.app.test_client()
+    assert client.get('/?installed=true').data != client.get('/').data
+    assert client.get('/?installed=whatever').data == client.get('/').data
+
+
+def test_config_change():
+    client = app.app.test_client()
+    before = client.get('/')
+    app.config = default_config()
+    app.config.morbo_client_id = 'abc123'
+    res = client.get('/')
+    assert res.headers['ETag'] != before.headers['ETag']
+    assert b'client_id=abc123' in res.data
+
+    # Reloaded in place
+    app.config.morbo_client_id = 'def456'
+    app.config.page_max_age = 60
+    res = client.get('/')
+    assert b'client_id=def456' in res.data
+    assert res.headers['Cache-Control'] == 'public, max-age=60'
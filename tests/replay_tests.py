@@ -0,0 +1,60 @@
+import nose
+import os
+import json
+import tempfile
+from humorbot import app
+from humorbot.bot import Humorbot
+from humorbot.replay import *
+from humorbot.dedupe import command_key
+from humorbot.stub import StubServer
+from . import stub_config, swap_app
+
+LOG = '''2017-03-01T10:00:00.000000+00:00 app[web.1]: INFO:root:command=morbo, username=alice, team_domain=team, text=do the hustle
+2017-03-01T10:00:00.250000+00:00 app[web.1]: DEBUG:root:Got request: {}
+2017-03-01T10:00:00.500000+00:00 app[web.1]: INFO:root:command=frink, username=bob, team_domain=team, text=gifs glayvin, with commas
+'''
+
+
+def setup_module():
+    global stub
+    global old
+    stub = StubServer().start()
+    config = stub_config(stub.url)
+    old = swap_app(config=config, hb=Humorbot(config))
+
+
+def teardown_module():
+    swap_app(**old)
+    stub.stop()
+
+
+def test_parse_log_lines():
+    path = os.path.join(tempfile.mkdtemp(), 'humorbot.log')
+    with open(path, 'w') as f:
+        f.write(LOG)
+    commands = load(path)
+    assert [(c.command, c.username, c.text, c.action) for c in commands] == [
+        ('morbo', 'alice', 'do the hustle', 'image'), ('frink', 'bob', 'gifs glayvin, with commas', 'gifs')]
+    assert schedule(commands) == [0, 0.5]
+    assert schedule(commands, speed=2) == [0, 0.25]
+    assert schedule(commands, max_rate=True) == [0, 0]
+
+
+def test_parse_jsonl():
+    cmd = parse_line(json.dumps({'command': '/morbo', 'user_name': 'alice', 'team_domain': 'team', 'text': 'gif foo',
+                                 'timestamp': 1488362400.5}))
+    assert (cmd.command, cmd.username, cmd.action, cmd.timestamp) == ('morbo', 'alice', 'gif', 1488362400.5)
+    assert parse_line('{not json') is None
+
+
+def test_replay():
+    commands = [parse_line(line) for line in LOG.splitlines()]
+    commands = [c for c in commands if c is not None] * 5
+    report = Replayer(app.config, workers=4).replay(commands, max_rate=True)
+    assert report['requests'] == 10
+    assert report['total']['errors'] == 0
+    assert sorted(report['actions']) == ['gifs', 'image']
+    assert report['actions']['gifs']['requests'] == 5
+    replayer = Replayer(app.config)
+    assert command_key(replayer.payload(commands[0])) != command_key(replayer.payload(commands[0]))
+    assert stub.requests > 0
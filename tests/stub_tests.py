@@ -0,0 +1,63 @@
+import nose
+import os
+import time
+import tempfile
+from humorbot.backend import *
+from humorbot.transport import HTTPTransport
+from humorbot.stub import StubServer, StubAPI, synthetic_episodes, load_fixtures, record
+from . import stub_config
+
+
+def setup_module():
+    global stub
+    stub = StubServer().start()
+
+
+def teardown_module():
+    stub.stop()
+
+
+def test_synthetic_episodes():
+    episodes = synthetic_episodes(3, length=60000, seed=1)
+    assert episodes == synthetic_episodes(3, length=60000, seed=1)
+    assert len(episodes) == 3
+    api = StubAPI(episodes)
+    sub = episodes['S01E02']['subtitles'][3]
+    res = api.search(sub['Content'])
+    assert res
+    assert all(sub['StartTimestamp'] <= f['Timestamp'] <= sub['EndTimestamp'] for f in res if
+               f['Episode'] == 'S01E02')
+
+
+def test_record_and_load_fixtures():
+    path = os.path.join(tempfile.mkdtemp(), 'fixtures.json')
+    record(stub.url, [('S05E02', 155870), ('S15E01', 437478)], path)
+    episodes = load_fixtures(path)
+    assert sorted(episodes) == ['S05E02', 'S15E01']
+    recorded = StubServer(episodes).start()
+    try:
+        expected = Morbotron(stub_config(stub.url)).captions('S05E02', 155870)
+        assert Morbotron(stub_config(recorded.url)).captions('S05E02', 155870) == expected
+    finally:
+        recorded.stop()
+
+
+def test_injected_latency():
+    slow = StubServer(latency=0.05).start()
+    try:
+        start = time.time()
+        Morbotron(stub_config(slow.url)).search('do the hustle')
+        assert time.time() - start >= 0.05
+    finally:
+        slow.stop()
+
+
+def test_injected_errors():
+    flaky = StubServer(error_rate=1).start()
+    try:
+        b = Morbotron(stub_config(flaky.url), HTTPTransport(retries=0))
+        nose.tools.assert_raises(RequestFailedException, b.search, 'do the hustle')
+        flaky.error_rate = 0
+        assert b.search('do the hustle')
+    finally:
+        flaky.stop()
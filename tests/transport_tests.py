@@ -0,0 +1,87 @@
+import nose
+import time
+import threading
+from humorbot.backend import *
+from humorbot.transport import HTTPTransport, SingleFlight
+from humorbot.stub import StubServer
+from . import stub_config
+
+
+def setup_module():
+    global stub
+    global m
+    stub = StubServer().start()
+    m = Morbotron(stub_config(stub.url), transport=HTTPTransport(retries=2, backoff=0))
+
+
+def teardown_module():
+    stub.stop()
+
+
+def test_api_url():
+    assert m.api_base == stub.url
+    assert m.image_url('S09E06', 729604) == 'https://morbotron.com/meme/S09E06/729604.jpg'
+
+
+def test_connection_reuse():
+    connections = stub.connections
+    calls = m.transport.stats['calls']
+    for q in ['do the hustle', 'hustle', 'the hustle', 'plays', 'glayvin']:
+        m.search(q)
+    m.captions('S05E02', 278561)
+    m.context_frames('S05E02', 278561)
+    assert stub.connections - connections <= 1
+    assert m.transport.stats['calls'] - calls == 7
+    assert m.transport.stats['total_time'] > 0
+
+
+def test_retry():
+    stub.fail_next = 2
+    assert len(m.context_frames('S05E02', 278000))
+    stub.fail_next = 3
+    try:
+        m.context_frames('S05E02', 277000)
+        assert False
+    except RequestFailedException:
+        pass
+
+
+class SlowTransport(HTTPTransport):
+    def get(self, url):
+        time.sleep(0.1)
+        return super(SlowTransport, self).get(url)
+
+
+def test_single_flight():
+    slow = Morbotron(stub_config(stub.url), transport=SlowTransport())
+    requests = stub.requests
+    threads = [threading.Thread(target=slow.context_frames, args=('S05E02', 276000)) for i in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert stub.requests - requests == 1
+    assert slow.flights.stats['coalesced'] == 9
+    assert slow.flights.flights == {}
+
+
+def test_single_flight_error():
+    flights = SingleFlight()
+    errors = []
+
+    def fail():
+        time.sleep(0.1)
+        raise RequestFailedException()
+
+    def call():
+        try:
+            flights.do('x', fail)
+        except RequestFailedException as e:
+            errors.append(e)
+    threads = [threading.Thread(target=call) for i in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(errors) == 5
+    assert flights.stats == {'calls': 1, 'coalesced': 4}